@@ -1,17 +1,26 @@
 from flocker.node import BackendDescription, DeployerType
+from .azure_storage_async_driver import (
+    azure_async_driver_from_configuration
+)
 from .azure_storage_driver import (
     azure_driver_from_configuration
 )
 
 
-def api_factory(**kwargs):
+def api_factory(reactor, **kwargs):
+    """
+    Create the driver from the dataset settings of the agent configuration.
+    :param IReactorTime reactor: The reactor of the agent, given by flocker
+        as the backend needs one.
+    :returns: The blocking ``AzureStorageBlockDeviceAPI`` flocker runs in
+        its thread pool, or an ``AzureStorageBlockDeviceAsyncAPI`` if
+        ``async_api`` is true.
+    """
+    config = dict(kwargs)
+    if config.pop('async_api', False):
+        return azure_async_driver_from_configuration(reactor, config)
 
-    return azure_driver_from_configuration(
-        service_name=kwargs[u"service_name"],
-        subscription_id=kwargs[u"subscription_id"],
-        storage_account_name=kwargs[u"storage_account_name"],
-        certificate_data_path=kwargs[u"./azure-cert.pem"],
-        debug=kwargs[u"debug"])
+    return azure_driver_from_configuration(config)
 
 FLOCKER_BACKEND = BackendDescription(
     name=u"azure_flocker_driver",
@@ -0,0 +1,150 @@
+"""
+Eliot action and message types of the driver.
+"""
+
+from functools import wraps
+
+from eliot import ActionType, Field, MessageType
+
+OPERATION = Field.for_types(
+    u'operation', [unicode, bytes],
+    u'The volume operation, like attach or destroy.')
+
+BLOCKDEVICE_ID = Field.for_types(
+    u'blockdevice_id', [unicode, bytes, None],
+    u'The identifier of the volume.')
+
+ROLE = Field.for_types(
+    u'role', [unicode, bytes, None],
+    u'The name of the role the volume is attached to.')
+
+LUN = Field.for_types(
+    u'lun', [int, None],
+    u'The LUN of the volume on its role.')
+
+REQUEST_ID = Field.for_types(
+    u'request_id', [unicode, bytes],
+    u'The id of an asynchronous Azure operation.')
+
+STATUS = Field.for_types(
+    u'status', [unicode, bytes],
+    u'The final status of an asynchronous Azure operation.')
+
+ERROR_CODE = Field.for_types(
+    u'error_code', [unicode, bytes, None],
+    u'The code of the error an Azure operation failed with.')
+
+ERROR_MESSAGE = Field.for_types(
+    u'error_message', [unicode, bytes, None],
+    u'The message of the error an Azure operation failed with.')
+
+WAIT = Field.for_types(
+    u'wait', [unicode, bytes],
+    u'What is being waited for.')
+
+POLLS = Field.for_types(
+    u'polls', [int],
+    u'The number of times the condition of a wait was checked.')
+
+DURATION = Field.for_types(
+    u'duration', [float],
+    u'Elapsed seconds.')
+
+ENDPOINT = Field.for_types(
+    u'endpoint', [unicode, bytes],
+    u'The Azure SDK client and method called.')
+
+ADDED = Field.for_types(
+    u'added', [list],
+    u'The identifiers of the volumes which appeared.')
+
+REMOVED = Field.for_types(
+    u'removed', [list],
+    u'The identifiers of the volumes which disappeared.')
+
+REATTACHED = Field.for_types(
+    u'reattached', [list],
+    u'The identifiers of the volumes attached to another role, or none.')
+
+REASON = Field.for_types(
+    u'reason', [unicode, bytes],
+    u'Why the driver fell back to a slower path.')
+
+VOLUME_OPERATION = ActionType(
+    u'azure_flocker_driver:volume_operation',
+    [OPERATION, BLOCKDEVICE_ID, ROLE],
+    [],
+    u'A volume is created, attached, detached or destroyed.')
+
+ASYNC_OPERATION = ActionType(
+    u'azure_flocker_driver:async_operation',
+    [REQUEST_ID],
+    [STATUS, ERROR_CODE, ERROR_MESSAGE],
+    u'Waiting for an asynchronous Azure operation to complete.')
+
+POLL_WAIT = ActionType(
+    u'azure_flocker_driver:wait',
+    [WAIT],
+    [POLLS, DURATION],
+    u'Polling until a condition holds.')
+
+AZURE_CALL = ActionType(
+    u'azure_flocker_driver:call',
+    [ENDPOINT],
+    [],
+    u'A call to the Azure SDK.')
+
+POLLED = MessageType(
+    u'azure_flocker_driver:polled',
+    [WAIT, POLLS],
+    u'A wait checked its condition again, only logged when the number of '
+    u'polls is a power of two.')
+
+LUN_RESERVED = MessageType(
+    u'azure_flocker_driver:lun_reserved',
+    [BLOCKDEVICE_ID, ROLE, LUN],
+    u'A LUN was reserved for a volume being attached.')
+
+FALLBACK = MessageType(
+    u'azure_flocker_driver:fallback',
+    [OPERATION, REASON],
+    u'An optimized path failed and a slower one is used instead.')
+
+VOLUMES_CHANGED = MessageType(
+    u'azure_flocker_driver:volumes_changed',
+    [ADDED, REMOVED, REATTACHED],
+    u'A listing found volumes added, removed or reattached since the '
+    u'previous one.')
+
+
+def operation_fields(result):
+    """
+    :param Operation result: A completed asynchronous Azure operation
+    :returns dict: The success fields of ``ASYNC_OPERATION``.
+    """
+    error = result.error
+    return {
+        'status': result.status,
+        'error_code': getattr(error, 'code', None) or None,
+        'error_message': getattr(error, 'message', None) or None,
+    }
+
+
+def volume_operation(operation, fields):
+    """
+    Log each call of the decorated driver method as a ``VOLUME_OPERATION``
+    action.
+    :param unicode operation: The name of the operation.
+    :param callable fields: Called with the driver and the arguments of
+        the method, positional or keyword, returns the ``blockdevice_id``
+        and ``role`` to log.
+    """
+    def decorator(f):
+        @wraps(f)
+        def logged(self, *args, **kwargs):
+            (blockdevice_id, role) = fields(self, *args, **kwargs)
+            with VOLUME_OPERATION(operation=operation,
+                                  blockdevice_id=blockdevice_id, role=role):
+                return f(self, *args, **kwargs)
+        return logged
+    return decorator
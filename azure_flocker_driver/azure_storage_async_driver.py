@@ -0,0 +1,295 @@
+from eliot._action import currentAction
+from eliot.twisted import DeferredContext
+from twisted.internet.defer import Deferred, inlineCallbacks, maybeDeferred, \
+    returnValue, succeed
+from twisted.internet.threads import deferToThreadPool
+from zope.interface import implementer
+
+from _logging import ASYNC_OPERATION, VOLUME_OPERATION, operation_fields
+from poll import AsynchronousTimeout
+from scheduler import DeferredOperationScheduler
+
+from flocker.node.agents.blockdevice import AlreadyAttachedVolume, \
+    IBlockDeviceAsyncAPI, UnattachedVolume, UnknownVolume
+
+from azure_storage_driver import azure_driver_from_configuration
+
+
+@implementer(IBlockDeviceAsyncAPI)
+class AzureStorageBlockDeviceAsyncAPI(object):
+    """
+    An ``IBlockDeviceAsyncAPI`` on top of ``AzureStorageBlockDeviceAPI``.
+
+    Azure SDK requests run in a thread pool and the waits for Azure to
+    complete an operation are scheduled on the reactor, so no thread is
+    held while an attach or detach is in progress and any number of
+    volume operations can be in flight at once.
+
+    Operations are split into the requests issued by the ``start_*``
+    methods of the driver and the waits for Azure to complete them, which
+    go through the ``poller`` of the driver. As with the blocking driver,
+    the requests mutating the deployment and the waits for Azure to accept
+    them run one at a time, through a ``DeferredOperationScheduler``.
+
+    The eliot action an operation runs in is carried along explicitly:
+    requests run in the thread pool within it, and the ``Deferred``s the
+    operations wait on fire within it, so the Azure calls and polls of an
+    operation are logged under its ``VOLUME_OPERATION``.
+    """
+
+    def __init__(self, reactor, api, threadpool=None):
+        """
+        :param IReactorTime reactor: The reactor polls are scheduled with.
+        :param AzureStorageBlockDeviceAPI api: The driver issuing the
+            Azure requests.
+        :param ThreadPool threadpool: The pool Azure requests run in,
+            the reactor's pool by default.
+        """
+        self._reactor = reactor
+        self._api = api
+        if threadpool is None:
+            threadpool = reactor.getThreadPool()
+        self._threadpool = threadpool
+        self._scheduler = DeferredOperationScheduler()
+
+    def _call(self, f, *args, **kwargs):
+        action = currentAction()
+        return _resumed_in(action, deferToThreadPool(
+            self._reactor, self._threadpool, _in_context, action, f,
+            *args, **kwargs))
+
+    def _schedule(self, operation, f, repeat_error):
+        """
+        Run a mutating operation in turn with the other operations on the
+        deployment.
+        :param callable f: A no argument callable returning a ``Deferred``.
+        :param Exception repeat_error: The error an identical operation
+            queued meanwhile raises once this one succeeded.
+        """
+        action = currentAction()
+        return _resumed_in(action, self._scheduler.run(
+            self._api.deployment, operation,
+            lambda: _in_context(action, f), repeat_error))
+
+    def _wait(self, name, check, timeout=None):
+        """
+        Poll ``check`` with the poller of the driver.
+        """
+        return _resumed_in(currentAction(), self._api.poller.wait_deferred(
+            self._reactor, name, check, timeout))
+
+    def _logged(self, action, f, *args, **kwargs):
+        """
+        Call ``f`` in the context of ``action`` and finish ``action`` once
+        the ``Deferred`` it returns fires.
+        :returns: A ``Deferred`` firing with the result of ``f``.
+        """
+        parent = currentAction()
+        with action.context():
+            d = DeferredContext(maybeDeferred(f, *args, **kwargs))
+            d.addActionFinish()
+        return _resumed_in(parent, d.result)
+
+    def allocation_unit(self):
+        return succeed(self._api.allocation_unit())
+
+    def compute_instance_id(self):
+        return succeed(self._api.compute_instance_id())
+
+    def create_volume(self, dataset_id, size):
+        # logged as a volume operation by the driver
+        return self._call(self._api.create_volume, dataset_id, size)
+
+    def create_volume_with_profile(self, dataset_id, size, profile_name):
+        # logged as a volume operation by the driver
+        return self._call(self._api.create_volume_with_profile,
+                          dataset_id, size, profile_name)
+
+    def list_volumes(self):
+        return self._call(self._api.list_volumes)
+
+    def list_volume_changes(self):
+        return self._call(self._api.list_volume_changes)
+
+    def list_volume_profiles(self):
+        return self._call(self._api.list_volume_profiles)
+
+    def get_device_path(self, blockdevice_id):
+        return self._call(self._api.get_device_path, blockdevice_id)
+
+    def destroy_volume(self, blockdevice_id):
+        return self._logged(
+            VOLUME_OPERATION(operation=u'destroy',
+                             blockdevice_id=blockdevice_id, role=None),
+            self._destroy_volume, blockdevice_id)
+
+    @inlineCallbacks
+    def _destroy_volume(self, blockdevice_id):
+        @inlineCallbacks
+        def destroy():
+            request = yield self._call(
+                self._api.start_destroy, blockdevice_id)
+            if request is not None:
+                yield self._wait_for_async(request.request_id)
+            returnValue(request)
+
+        request = yield self._schedule(
+            ('destroy', blockdevice_id), destroy,
+            UnknownVolume(blockdevice_id))
+
+        if request is not None:
+            yield self._wait_for_detach(blockdevice_id)
+
+    def attach_volume(self, blockdevice_id, attach_to):
+        return self._logged(
+            VOLUME_OPERATION(operation=u'attach',
+                             blockdevice_id=blockdevice_id, role=attach_to),
+            self._attach_volume, blockdevice_id, attach_to)
+
+    @inlineCallbacks
+    def _attach_volume(self, blockdevice_id, attach_to):
+        @inlineCallbacks
+        def attach():
+            pending = yield self._call(
+                self._api.start_attach, blockdevice_id, attach_to)
+            try:
+                yield self._wait_for_async(pending.request_id)
+            except Exception:
+                self._api.finish_attach(pending)
+                raise
+            returnValue(pending)
+
+        # only the attach which reserved the LUN releases it, coalesced
+        # ones fail before getting here
+        pending = yield self._schedule(
+            ('attach', blockdevice_id, attach_to), attach,
+            AlreadyAttachedVolume(blockdevice_id))
+
+        try:
+            yield self._wait(
+                'attach',
+                lambda: self._call(self._api.is_attached, blockdevice_id))
+        finally:
+            volume = self._api.finish_attach(pending)
+
+        returnValue(volume)
+
+    def detach_volume(self, blockdevice_id):
+        return self._logged(
+            VOLUME_OPERATION(operation=u'detach',
+                             blockdevice_id=blockdevice_id, role=None),
+            self._detach_volume, blockdevice_id)
+
+    @inlineCallbacks
+    def _detach_volume(self, blockdevice_id):
+        @inlineCallbacks
+        def detach():
+            request = yield self._call(
+                self._api.start_detach, blockdevice_id)
+            yield self._wait_for_async(request.request_id)
+
+        yield self._schedule(('detach', blockdevice_id), detach,
+                             UnattachedVolume(blockdevice_id))
+        yield self._wait_for_detach(blockdevice_id)
+        yield self._call(self._api.finish_detach, blockdevice_id)
+
+    def snapshot_volume(self, blockdevice_id):
+        # logged as a volume operation by the driver
+        return self._call(self._api.snapshot_volume, blockdevice_id)
+
+    def list_snapshots(self, blockdevice_id):
+        return self._call(self._api.list_snapshots, blockdevice_id)
+
+    def delete_snapshot(self, snapshot):
+        return self._call(self._api.delete_snapshot, snapshot)
+
+    def create_volume_from_snapshot(self, dataset_id, snapshot):
+        return self._logged(
+            VOLUME_OPERATION(operation=u'create_from_snapshot',
+                             blockdevice_id=None, role=None),
+            self._create_volume_from_snapshot, dataset_id, snapshot)
+
+    @inlineCallbacks
+    def _create_volume_from_snapshot(self, dataset_id, snapshot):
+        pending = yield self._call(
+            self._api.start_copy, dataset_id, snapshot)
+
+        try:
+            properties = yield self._wait(
+                'copy', lambda: self._call(self._api.copy_status, pending),
+                self._api.copy_timeout)
+        except AsynchronousTimeout:
+            yield self._call(self._api.abort_copy, pending)
+            raise
+
+        volume = yield self._call(self._api.finish_copy, pending, properties)
+        returnValue(volume)
+
+    def clone_volume(self, blockdevice_id, dataset_id):
+        return self._logged(
+            VOLUME_OPERATION(operation=u'clone',
+                             blockdevice_id=blockdevice_id, role=None),
+            self._clone_volume, blockdevice_id, dataset_id)
+
+    @inlineCallbacks
+    def _clone_volume(self, blockdevice_id, dataset_id):
+        snapshot = yield self.snapshot_volume(blockdevice_id)
+        try:
+            volume = yield self.create_volume_from_snapshot(
+                dataset_id, snapshot)
+        finally:
+            yield self.delete_snapshot(snapshot)
+        returnValue(volume)
+
+    def _wait_for_detach(self, blockdevice_id):
+        return self._wait(
+            'detach',
+            lambda: self._call(self._api.is_detached, blockdevice_id))
+
+    def _wait_for_async(self, request_id):
+        action = ASYNC_OPERATION(request_id=request_id)
+
+        def wait():
+            d = self._wait(
+                'async',
+                lambda: self._call(self._api.operation_status, request_id))
+            d.addCallback(lambda result: action.add_success_fields(
+                **operation_fields(result)))
+            return d
+
+        return self._logged(action, wait)
+
+
+def _in_context(action, f, *args, **kwargs):
+    """
+    Call ``f`` in the context of ``action``, if there is one.
+    """
+    if action is None:
+        return f(*args, **kwargs)
+    with action.context():
+        return f(*args, **kwargs)
+
+
+def _resumed_in(action, d):
+    """
+    :returns: A ``Deferred`` firing with the result of ``d`` in the
+        context of ``action``, so a generator of ``inlineCallbacks`` waiting
+        on it resumes within that action.
+    """
+    if action is None:
+        return d
+    resumed = Deferred()
+    d.addBoth(lambda result: _in_context(action, resumed.callback, result))
+    return resumed
+
+
+def azure_async_driver_from_configuration(reactor, config):
+    """
+    Returns Flocker Azure IBlockDeviceAsyncAPI from plugin config yml.
+        :param IReactorTime reactor: The reactor to schedule waits with.
+        :param dictonary config: The Dictonary representing
+            the data from the configuration yaml
+    """
+
+    return AzureStorageBlockDeviceAsyncAPI(
+        reactor, azure_driver_from_configuration(config))
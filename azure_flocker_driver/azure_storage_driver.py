@@ -1,31 +1,71 @@
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 import time
-from uuid import UUID
+from uuid import UUID, uuid4
 import socket
 import os
 import sys
+import threading
 
 from bitmath import Byte, GiB
+from azure import WindowsAzureConflictError, WindowsAzureError, \
+    WindowsAzureMissingResourceError
 from azure.servicemanagement import ServiceManagementService
 from azure.storage import BlobService
-from eliot import Message, to_file
-from zope.interface import implementer
-
-from lun import Lun
-from vhd import Vhd
+from eliot import to_file
+from zope.interface import classImplements, implementer
+
+from _logging import ASYNC_OPERATION, FALLBACK, LUN_RESERVED, \
+    VOLUMES_CHANGED, operation_fields, volume_operation
+from batch import BatchExecutor
+from inventory import BlobRecord, DeploymentSnapshot, InventoryCache, \
+    InventoryIndex, VolumeChanges, volume_changes
+from lun import Lun, LunAllocator
+from metrics import CallMetrics, InstrumentedClient
+# AsynchronousTimeout used to be defined here
+from poll import AsynchronousTimeout, Poller  # noqa: F401
+from pool import PoolEntry, WarmPool
+from profiles import PREMIUM, STANDARD, load_profiles, premium_size
+from scheduler import OperationScheduler
+from scsi import ScsiDevices, UnknownScsiDevice
+from shards import Placement, Shard
+from shared import SharedInventory
+from vhd import FOOTER_SIZE, Vhd
 
 from flocker.node.agents.blockdevice import AlreadyAttachedVolume, \
     IBlockDeviceAPI, BlockDeviceVolume, UnknownVolume, UnattachedVolume
 
+try:
+    from flocker.node.agents.blockdevice import IProfiledBlockDeviceAPI
+except ImportError:
+    # flocker releases without volume profiles
+    IProfiledBlockDeviceAPI = None
+
+# the blob metadata holding the profile of a volume
+PROFILE_METADATA = 'flocker_profile'
+# the blob metadata a volume is listed from by ``metadata_listing``
+DATASET_METADATA = 'flocker_dataset_id'
+SIZE_METADATA = 'flocker_size'
+# the role the volume was last attached to
+ATTACHED_METADATA = 'flocker_attached_to'
+
+# in the message of the conflict Azure raises while another operation holds
+# the deployment, the only conflict which goes away by retrying
+DEPLOYMENT_BUSY = 'currently performing an operation'
+
 
-# Logging Helpers
-def log_info(message):
+# the blockdevice_id and role ``volume_operation`` logs for each operation
 
-    Message.new(Info=message).write()
+def _dataset_fields(api, dataset_id, *args, **kwargs):
+    return (unicode(api._disk_label_for_dataset_id(dataset_id)), None)
 
 
-def log_error(message):
+def _volume_fields(api, blockdevice_id, *args, **kwargs):
+    return (blockdevice_id, None)
 
-    Message.new(Error=message).write()
+
+def _attach_fields(api, blockdevice_id, attach_to):
+    return (blockdevice_id, attach_to)
 
 
 class UnsupportedVolumeSize(Exception):
@@ -45,10 +85,33 @@ class UnsupportedVolumeSize(Exception):
         self.dataset_id = dataset_id
 
 
-class AsynchronousTimeout(Exception):
+class SnapshotCopyFailed(Exception):
+    """
+    The server side copy of a snapshot to a new volume did not succeed.
+    :param unicode blockdevice_id: The identifier of the new volume
+    :param str status: The final copy status, ``failed`` or ``aborted``
+    :param str description: Why Azure failed the copy, if known
+    """
+
+    def __init__(self, blockdevice_id, status, description):
+        Exception.__init__(self, blockdevice_id, status, description)
+        self.blockdevice_id = blockdevice_id
+        self.status = status
+        self.description = description
 
-    def __init__(self):
-        pass
+
+# A read-only point in time copy of a volume, kept by Azure alongside the
+# page blob of the volume and identified by its timestamp.
+VolumeSnapshot = namedtuple('VolumeSnapshot', ['blockdevice_id', 'snapshot'])
+
+# An attach issued by ``start_attach``: the asynchronous Azure request to
+# wait for, the volume, the role it is attached to and its size in bytes.
+PendingAttach = namedtuple(
+    'PendingAttach', ['request_id', 'blockdevice_id', 'attach_to', 'size'])
+
+# A server side copy issued by ``start_copy``: the ``Shard`` and label of
+# the new volume and the id of the copy.
+PendingCopy = namedtuple('PendingCopy', ['shard', 'label', 'copy_id'])
 
 
 @implementer(IBlockDeviceAPI)
@@ -58,29 +121,182 @@ class AzureStorageBlockDeviceAPI(object):
     Current Support: Azure SMS API
     """
 
-    def __init__(self, **azure_config):
+    def __init__(self, service_client=None, storage_client=None,
+                 storage_clients=None, **azure_config):
         """
-        :param ServiceManagement azure_client: an instance of the azure
-        serivce managment api client.
+        :param ServiceManagementService service_client: The service
+            management client to use instead of one created from the
+            ``subscription_id`` and ``management_certificate_path``.
+        :param BlobService storage_client: The blob client to use instead
+            of one created from the ``storage_account_name`` and
+            ``storage_account_key``.
+        :param dict storage_clients: The blob clients to use for the
+            accounts of ``storage_accounts``, by account name.
+        :param list storage_accounts: The ``storage_account_name``,
+            ``storage_account_key`` and ``disk_container_name`` of each
+            storage account volumes are spread over, instead of the single
+            account of the top level settings.
+        :param str placement_policy: How the account of a new volume is
+            chosen, see ``Placement``.
+        :param str storage_account_tier: ``premium`` for a premium storage
+            account, ``standard`` by default.
+        :param dict profiles: Performance profiles added to the default
+            ones, see ``load_profiles``.
+        :param unicode default_profile: The profile of the volumes created
+            without one, ``default`` by default.
+        :param bool metadata_listing: Whether volumes are listed from the
+            metadata of their blobs, see ``list_volumes``.
+        :param bool change_detection: Whether ``list_volumes`` returns its
+            previous result while the inventory is unchanged.
+        :param bool shared_inventory: Whether the nodes list volumes from
+            the inventory published by a leader, see ``SharedInventory``.
+        :param float shared_inventory_interval: Seconds between two polls
+            of the leader.
+        :param float shared_inventory_max_age: Seconds after which the
+            published inventory is ignored and volumes are listed directly.
         :param String service_name: The name of the cloud service
         :param
             names of Azure volumes to identify cluster
         :returns: A ``BlockDeviceVolume``.
         """
         self._instance_id = self.compute_instance_id()
-        self._azure_service_client = ServiceManagementService(
-            azure_config['subscription_id'],
-            azure_config['management_certificate_path'])
+        self._metrics = CallMetrics()
+        if service_client is None:
+            service_client = ServiceManagementService(
+                azure_config['subscription_id'],
+                azure_config['management_certificate_path'])
+        self._azure_service_client = InstrumentedClient(
+            service_client, 'service', self._metrics)
         self._service_name = azure_config['service_name']
-        self._azure_storage_client = BlobService(
-            azure_config['storage_account_name'],
-            azure_config['storage_account_key'])
-        self._storage_account_name = azure_config['storage_account_name']
-        self._disk_container_name = azure_config['disk_container_name']
+        accounts = azure_config.get('storage_accounts')
+        storage_clients = dict(storage_clients or {})
+        if not accounts:
+            accounts = [azure_config]
+            if storage_client is not None:
+                storage_clients[azure_config['storage_account_name']] = \
+                    storage_client
+        self._shards = []
+        for account in accounts:
+            name = account['storage_account_name']
+            client = storage_clients.get(name)
+            if client is None:
+                client = BlobService(name, account['storage_account_key'])
+            self._shards.append(Shard(
+                name, account['disk_container_name'],
+                InstrumentedClient(client, 'storage', self._metrics),
+                account.get('storage_account_tier', STANDARD)))
+        self._placement = Placement(
+            self._shards,
+            azure_config.get('placement_policy', Placement.HASH))
+        # lists and probes the shards in parallel
+        self._shard_pool = None
+        if len(self._shards) > 1:
+            self._shard_pool = ThreadPool(len(self._shards))
+        self._inventory = InventoryCache(
+            self._load_inventory,
+            float(azure_config.get('inventory_ttl', 5)))
+        self._deployment_snapshot = \
+            azure_config.get('deployment_snapshot', True)
+        self._poller = Poller(
+            timeout=float(azure_config.get('async_timeout', 600)),
+            initial_delay=float(azure_config.get('poll_initial_delay', 0.5)),
+            max_delay=float(azure_config.get('poll_max_delay', 10)),
+            max_rate=azure_config.get('poll_max_rate'))
+        self._lun_allocator = LunAllocator(
+            policy=azure_config.get('lun_policy', LunAllocator.LOWEST_FREE),
+            reservation_ttl=float(azure_config.get('async_timeout', 600)))
+        self._scheduler = OperationScheduler()
+        self._batch = BatchExecutor(
+            self, workers=int(azure_config.get('batch_workers', 8)))
+        # the udev monitor is started by the first wait for a device
+        self._devices = ScsiDevices(host=azure_config.get('scsi_host'))
+        self._device_timeout = float(azure_config.get('device_timeout', 1))
+        self._copy_timeout = float(azure_config.get('copy_timeout', 3600))
+        self._profiles = load_profiles(azure_config.get('profiles'))
+        self._default_profile = unicode(
+            azure_config.get('default_profile', u'default'))
+        if self._default_profile not in self._profiles:
+            raise ValueError(
+                'Unknown default profile: ' + self._default_profile)
+        self._metadata_listing = azure_config.get('metadata_listing', False)
+        self._change_detection = azure_config.get('change_detection', True)
+        # the fingerprint of the inventory and the volumes of the last
+        # listing
+        self._listing_lock = threading.Lock()
+        self._listing = (None, [])
+        self._pool = None
+        if azure_config.get('warm_pool_sizes'):
+            self._pool = WarmPool(
+                kinds=[(shard.name, self._gibytes_to_bytes(size))
+                       for shard in self._shards
+                       for size in azure_config['warm_pool_sizes']],
+                depth=int(azure_config.get('warm_pool_depth', 2)),
+                max_age=float(azure_config.get('warm_pool_max_age', 86400)),
+                provision=self._provision_pool_blob,
+                discard=self._discard_pool_blob,
+                cleanup=self._delete_orphaned_pool_blobs,
+                interval=float(azure_config.get('warm_pool_interval', 60)))
+            self._pool.start()
+        # the fingerprint of the inventory and the volumes of the last poll
+        # of the shared inventory
+        self._polled = (None, [])
+        self._shared = None
+        if azure_config.get('shared_inventory'):
+            self._shared = SharedInventory(
+                self._shards[0], self._instance_id,
+                self._poll_shared_inventory,
+                interval=float(
+                    azure_config.get('shared_inventory_interval', 10)),
+                max_age=float(
+                    azure_config.get('shared_inventory_max_age', 30)))
+            self._shared.start()
 
         if azure_config['debug']:
             to_file(sys.stdout)
 
+    def stats(self):
+        """
+        An in-process snapshot of where the driver spends its time.
+        :returns dict: The ``calls`` made to each Azure endpoint and to the
+            SCSI device wait, the ``polls`` of each kind of wait, the
+            ``inventory`` cache counters, the ``scheduler`` queues, the
+            ``pool`` counters, ``None`` without a warm pool, and the
+            ``shared`` inventory counters, ``None`` without one.
+        """
+        return {
+            'calls': self._metrics.snapshot(),
+            'polls': self._poller.stats(),
+            'inventory': self._inventory.stats(),
+            'scheduler': self._scheduler.stats(),
+            'pool': self._pool.stats() if self._pool is not None else None,
+            'shared':
+                self._shared.stats() if self._shared is not None else None,
+        }
+
+    @property
+    def poller(self):
+        """
+        The ``Poller`` every wait of the driver goes through, so waits run
+        elsewhere, like those of ``AzureStorageBlockDeviceAsyncAPI``, share
+        its rate limit and metrics.
+        """
+        return self._poller
+
+    @property
+    def deployment(self):
+        """
+        The name of the deployment the driver attaches volumes in, which
+        mutating operations are serialized on.
+        """
+        return self._service_name
+
+    @property
+    def copy_timeout(self):
+        """
+        Seconds after which a server side copy is aborted.
+        """
+        return self._copy_timeout
+
     def allocation_unit(self):
         """
         1GiB is the minimum allocation unit for azure disks
@@ -98,30 +314,81 @@ class AzureStorageBlockDeviceAPI(object):
 
         return unicode(socket.gethostname())
 
+    @volume_operation(u'create', _dataset_fields)
     def create_volume(self, dataset_id, size):
         """
-        Create a new volume.
+        Create a new volume with the default profile. The volume has the
+        size requested, whatever the profile.
+        :param UUID dataset_id: The Flocker dataset ID of the dataset on this
+            volume.
+        :param int size: The size of the new volume in bytes.
+        :returns: A ``BlockDeviceVolume``.
+        """
+        return self._create_volume(
+            dataset_id, size, self._default_profile, False)
+
+    @volume_operation(u'create', _dataset_fields)
+    def create_volume_with_profile(self, dataset_id, size, profile_name):
+        """
+        Create a new volume with a performance profile. Premium volumes are
+        placed in a premium storage account and, if their profile has
+        ``tier_rounding``, rounded up to the size of their premium tier.
         :param UUID dataset_id: The Flocker dataset ID of the dataset on this
             volume.
         :param int size: The size of the new volume in bytes.
-        :returns: A ``Deferred`` that fires with a ``BlockDeviceVolume`` when
-            the volume has been created.
+        :param unicode profile_name: The name of the profile, the default
+            profile is used for unknown names.
+        :returns: A ``BlockDeviceVolume``.
         """
+        return self._create_volume(dataset_id, size, profile_name, True)
 
+    def _create_volume(self, dataset_id, size, profile_name, tier_rounding):
+        """
+        :param bool tier_rounding: Whether the size may be rounded up to
+            the premium tier, as the profile asks.
+        """
         size_in_gb = Byte(size).to_GiB().value
 
         if size_in_gb % 1 != 0:
             raise UnsupportedVolumeSize(dataset_id)
 
-        self._create_volume_blob(size, dataset_id)
+        profile = self._profiles.get(profile_name)
+        if profile is None:
+            FALLBACK(operation=u'create',
+                     reason=u'Unknown profile ' + unicode(profile_name)
+                            + u', using ' + self._default_profile).write()
+            profile = self._profiles[self._default_profile]
+
+        shards = [s for s in self._shards if s.tier == profile.tier]
+        if not shards:
+            FALLBACK(operation=u'create',
+                     reason=u'No ' + profile.tier + u' storage account for '
+                            u'profile ' + profile.name).write()
+            shards = self._shards
+        elif tier_rounding and profile.tier == PREMIUM and \
+                profile.tier_rounding:
+            size = premium_size(size)
 
         label = self._disk_label_for_dataset_id(str(dataset_id))
+        shard = self._place(dataset_id, shards)
+        metadata = {
+            PROFILE_METADATA: profile.name,
+            DATASET_METADATA: str(dataset_id),
+            SIZE_METADATA: str(size),
+            ATTACHED_METADATA: '',
+        }
+
+        if not self._copy_pool_blob(shard, label, size, metadata):
+            self._create_volume_blob(size, dataset_id, shard, metadata)
+        self._inventory.invalidate()
+
         return BlockDeviceVolume(
             blockdevice_id=unicode(label),
             size=size,
             attached_to=None,
             dataset_id=self._dataset_id_for_disk_label(label))
 
+    @volume_operation(u'destroy', _volume_fields)
     def destroy_volume(self, blockdevice_id):
         """
         Destroy an existing volume.
@@ -131,7 +398,25 @@ class AzureStorageBlockDeviceAPI(object):
             exist.
         :return: ``None``
         """
-        log_info('Destorying block device: ' + str(blockdevice_id))
+        def destroy():
+            request = self.start_destroy(blockdevice_id)
+            if request is not None:
+                self._wait_for_async(request.request_id)
+            return request
+
+        if self._schedule(('destroy', blockdevice_id), destroy,
+                          UnknownVolume(blockdevice_id)) is not None:
+            self._wait_for_detach(blockdevice_id)
+
+    def start_destroy(self, blockdevice_id):
+        """
+        Issue the requests deleting a volume without waiting for Azure to
+        complete them.
+        :param unicode blockdevice_id: The identifier of the volume
+        :raises UnknownVolume: If the volume does not exist.
+        :returns: The ``AsynchronousOperationResult`` of the deletion, or
+            ``None`` if the volume was deleted synchronously.
+        """
         (target_disk, role_name, lun) = \
             self._get_disk_vmname_lun(blockdevice_id)
 
@@ -141,27 +426,40 @@ class AzureStorageBlockDeviceAPI(object):
 
         request = None
 
+        shard = self._shard_of(target_disk)
+        if not isinstance(target_disk, BlobRecord):
+            # azure does not delete the blob of a disk which has snapshots
+            blob_name = self._blob_name(target_disk)
+            for s in self._iter_snapshots(shard, blob_name):
+                shard.client.delete_blob(
+                    shard.container_name, blob_name, snapshot=s.snapshot)
+
         if lun is not None:
-            request = \
-                self._azure_service_client.delete_data_disk(
+            request = self._retry_conflicts(
+                'delete_data_disk',
+                lambda: self._azure_service_client.delete_data_disk(
                     service_name=self._service_name,
                     deployment_name=self._service_name,
                     role_name=target_disk.attached_to.role_name,
                     lun=lun,
-                    delete_vhd=True)
+                    delete_vhd=True))
         else:
-            if target_disk.__class__.__name__ == 'Blob':
+            if isinstance(target_disk, BlobRecord):
                 # unregistered disk
-                self._azure_storage_client.delete_blob(
-                    self._disk_container_name, target_disk.name)
+                shard.client.delete_blob(
+                    shard.container_name, target_disk.name,
+                    x_ms_delete_snapshots='include')
             else:
-                request = self._azure_service_client.delete_disk(
-                    target_disk.name, True)
+                request = self._retry_conflicts(
+                    'delete_disk',
+                    lambda: self._azure_service_client.delete_disk(
+                        target_disk.name, True))
 
-        if request is not None:
-            self._wait_for_async(request.request_id, 5000)
-            self._wait_for_detach(blockdevice_id)
+        self._inventory.invalidate()
+
+        return request
 
+    @volume_operation(u'attach', _attach_fields)
     def attach_volume(self, blockdevice_id, attach_to):
         """
         Attach ``blockdevice_id`` to ``host``.
@@ -178,28 +476,28 @@ class AzureStorageBlockDeviceAPI(object):
             ``host``.
         """
 
-        (target_disk, role_name, lun) = \
-            self._get_disk_vmname_lun(blockdevice_id)
-
-        if target_disk is None:
-            raise UnknownVolume(blockdevice_id)
-
-        if lun is not None:
-            raise AlreadyAttachedVolume(blockdevice_id)
-
-        log_info('Attempting to attach ' + str(blockdevice_id)
-                 + ' to ' + str(attach_to))
+        # only the attach which reserved the LUN releases it, a repeated
+        # or coalesced one fails while the first may still be waiting on it
+        started = []
 
-        disk_size = self._attach_disk(blockdevice_id, target_disk, attach_to)
+        def attach():
+            pending = self.start_attach(blockdevice_id, attach_to)
+            started.append(pending)
+            self._wait_for_attach(pending)
+            return pending
 
-        self._wait_for_attach(blockdevice_id)
+        try:
+            pending = self._schedule(
+                ('attach', blockdevice_id, attach_to), attach,
+                AlreadyAttachedVolume(blockdevice_id))
+        finally:
+            if started:
+                self._lun_allocator.release(attach_to, blockdevice_id)
 
-        log_info('disk attached')
-
-        return self._blockdevicevolume_from_azure_volume(blockdevice_id,
-                                                         disk_size,
-                                                         attach_to)
+        return self._blockdevicevolume_from_azure_volume(
+            blockdevice_id, pending.size, attach_to)
 
+    @volume_operation(u'detach', _volume_fields)
     def detach_volume(self, blockdevice_id):
         """
         Detach ``blockdevice_id`` from whatever host it is attached to.
@@ -211,7 +509,91 @@ class AzureStorageBlockDeviceAPI(object):
             not attached to anything.
         :returns: ``None``
         """
+        def detach():
+            request = self.start_detach(blockdevice_id)
+            self._wait_for_async(request.request_id)
+
+        self._schedule(('detach', blockdevice_id), detach,
+                       UnattachedVolume(blockdevice_id))
+
+        self._wait_for_detach(blockdevice_id)
+        self.finish_detach(blockdevice_id)
+
+    def attach_volumes(self, blockdevice_ids, attach_to):
+        """
+        Attach several volumes to one node concurrently, for a node taking
+        over many datasets, see ``BatchExecutor``.
+        :param list blockdevice_ids: The identifiers of the volumes
+        :param unicode attach_to: The name of the role to attach to
+        :returns list: For each volume, in order, the ``BlockDeviceVolume``
+            returned by ``attach_volume`` or the exception it raised.
+        """
+        return self._batch.attach_volumes(blockdevice_ids, attach_to)
 
+    def detach_volumes(self, blockdevice_ids):
+        """
+        Detach several volumes concurrently.
+        :param list blockdevice_ids: The identifiers of the volumes
+        :returns list: For each volume, in order, ``None`` or the exception
+            raised by ``detach_volume``.
+        """
+        return self._batch.detach_volumes(blockdevice_ids)
+
+    def destroy_volumes(self, blockdevice_ids):
+        """
+        Destroy several volumes concurrently.
+        :param list blockdevice_ids: The identifiers of the volumes
+        :returns list: For each volume, in order, ``None`` or the exception
+            raised by ``destroy_volume``.
+        """
+        return self._batch.destroy_volumes(blockdevice_ids)
+
+    def start_attach(self, blockdevice_id, attach_to):
+        """
+        Issue the request attaching a volume without waiting for Azure to
+        complete it.
+        :param unicode blockdevice_id: The identifier of the volume
+        :param unicode attach_to: The name of the role to attach to
+        :raises UnknownVolume: If the volume does not exist.
+        :raises AlreadyAttachedVolume: If the volume is attached.
+        :returns PendingAttach: The attach. The LUN chosen for the volume
+            stays reserved until ``finish_attach`` is called.
+        """
+        (target_disk, role_name, lun) = \
+            self._get_disk_vmname_lun(blockdevice_id)
+
+        if target_disk is None:
+            raise UnknownVolume(blockdevice_id)
+
+        if lun is not None:
+            raise AlreadyAttachedVolume(blockdevice_id)
+
+        (request, disk_size) = \
+            self._attach_disk(blockdevice_id, target_disk, attach_to)
+        return PendingAttach(
+            request_id=request.request_id, blockdevice_id=blockdevice_id,
+            attach_to=attach_to, size=disk_size)
+
+    def finish_attach(self, pending):
+        """
+        Release the LUN reserved by ``start_attach``, once the attach
+        completed or failed.
+        :param PendingAttach pending: The attach
+        :returns: The ``BlockDeviceVolume`` the attach results in.
+        """
+        self._lun_allocator.release(pending.attach_to, pending.blockdevice_id)
+        return self._blockdevicevolume_from_azure_volume(
+            pending.blockdevice_id, pending.size, pending.attach_to)
+
+    def start_detach(self, blockdevice_id):
+        """
+        Issue the request detaching a volume without waiting for Azure to
+        complete it.
+        :param unicode blockdevice_id: The identifier of the volume
+        :raises UnknownVolume: If the volume does not exist.
+        :raises UnattachedVolume: If the volume is not attached.
+        :returns: The ``AsynchronousOperationResult`` of the request.
+        """
         (target_disk, role_name, lun) = \
             self._get_disk_vmname_lun(blockdevice_id)
 
@@ -223,15 +605,39 @@ class AzureStorageBlockDeviceAPI(object):
 
         # contrary to function name it doesn't delete by default, just detachs
 
-        request = \
-            self._azure_service_client.delete_data_disk(
+        request = self._retry_conflicts(
+            'delete_data_disk',
+            lambda: self._azure_service_client.delete_data_disk(
                 service_name=self._service_name,
                 deployment_name=self._service_name,
-                role_name=role_name, lun=lun)
+                role_name=role_name, lun=lun))
 
-        self._wait_for_async(request.request_id, 5000)
+        self._inventory.invalidate()
 
-        self._wait_for_detach(blockdevice_id)
+        return request
+
+    def finish_detach(self, blockdevice_id):
+        """
+        Clear the role recorded in the metadata of the blob of a volume,
+        once Azure reports it detached. Azure keeps the blob of a
+        registered disk leased, in which case the record stays, listings
+        reading the attachment from the deployment.
+        :param unicode blockdevice_id: The identifier of the volume
+        """
+        if not self._metadata_listing:
+            return
+
+        target_disk = self._get_disk_vmname_lun(blockdevice_id)[0]
+        if target_disk is None:
+            return
+
+        shard = self._shard_of(target_disk)
+        blob = self._get_shard_blob(shard, self._blob_name(target_disk))
+        if blob is not None and blob.lease_state != 'leased' and \
+                blob.metadata.get(ATTACHED_METADATA):
+            self._stamp_blob(shard, blob.name, blob.metadata,
+                             {ATTACHED_METADATA: ''})
+            self._inventory.invalidate()
 
     def get_device_path(self, blockdevice_id):
         """
@@ -242,7 +648,7 @@ class AzureStorageBlockDeviceAPI(object):
         :raises UnknownVolume: If the supplied ``blockdevice_id`` does not
             exist.
         :raises UnattachedVolume: If the supplied ``blockdevice_id`` is
-            not attached to a host.
+            not attached to a host, or no device of it appears on this one.
         :returns: A ``FilePath`` for the device.
         """
 
@@ -255,47 +661,407 @@ class AzureStorageBlockDeviceAPI(object):
         if lun is None:
             raise UnattachedVolume(blockdevice_id)
 
-        return Lun.get_device_path_for_lun(lun)
+        try:
+            return Lun.get_device_path_for_lun(lun, self._devices)
+        except UnknownScsiDevice:
+            raise UnattachedVolume(blockdevice_id)
 
     def list_volumes(self):
         """
         List all the block devices available via the back end API.
+
+        With ``change_detection`` the volumes are only listed again when
+        the fingerprint of the inventory changed, which takes the blob
+        listing and the deployment but not the registered disks.
+
+        With ``shared_inventory`` the nodes which are not the leader list
+        the volumes published by the leader, unless that inventory is too
+        old or predates the last change made by this node.
+        :returns: A ``list`` of ``BlockDeviceVolume``s.
+        """
+        return self._list_volumes_and_changes()[0]
+
+    def list_volume_changes(self):
+        """
+        List the block devices and report how they changed since the
+        previous listing, to act on the changes only.
+        :returns VolumeChanges: The volumes added, removed and reattached
+            since the previous ``list_volumes`` or ``list_volume_changes``,
+            empty if nothing changed.
+        """
+        return self._list_volumes_and_changes()[1]
+
+    def _list_volumes_and_changes(self):
+        snapshot = self._shared_snapshot()
+        index = self._inventory.get() if snapshot is None else None
+        fingerprint = None
+        with self._listing_lock:
+            if snapshot is not None:
+                fingerprint = ('shared', tuple(snapshot.volumes))
+            elif self._change_detection:
+                fingerprint = index.fingerprint()
+            if fingerprint is not None and fingerprint == self._listing[0]:
+                return list(self._listing[1]), VolumeChanges([], [], [])
+
+            if snapshot is not None:
+                volumes = [self._blockdevicevolume_from_azure_volume(*v)
+                           for v in snapshot.volumes]
+            else:
+                volumes = self._compute_volumes(index)
+            changes = volume_changes(self._listing[1], volumes)
+            self._listing = (fingerprint, volumes)
+
+        if any(changes):
+            VOLUMES_CHANGED(
+                added=[v.blockdevice_id for v in changes.added],
+                removed=[v.blockdevice_id for v in changes.removed],
+                reattached=[v.blockdevice_id
+                            for v in changes.reattached]).write()
+        return list(volumes), changes
+
+    def _shared_snapshot(self):
+        """
+        :returns InventorySnapshot: The inventory published by the leader,
+            or ``None`` if this node is the leader or the volumes are to
+            be listed directly.
+        """
+        if self._shared is None or self._shared.is_leader:
+            return None
+
+        snapshot = self._shared.read()
+        if snapshot is None:
+            FALLBACK(operation=u'list',
+                     reason=u'No recent shared inventory').write()
+            return None
+        # the leader has not seen the last change made by this node yet
+        if snapshot.polled_at < self._inventory.invalidated_at:
+            return None
+        return snapshot
+
+    def _poll_shared_inventory(self):
+        """
+        List the volumes for the shared inventory, from a fresh inventory
+        rather than the cached one.
+        :returns list: The ``blockdevice_id``, size and role of each
+            volume.
+        """
+        index = self._load_inventory()
+        fingerprint = index.fingerprint()
+        if fingerprint != self._polled[0]:
+            self._polled = (fingerprint, self._compute_volumes(index))
+        return [(v.blockdevice_id, v.size, v.attached_to)
+                for v in self._polled[1]]
+
+    def _compute_volumes(self, index):
+        """
+        With ``metadata_listing`` the volumes are rebuilt from the
+        metadata of their blobs, listed by one ``list_blobs`` call per
+        storage account, and the registered disks are only listed to
+        reconcile volumes whose metadata is missing or stale.
+        :param InventoryIndex index: The current inventory
         :returns: A ``list`` of ``BlockDeviceVolume``s.
         """
-        media_url_prefix = 'https://' + self._storage_account_name \
-            + '.blob.core.windows.net/' + self._disk_container_name
-        disks = self._azure_service_client.list_disks()
+        if not self._metadata_listing:
+            return self._list_registered_volumes(index)
+
+        (volumes, stale) = self._list_stamped_volumes(index)
+        if not stale:
+            return volumes
+
+        FALLBACK(operation=u'list',
+                 reason=u'Missing or stale metadata on '
+                        + u', '.join(sorted(b.name for b in stale))).write()
+        volumes = self._list_registered_volumes(index)
+        by_id = dict((v.blockdevice_id, v) for v in volumes)
+        for b in stale:
+            volume = by_id.get(unicode(b.name))
+            # azure holds a lease on the blob of a registered disk, without
+            # which its metadata cannot be updated
+            if volume is not None and b.lease_state != 'leased':
+                self._stamp_blob(b.shard, b.name, b.metadata, {
+                    DATASET_METADATA: str(volume.dataset_id),
+                    SIZE_METADATA: str(volume.size),
+                    ATTACHED_METADATA: volume.attached_to or '',
+                })
+        return volumes
+
+    def _list_registered_volumes(self, index):
+        """
+        :param InventoryIndex index: The current inventory
+        :returns: The ``BlockDeviceVolume``s of the registered disks and of
+            the flocker blobs which are not registered as disks.
+        """
         disk_list = []
-        all_blobs = self._get_flocker_blobs()
-        for d in disks:
+        for d in index.disks.values():
 
-            if media_url_prefix not in d.media_link or \
+            if self._shard_for_media_link(d.media_link) is None or \
                     'flocker-' not in d.label:
                     continue
 
-            role_name = None
-
-            if d.attached_to is not None \
-                    and d.attached_to.role_name is not None:
-
-                    role_name = d.attached_to.role_name
+            # detached disks carry an empty role name
+            role_name = getattr(d.attached_to, 'role_name', None) or None
 
             disk_list.append(self._blockdevicevolume_from_azure_volume(
                 d.label, self._gibytes_to_bytes(d.logical_disk_size_in_gb),
                 role_name))
 
-            if d.label in all_blobs:
-                del all_blobs[d.label]
-
-        for key in all_blobs:
+        for b in index.unregistered_blobs():
             # include unregistered 'disk' blobs
             disk_list.append(self._blockdevicevolume_from_azure_volume(
-                all_blobs[key].name,
-                all_blobs[key].properties.content_length,
-                None))
+                b.name, self._virtual_size(b.content_length), None))
 
         return disk_list
 
+    def _list_stamped_volumes(self, index):
+        """
+        :param InventoryIndex index: The current inventory
+        :returns tuple: The ``BlockDeviceVolume``s of the flocker blobs
+            whose metadata can be trusted, and the ``BlobRecord``s of the
+            others.
+        """
+        volumes = []
+        stale = []
+        for b in index.all_blobs():
+            volume = self._stamped_volume(index, b)
+            if volume is None:
+                stale.append(b)
+                continue
+
+            volumes.append(volume)
+            # the role a volume is attached to only serves as a record,
+            # the deployment is authoritative
+            if (b.metadata.get(ATTACHED_METADATA) or None) != \
+                    volume.attached_to and b.lease_state != 'leased':
+                self._stamp_blob(b.shard, b.name, b.metadata, {
+                    ATTACHED_METADATA: volume.attached_to or ''})
+        return volumes, stale
+
+    def _stamped_volume(self, index, blob):
+        """
+        Rebuild a volume from the metadata of its blob. Its attachment is
+        read from the data disks of the deployment rather than from the
+        metadata or the lease of the blob: azure keeps the blob of a
+        registered disk leased once it is detached, and the metadata of a
+        leased blob cannot be updated.
+        :param InventoryIndex index: The current inventory
+        :param BlobRecord blob: The blob of the volume
+        :returns: A ``BlockDeviceVolume``, or ``None`` if the metadata is
+            missing or stale.
+        """
+        metadata = blob.metadata or {}
+        try:
+            dataset_id = UUID(metadata[DATASET_METADATA])
+            size = int(metadata[SIZE_METADATA])
+        except (KeyError, ValueError):
+            return None
+
+        # copies carry the metadata of the volume they were copied from
+        # until they are stamped with their own
+        if blob.name != self._disk_label_for_dataset_id(str(dataset_id)):
+            return None
+
+        return self._blockdevicevolume_from_azure_volume(
+            blob.name, size, index.holder(blob.shard.url(blob.name)))
+
+    def list_volume_profiles(self):
+        """
+        The profiles recorded for the volumes ``list_volumes`` reports,
+        the volumes and their blobs being read from one inventory.
+        :returns dict: The name of the profile of each volume by
+            ``blockdevice_id``, ``None`` for volumes created without one.
+        """
+        index = self._inventory.get()
+        blobs = dict((b.name, b) for b in index.all_blobs())
+        profiles = {}
+        for volume in self._compute_volumes(index):
+            record = blobs.get(str(volume.blockdevice_id))
+            profiles[volume.blockdevice_id] = \
+                (record.metadata if record is not None else {}).get(
+                    PROFILE_METADATA)
+        return profiles
+
+    @volume_operation(u'snapshot', _volume_fields)
+    def snapshot_volume(self, blockdevice_id):
+        """
+        Take a read-only, point in time snapshot of a volume. Azure keeps
+        the snapshot alongside the page blob of the volume and only stores
+        the pages which change afterwards.
+        :param unicode blockdevice_id: The identifier of the volume
+        :raises UnknownVolume: If the volume does not exist.
+        :returns VolumeSnapshot: The snapshot.
+        """
+        target_disk = self._get_volume(blockdevice_id)
+        shard = self._shard_of(target_disk)
+        result = shard.client.snapshot_blob(
+            shard.container_name, self._blob_name(target_disk))
+
+        return VolumeSnapshot(
+            blockdevice_id=unicode(blockdevice_id),
+            snapshot=result['x-ms-snapshot'])
+
+    def list_snapshots(self, blockdevice_id):
+        """
+        :param unicode blockdevice_id: The identifier of the volume
+        :raises UnknownVolume: If the volume does not exist.
+        :returns list: The ``VolumeSnapshot``s of the volume, oldest first.
+        """
+        target_disk = self._get_volume(blockdevice_id)
+        return list(self._iter_snapshots(
+            self._shard_of(target_disk), self._blob_name(target_disk),
+            unicode(blockdevice_id)))
+
+    def delete_snapshot(self, snapshot):
+        """
+        :param VolumeSnapshot snapshot: The snapshot to delete
+        :raises UnknownVolume: If the volume of the snapshot does not exist.
+        """
+        target_disk = self._get_volume(snapshot.blockdevice_id)
+        shard = self._shard_of(target_disk)
+        shard.client.delete_blob(
+            shard.container_name, self._blob_name(target_disk),
+            snapshot=snapshot.snapshot)
+
+    @volume_operation(u'create_from_snapshot', _dataset_fields)
+    def create_volume_from_snapshot(self, dataset_id, snapshot):
+        """
+        Create a new volume holding the content of a snapshot. Azure copies
+        the pages server side, no data goes through this node, and the
+        volume is returned once the copy completed. The volume is placed
+        in the storage account of the snapshot.
+        :param UUID dataset_id: The Flocker dataset ID of the dataset on
+            the new volume.
+        :param VolumeSnapshot snapshot: The snapshot to copy
+        :raises UnknownVolume: If the volume of the snapshot does not exist.
+        :raises WindowsAzureConflictError: If a volume of the dataset exists
+            already.
+        :raises SnapshotCopyFailed: If Azure failed the copy.
+        :raises AsynchronousTimeout: If the copy did not complete within
+            ``copy_timeout`` seconds, it is aborted.
+        :returns: A ``BlockDeviceVolume``.
+        """
+        pending = self.start_copy(dataset_id, snapshot)
+
+        try:
+            properties = self._poller.wait(
+                'copy', lambda: self.copy_status(pending), self._copy_timeout)
+        except AsynchronousTimeout:
+            self.abort_copy(pending)
+            raise
+
+        return self.finish_copy(pending, properties)
+
+    @volume_operation(u'clone', _volume_fields)
+    def clone_volume(self, blockdevice_id, dataset_id):
+        """
+        Create a new volume holding the current content of a volume, copied
+        server side from a snapshot deleted once the copy completed.
+        :param unicode blockdevice_id: The identifier of the volume to
+            clone.
+        :param UUID dataset_id: The Flocker dataset ID of the dataset on
+            the new volume.
+        :raises UnknownVolume: If the volume does not exist.
+        :returns: A ``BlockDeviceVolume``.
+        """
+        snapshot = self.snapshot_volume(blockdevice_id)
+        try:
+            return self.create_volume_from_snapshot(dataset_id, snapshot)
+        finally:
+            self.delete_snapshot(snapshot)
+
+    def start_copy(self, dataset_id, snapshot):
+        """
+        Issue the server side copy of a snapshot to the page blob of a new
+        volume.
+        :param UUID dataset_id: The Flocker dataset ID of the dataset on
+            the new volume.
+        :param VolumeSnapshot snapshot: The snapshot to copy
+        :raises UnknownVolume: If the volume of the snapshot does not exist.
+        :raises WindowsAzureConflictError: If a volume of the dataset exists
+            already.
+        :returns PendingCopy: The copy.
+        """
+        label = self._disk_label_for_dataset_id(dataset_id)
+        target_disk = self._get_volume(snapshot.blockdevice_id)
+        shard = self._shard_of(target_disk)
+        source = shard.url(self._blob_name(target_disk))
+
+        # a copy replaces whatever blob it targets, Azure refuses it if
+        # the blob of the new volume exists already
+        result = shard.client.copy_blob(
+            shard.container_name, label,
+            source + '?snapshot=' + snapshot.snapshot, if_none_match='*')
+        self._inventory.invalidate()
+
+        return PendingCopy(
+            shard=shard, label=label, copy_id=result['x-ms-copy-id'])
+
+    def copy_status(self, pending):
+        """
+        :param PendingCopy pending: The copy
+        :returns dict: The properties of the blob of the new volume, or
+            ``None`` while the copy is in progress.
+        """
+        return self._copy_completed(pending.shard, pending.label)
+
+    def _copy_completed(self, shard, label):
+        """
+        :returns dict: The properties of the blob of the new volume, or
+            ``None`` while the copy is in progress.
+        """
+        properties = shard.client.get_blob_properties(
+            shard.container_name, label)
+        if properties.get('x-ms-copy-status') == 'pending':
+            return None
+        return properties
+
+    def finish_copy(self, pending, properties):
+        """
+        Check the outcome of a copy and stamp the new volume with a footer
+        of its own, so it is not mistaken for the volume it was copied
+        from.
+        :param PendingCopy pending: The copy
+        :param dict properties: The properties of the blob of the new
+            volume once the copy completed, as returned by ``copy_status``
+        :raises SnapshotCopyFailed: If the copy did not succeed, the blob
+            of the new volume is deleted.
+        :returns: A ``BlockDeviceVolume``.
+        """
+        (shard, label) = (pending.shard, pending.label)
+        status = properties.get('x-ms-copy-status')
+        if status != 'success':
+            shard.client.delete_blob(shard.container_name, label)
+            self._inventory.invalidate()
+            raise SnapshotCopyFailed(
+                unicode(label), status,
+                properties.get('x-ms-copy-status-description'))
+
+        blob_size = int(properties['content-length'])
+        size = self._virtual_size(blob_size)
+        self._write_vhd_footer(shard, label, size, blob_size)
+        # the copy carries the metadata of the volume it was copied from
+        self._stamp_blob(shard, label, self._metadata(properties), {
+            DATASET_METADATA: str(self._dataset_id_for_disk_label(label)),
+            SIZE_METADATA: str(size),
+            ATTACHED_METADATA: '',
+        })
+
+        return self._blockdevicevolume_from_azure_volume(label, size, None)
+
+    def abort_copy(self, pending):
+        """
+        Abort a pending copy and delete the blob it was copying to.
+        :param PendingCopy pending: The copy
+        """
+        shard = pending.shard
+        try:
+            shard.client.abort_copy_blob(
+                shard.container_name, pending.label, pending.copy_id)
+        except WindowsAzureConflictError:
+            # the copy completed meanwhile
+            pass
+        shard.client.delete_blob(shard.container_name, pending.label)
+        self._inventory.invalidate()
+
     def _attach_disk(
             self,
             blockdevice_id,
@@ -305,66 +1071,329 @@ class AzureStorageBlockDeviceAPI(object):
         """
         Attaches disk to specified VM
         :param string blockdevice_id: The identifier of the disk
-        :param DataVirtualHardDisk/Blob target_disk: The Blob
+        :param Disk/BlobRecord target_disk: The Blob
                or Disk to be attached
-        :returns int: The size of the attached disk
+        :returns tuple: The ``AsynchronousOperationResult`` of the
+            request and the size of the attached disk
         """
 
-        lun = Lun.compute_next_lun(
-            self._azure_service_client,
-            self._service_name,
-            str(attach_to))
+        lun = self._lun_allocator.reserve(
+            attach_to, blockdevice_id,
+            self._inventory.get().luns_for_role(attach_to))
+        LUN_RESERVED(blockdevice_id=blockdevice_id, role=attach_to,
+                     lun=lun).write()
         common_params = {
             'service_name': self._service_name,
             'deployment_name': self._service_name,
             'role_name': attach_to,
             'lun': lun
         }
-        disk_size = None
+        blob = self._volume_blob(target_disk)
+        self._stamp_attachment(blob, attach_to)
+        (disk_params, disk_size) = \
+            self._data_disk_params(blockdevice_id, target_disk, blob[2])
+        common_params.update(disk_params)
+
+        try:
+            request = self._retry_conflicts(
+                'add_data_disk',
+                lambda: self._azure_service_client.add_data_disk(
+                    **common_params))
+        except Exception:
+            self._lun_allocator.release(attach_to, blockdevice_id)
+            raise
+        self._inventory.invalidate()
+
+        return request, disk_size
+
+    def _data_disk_params(self, blockdevice_id, target_disk, metadata):
+        """
+        The parameters identifying a volume in an attach request.
+        :param string blockdevice_id: The identifier of the disk
+        :param Disk/BlobRecord target_disk: The Blob
+               or Disk to be attached
+        :param dict metadata: The metadata of the blob of the volume
+        :returns tuple: A ``dict`` of ``DataVirtualHardDisk`` attributes
+            and the size of the disk in bytes.
+        """
+        params = {}
 
-        if target_disk.__class__.__name__ == 'Blob':
+        if isinstance(target_disk, BlobRecord):
             # exclude 512 byte footer
-            disk_size = target_disk.properties.content_length
+            disk_size = self._virtual_size(target_disk.content_length)
 
-            common_params['source_media_link'] = \
-                'https://' + self._storage_account_name \
-                + '.blob.core.windows.net/' + self._disk_container_name \
-                + '/' + blockdevice_id
+            params['source_media_link'] = target_disk.shard.url(
+                target_disk.name)
 
-            common_params['disk_label'] = blockdevice_id
+            params['disk_label'] = blockdevice_id
 
         else:
 
             disk_size = self._gibytes_to_bytes(
                 target_disk.logical_disk_size_in_gb)
 
-            common_params['disk_name'] = target_disk.name
+            params['disk_name'] = target_disk.name
 
-        request = self._azure_service_client.add_data_disk(**common_params)
-        self._wait_for_async(request.request_id, 5000)
+        profile = self._profiles.get(metadata.get(PROFILE_METADATA))
+        if profile is not None and profile.host_caching is not None:
+            params['host_caching'] = profile.host_caching
 
-        return disk_size
+        return params, disk_size
 
-    def _create_volume_blob(self, size, dataset_id):
-        # Create a new page blob as a blank disk
-        self._azure_storage_client.put_blob(
-            container_name=self._disk_container_name,
-            blob_name=self._disk_label_for_dataset_id(dataset_id),
+    def _volume_blob(self, target_disk):
+        """
+        :param Disk/BlobRecord target_disk: The disk or blob of a volume
+        :returns tuple: The ``Shard`` and name of the blob of the volume
+            and its metadata.
+        """
+        if isinstance(target_disk, BlobRecord):
+            return (target_disk.shard, target_disk.name,
+                    target_disk.metadata or {})
+
+        # the metadata of the blob of a registered disk is not part of the
+        # inventory
+        shard = self._shard_of(target_disk)
+        name = self._blob_name(target_disk)
+        record = self._get_shard_blob(shard, name)
+        return shard, name, record.metadata if record is not None else {}
+
+    def _stamp_attachment(self, blob, attach_to):
+        """
+        Record the role a volume is being attached to in the metadata of
+        its blob, while azure does not hold a lease on it yet.
+        :param tuple blob: The shard, name and metadata of the blob as
+            returned by ``_volume_blob``
+        :param unicode attach_to: The name of the role
+        """
+        if self._metadata_listing:
+            (shard, name, metadata) = blob
+            self._stamp_blob(
+                shard, name, metadata, {ATTACHED_METADATA: attach_to})
+
+    def _stamp_blob(self, shard, blob_name, metadata, changes):
+        """
+        Update the metadata of the blob of a volume. A failure only leaves
+        the metadata stale, to be reconciled by the next listing, so it is
+        logged and ignored.
+        :param Shard shard: The shard of the blob
+        :param string blob_name: The name of the blob
+        :param dict metadata: The current metadata of the blob
+        :param dict changes: The metadata to set, by name
+        """
+        metadata = dict(metadata)
+        metadata.update(changes)
+        try:
+            shard.client.set_blob_metadata(
+                shard.container_name, blob_name,
+                x_ms_meta_name_values=metadata)
+        except WindowsAzureError as e:
+            FALLBACK(operation=u'stamp',
+                     reason=u'Could not update the metadata of '
+                            + unicode(blob_name) + u': '
+                            + unicode(e)).write()
+
+    def _create_volume_blob(self, size, dataset_id, shard, metadata=None):
+        self._create_vhd_blob(
+            shard, self._disk_label_for_dataset_id(dataset_id), size,
+            metadata)
+
+    def _create_vhd_blob(self, shard, blob_name, size, metadata=None):
+        # Create a new page blob as a blank disk, a fixed VHD of ``size``
+        # bytes followed by its footer
+        shard.client.put_blob(
+            container_name=shard.container_name,
+            blob_name=blob_name,
             blob=None,
             x_ms_blob_type='PageBlob',
             x_ms_blob_content_type='application/octet-stream',
-            x_ms_blob_content_length=size)
+            x_ms_blob_content_length=size + FOOTER_SIZE,
+            x_ms_meta_name_values=metadata)
 
-        # for disk to be a valid vhd it requires a vhd footer
-        # on the last 512 bytes
-        vhd_footer = Vhd.generate_vhd_footer(size)
+        self._write_vhd_footer(shard, blob_name, size)
 
-        self._azure_storage_client.put_page(
-            container_name=self._disk_container_name,
-            blob_name=self._disk_label_for_dataset_id(dataset_id),
+    def _write_vhd_footer(self, shard, blob_name, size, blob_size=None):
+        """
+        Write the VHD footer describing a disk of ``size`` bytes to the
+        last 512 bytes of its blob.
+        :param int blob_size: The size of the blob in bytes, ``size`` plus
+            the footer by default.
+        """
+        if blob_size is None:
+            blob_size = size + FOOTER_SIZE
+        vhd_footer = Vhd.generate_vhd_footer(
+            size, Vhd.compute_geometry(size))
+
+        shard.client.put_page(
+            container_name=shard.container_name,
+            blob_name=blob_name,
             page=vhd_footer,
             x_ms_page_write='update',
-            x_ms_range='bytes=' + str((size - 512)) + '-' + str(size - 1))
+            x_ms_range='bytes=' + str(blob_size - FOOTER_SIZE) + '-'
+                       + str(blob_size - 1))
+
+    @staticmethod
+    def _virtual_size(blob_size):
+        """
+        :param int blob_size: The size of the page blob of a volume
+        :returns int: The size of the disk it holds, without the footer.
+            Blobs written before the footer was appended to the disk are a
+            whole number of MiB, their footer overlapping the disk.
+        """
+        if blob_size % (1024 * 1024) == FOOTER_SIZE:
+            return blob_size - FOOTER_SIZE
+        return blob_size
+
+    def _place(self, dataset_id, shards=None):
+        """
+        :param UUID dataset_id: The dataset id of a new volume
+        :param list shards: The shards the volume may be placed in, every
+            shard by default.
+        :returns Shard: The shard to create the volume in.
+        """
+        if not self._placement.needs_loads:
+            return self._placement.choose(dataset_id, shards=shards)
+
+        index = self._inventory.get()
+        loads = {}
+        volumes = [(self._shard_for_media_link(d.media_link),
+                    self._gibytes_to_bytes(d.logical_disk_size_in_gb))
+                   for d in index.disks.values()]
+        volumes.extend((b.shard, self._virtual_size(b.content_length))
+                       for b in index.unregistered_blobs())
+        for (shard, size) in volumes:
+            if shard is not None:
+                (count, total) = loads.get(shard.name, (0, 0))
+                loads[shard.name] = (count + 1, total + size)
+
+        return self._placement.choose(dataset_id, loads, shards)
+
+    def _shard_for_media_link(self, media_link):
+        """
+        :param string media_link: The URL of the blob of a disk
+        :returns Shard: The shard of the blob, ``None`` if it is not in one
+            of the shards of the driver.
+        """
+        for shard in self._shards:
+            if shard.owns(media_link):
+                return shard
+        return None
+
+    def _shard_of(self, target_disk):
+        """
+        :param Disk/BlobRecord target_disk: A volume
+        :returns Shard: The shard holding the blob of the volume, ``None``
+            for a disk whose blob is not in one of the shards of the
+            driver.
+        """
+        if isinstance(target_disk, BlobRecord):
+            return target_disk.shard
+        return self._shard_for_media_link(target_disk.media_link)
+
+    def _map_shards(self, f, shards=None):
+        """
+        Call ``f`` with each shard, in parallel when there are several.
+        :param callable f: Called with a ``Shard``.
+        :param list shards: The shards, every shard by default.
+        :returns list: The results of ``f``, in the order of the shards.
+        """
+        if shards is None:
+            shards = self._shards
+        if len(shards) == 1 or self._shard_pool is None:
+            return [f(shard) for shard in shards]
+        return self._shard_pool.map(f, shards)
+
+    @staticmethod
+    def _blob_name(target_disk):
+        """
+        :param Disk/BlobRecord target_disk: A volume
+        :returns string: The name of the page blob of the volume.
+        """
+        if isinstance(target_disk, BlobRecord):
+            return target_disk.name
+        return target_disk.media_link.rsplit('/', 1)[1]
+
+    def _copy_pool_blob(self, shard, label, size, metadata=None):
+        """
+        Create the blob of a new volume as a server side copy of a blob of
+        the warm pool, a single request when Azure completes the copy
+        synchronously.
+        :param Shard shard: The shard of the new volume
+        :param string label: The label of the new volume
+        :param int size: The size of the volume in bytes
+        :param dict metadata: The metadata of the blob of the volume
+        :returns bool: Whether the blob was created, ``False`` if there is
+            no pooled blob of that size or the copy failed.
+        """
+        if self._pool is None:
+            return False
+
+        entry = self._pool.claim((shard.name, size))
+        if entry is None:
+            return False
+
+        try:
+            properties = shard.client.copy_blob(
+                shard.container_name, label, shard.url(entry.name),
+                x_ms_meta_name_values=metadata,
+                x_ms_source_lease_id=entry.lease_id)
+            if properties.get('x-ms-copy-status') == 'pending':
+                properties = self._poller.wait(
+                    'copy', lambda: self._copy_completed(shard, label),
+                    self._copy_timeout)
+            if properties.get('x-ms-copy-status') != 'success':
+                raise SnapshotCopyFailed(
+                    unicode(label), properties.get('x-ms-copy-status'),
+                    properties.get('x-ms-copy-status-description'))
+        except (WindowsAzureError, AsynchronousTimeout,
+                SnapshotCopyFailed) as e:
+            FALLBACK(operation=u'create',
+                     reason=u'Copy from the warm pool failed: '
+                            + repr(e)).write()
+            return False
+        finally:
+            self._pool.retire(entry)
+
+        return True
+
+    def _pool_prefix(self):
+        # not matched by the 'flocker-' prefix of volume blobs
+        return 'flockerpool-' + self._instance_id + '-'
+
+    def _provision_pool_blob(self, kind):
+        """
+        Create a blob for the warm pool and lease it, so it is not
+        mistaken for a blob left behind by an earlier pool.
+        :param tuple kind: The name of the shard of the blob and its size
+            in bytes
+        :returns PoolEntry: The pooled blob.
+        """
+        (shard_name, size) = kind
+        [shard] = [s for s in self._shards if s.name == shard_name]
+        name = self._pool_prefix() + str(uuid4())
+        self._create_vhd_blob(shard, name, size)
+        lease = shard.client.lease_blob(
+            shard.container_name, name, 'acquire', x_ms_lease_duration=-1)
+
+        return PoolEntry(name=name, kind=kind,
+                         lease_id=lease['x-ms-lease-id'], created=time.time())
+
+    def _discard_pool_blob(self, entry):
+        [shard] = [s for s in self._shards if s.name == entry.kind[0]]
+        shard.client.delete_blob(
+            shard.container_name, entry.name, x_ms_lease_id=entry.lease_id)
+
+    def _delete_orphaned_pool_blobs(self):
+        """
+        Delete the pooled blobs of this node left behind by an earlier
+        process, breaking the leases it held on them.
+        """
+        for shard in self._shards:
+            for b in self._iter_blobs(shard, self._pool_prefix()):
+                if b.properties.lease_state == 'leased':
+                    shard.client.lease_blob(
+                        shard.container_name, b.name, 'break',
+                        x_ms_lease_break_period=0)
+                shard.client.delete_blob(shard.container_name, b.name)
 
     def _disk_label_for_dataset_id(self, dataset_id):
         """
@@ -385,110 +1414,316 @@ class AzureStorageBlockDeviceAPI(object):
         """
         return UUID(disk_label.replace('flocker-', ''))
 
-    def _get_disk_vmname_lun(self, blockdevice_id):
-        target_disk = None
-        target_lun = None
-        role_name = None
-        disk_list = self._azure_service_client.list_disks()
+    def _load_inventory(self):
+        """
+        Fetch the disks registered with the subscription and the flocker
+        blobs in the disk container.
+        :returns InventoryIndex: An index over the fetched inventory.
+        """
+        role_loader = self._get_role_data_disks
+        deployment = DeploymentSnapshot(self._get_deployment)
 
-        for d in disk_list:
+        if self._deployment_snapshot:
+            role_loader = deployment.data_disks
 
-            if 'flocker-' not in d.label:
-                continue
-            if d.label == str(blockdevice_id):
-                target_disk = d
-                break
+        return InventoryIndex(
+            self._azure_service_client.list_disks,
+            self._iter_flocker_blobs,
+            self._get_flocker_blob,
+            role_loader,
+            deployment)
 
+    def _get_disk_vmname_lun(self, blockdevice_id):
+        (target_disk, role_name, lun) = \
+            self._inventory.get().lookup(blockdevice_id)
+        # like list_volumes, ignore the disks whose blob is outside the
+        # configured shards, which the driver has no client for
+        if target_disk is not None and self._shard_of(target_disk) is None:
+            return None, None, None
+        return target_disk, role_name, lun
+
+    def _get_volume(self, blockdevice_id):
+        """
+        :param unicode blockdevice_id: The identifier of the volume
+        :raises UnknownVolume: If the volume does not exist.
+        :returns: The ``Disk`` or ``BlobRecord`` of the volume.
+        """
+        target_disk = self._get_disk_vmname_lun(blockdevice_id)[0]
         if target_disk is None:
-            # check for unregisterd disk
-            blobs = self._get_flocker_blobs()
-            blob = None
+            raise UnknownVolume(blockdevice_id)
+        return target_disk
 
-            if str(blockdevice_id) in blobs:
-                blob = blobs[str(blockdevice_id)]
+    def _get_deployment(self):
+        return self._azure_service_client.get_deployment_by_name(
+            self._service_name, self._service_name)
 
-            return blob, None, None
+    def _get_role_data_disks(self, role_name):
+        vm_info = self._azure_service_client.get_role(
+            self._service_name, self._service_name, role_name)
 
-        vm_info = None
+        return vm_info.data_virtual_hard_disks
 
-        if hasattr(target_disk.attached_to, 'role_name'):
-            vm_info = self._azure_service_client.get_role(
-                self._service_name, self._service_name,
-                target_disk.attached_to.role_name)
+    def _iter_flocker_blobs(self):
+        """
+        Enumerate the flocker blobs of every shard one listing page at a
+        time, so no shard is held in memory whole. With several shards the
+        next page of each is fetched in parallel.
+        :returns: A generator of ``BlobRecord``s.
+        """
+        def records(shard):
+            for page in self._iter_blob_pages(shard, 'flocker-', 'metadata'):
+                yield [BlobRecord(
+                    name=b.name,
+                    content_length=b.properties.content_length,
+                    etag=b.properties.etag,
+                    lease_state=b.properties.lease_state,
+                    shard=shard,
+                    metadata=b.metadata)
+                    for b in page]
+
+        shard_pages = [records(shard) for shard in self._shards]
+
+        if len(shard_pages) == 1 or self._shard_pool is None:
+            for pages in shard_pages:
+                for page in pages:
+                    for r in page:
+                        yield r
+            return
+
+        while shard_pages:
+            fetches = [(pages, self._shard_pool.apply_async(next, (pages,)))
+                       for pages in shard_pages]
+            shard_pages = []
+            for (pages, fetch) in fetches:
+                try:
+                    page = fetch.get()
+                except StopIteration:
+                    continue
+                shard_pages.append(pages)
+                for r in page:
+                    yield r
 
-            for d in vm_info.data_virtual_hard_disks:
-                if d.disk_name == target_disk.name:
-                    target_lun = d.lun
-                    break
+    def _iter_snapshots(self, shard, blob_name, blockdevice_id=None):
+        """
+        :param Shard shard: The shard of the volume
+        :param string blob_name: The name of the page blob of a volume
+        :param unicode blockdevice_id: The identifier of the volume,
+            ``blob_name`` by default.
+        :returns: A generator of the ``VolumeSnapshot``s of the volume.
+        """
+        if blockdevice_id is None:
+            blockdevice_id = unicode(blob_name)
 
-            role_name = target_disk.attached_to.role_name
+        for b in self._iter_blobs(shard, blob_name, include='snapshots'):
+            if b.name == blob_name and b.snapshot:
+                yield VolumeSnapshot(
+                    blockdevice_id=blockdevice_id, snapshot=b.snapshot)
 
-        return (target_disk, role_name, target_lun)
+    def _iter_blobs(self, shard, prefix, include=None):
+        """
+        Enumerate the blobs of the container of a shard.
+        :param Shard shard: The shard
+        :param string prefix: The prefix of the blob names
+        :param string include: The datasets to include, like ``snapshots``
+        :returns: A generator of SDK ``Blob``s.
+        """
+        for page in self._iter_blob_pages(shard, prefix, include):
+            for b in page:
+                yield b
 
-    def _get_flocker_blobs(self):
-        all_blobs = {}
+    def _iter_blob_pages(self, shard, prefix, include=None):
+        """
+        Enumerate the blobs of the container of a shard one page at a
+        time, following the continuation markers.
+        :param Shard shard: The shard
+        :param string prefix: The prefix of the blob names
+        :param string include: The datasets to include, like ``snapshots``
+        :returns: A generator of the pages, each a list of SDK ``Blob``s.
+        """
+        marker = None
 
-        blobs = self._azure_storage_client.list_blobs(
-            self._disk_container_name,
-            prefix='flocker-')
+        while True:
+            blobs = shard.client.list_blobs(
+                shard.container_name,
+                prefix=prefix,
+                marker=marker,
+                include=include)
 
-        for b in blobs:
-            # todo - this could be big!
-            all_blobs[b.name] = b
+            yield blobs
 
-        return all_blobs
+            marker = blobs.next_marker
+            if not marker:
+                return
 
-    def _wait_for_detach(self, blockdevice_id):
-        role_name = ''
-        lun = -1
+    def _get_flocker_blob(self, name):
+        """
+        Find a blob in the shards its volume is placed in by hash first,
+        then in the other shards, in parallel.
+        :param string name: The name of the blob
+        :returns: The ``BlobRecord`` of the blob, or ``None`` if it does not
+            exist.
+        """
+        try:
+            hashed = self._hashed_shards(
+                self._dataset_id_for_disk_label(name))
+        except ValueError:
+            hashed = self._shards[:1]
+
+        others = [s for s in self._shards if s not in hashed]
+        for shards in (hashed, others):
+            for record in self._map_shards(
+                    lambda shard: self._get_shard_blob(shard, name), shards):
+                if record is not None:
+                    return record
+        return None
+
+    def _hashed_shards(self, dataset_id):
+        """
+        :param UUID dataset_id: The dataset id of a volume
+        :returns list: The shards ``HASH`` places the volume in, over every
+            shard and over the shards of each storage tier, as volumes are
+            placed among the shards of the tier of their profile.
+        """
+        tiers = []
+        for shard in self._shards:
+            if shard.tier not in tiers:
+                tiers.append(shard.tier)
+
+        hashed = [self._placement.hashed(dataset_id)]
+        for tier in tiers:
+            shard = self._placement.hashed(
+                dataset_id, [s for s in self._shards if s.tier == tier])
+            if shard not in hashed:
+                hashed.append(shard)
+        return hashed
+
+    def _get_shard_blob(self, shard, name):
+        """
+        :returns: The ``BlobRecord`` of the blob ``name`` of ``shard``, or
+            ``None`` if it does not exist.
+        """
+        try:
+            properties = shard.client.get_blob_properties(
+                shard.container_name, name)
+        except WindowsAzureMissingResourceError:
+            return None
+
+        return BlobRecord(
+            name=name,
+            content_length=int(properties['content-length']),
+            etag=properties.get('etag'),
+            lease_state=properties.get('x-ms-lease-state'),
+            shard=shard,
+            metadata=self._metadata(properties))
+
+    @staticmethod
+    def _metadata(properties):
+        """
+        :param dict properties: The headers returned by
+            ``get_blob_properties``
+        :returns dict: The metadata of the blob, by name.
+        """
+        return dict((key[len('x-ms-meta-'):], value)
+                    for (key, value) in properties.items()
+                    if key.startswith('x-ms-meta-'))
 
-        timeout_count = 0
+    def _schedule(self, operation, f, repeat_error):
+        """
+        Run a mutating operation in turn with the other operations on the
+        deployment.
+        :param Exception repeat_error: The error an identical operation
+            queued meanwhile raises once this one succeeded.
+        """
+        return self._scheduler.run(
+            self._service_name, operation, f, repeat_error)
 
-        log_info('waiting for azure to ' + 'report disk as detached...')
+    def _retry_conflicts(self, name, f):
+        """
+        Call ``f``, retrying while Azure rejects it because another
+        operation is in progress on the deployment. Other conflicts, like
+        a lease held on the blob, are raised at once.
+        """
+        return self._poller.retry(
+            name, f, (WindowsAzureConflictError,),
+            lambda e: DEPLOYMENT_BUSY in str(e))
 
-        while role_name is not None or lun is not None:
-            (target_disk, role_name, lun) = \
-                self._get_disk_vmname_lun(blockdevice_id)
-            time.sleep(1)
-            timeout_count += 1
+    def is_detached(self, blockdevice_id):
+        """
+        :param unicode blockdevice_id: The identifier of the volume
+        :returns bool: Whether Azure reports the volume detached, or
+            deleted.
+        """
+        self._inventory.invalidate()
+        (target_disk, role_name, lun) = \
+            self._get_disk_vmname_lun(blockdevice_id)
+        return role_name is None and lun is None
 
-            if timeout_count > 5000:
-                raise AsynchronousTimeout()
+    def is_attached(self, blockdevice_id):
+        """
+        :param unicode blockdevice_id: The identifier of the volume
+        :returns bool: Whether Azure reports the volume attached.
+        """
+        return self._are_attached([blockdevice_id])
+
+    def _are_attached(self, blockdevice_ids):
+        self._inventory.invalidate()
+        index = self._inventory.get()
+        return all(index.lookup(b)[2] is not None for b in blockdevice_ids)
 
-        log_info('Disk Detached')
+    def operation_status(self, request_id):
+        """
+        :param str request_id: The id of an asynchronous Azure request
+        :returns: The ``Operation`` of the request, or ``None`` while it is
+            in progress.
+        """
+        result = self._azure_service_client.get_operation_status(request_id)
+        if result.status == 'InProgress':
+            return None
+        return result
+
+    def _wait_for_detach(self, blockdevice_id):
+        self._poller.wait(
+            'detach', lambda: self.is_detached(blockdevice_id))
 
-    def _wait_for_attach(self, blockdevice_id):
-        timeout_count = 0
+    def _wait_for_attach(self, pending):
+        """
+        Wait for an attach to complete. When the volume is attached to
+        this node a block device of its size appearing completes it as
+        well as Azure reporting the operation complete, whichever comes
+        first: between the polls of the operation the device is waited
+        for ``device_timeout`` seconds. Otherwise the operation alone is
+        waited for.
+        :param PendingAttach pending: The attach
+        """
         lun = None
+        if pending.attach_to == self._instance_id and \
+                self._device_timeout > 0:
+            lun = self._lun_allocator.reservations(pending.attach_to).get(
+                pending.blockdevice_id)
 
-        log_info('waiting for azure to report disk as attached...')
+        if lun is None:
+            self._wait_for_async(pending.request_id)
+            return
 
-        while lun is None:
-            (target_disk, role_name, lun) = \
-                self._get_disk_vmname_lun(blockdevice_id)
-            time.sleep(.001)
-            timeout_count += 1
+        start = time.time()
 
-            if timeout_count > 5000:
-                raise AsynchronousTimeout()
+        def check():
+            try:
+                self._devices.wait_for_device(
+                    lun, self._device_timeout, pending.size)
+            except UnknownScsiDevice:
+                return self.operation_status(pending.request_id)
+            self._metrics.record('scsi.wait_for_device', time.time() - start)
+            return True
 
-    def _wait_for_async(self, request_id, timeout):
-        count = 0
-        result = self._azure_service_client.get_operation_status(request_id)
-        while result.status == 'InProgress':
-            count = count + 1
-            if count > timeout:
-                log_error('Timed out waiting for async operation to complete.')
-                raise AsynchronousTimeout()
-            time.sleep(.001)
-            log_info('.')
-            result = self._azure_service_client.get_operation_status(
-                request_id)
-            if result.error:
-                log_error(result.error.code)
-                log_error(str(result.error.message))
-
-        log_error(result.status + ' in ' + str(count * 5) + 's')
+        self._poller.wait('attach', check)
+        self._inventory.invalidate()
+
+    def _wait_for_async(self, request_id):
+        with ASYNC_OPERATION(request_id=request_id) as action:
+            result = self._poller.wait(
+                'async', lambda: self.operation_status(request_id))
+            action.add_success_fields(**operation_fields(result))
 
     def _gibytes_to_bytes(self, size):
 
@@ -508,6 +1743,10 @@ class AzureStorageBlockDeviceAPI(object):
         )  # disk labels are formatted as flocker-<data_set_id>
 
 
+if IProfiledBlockDeviceAPI is not None:
+    classImplements(AzureStorageBlockDeviceAPI, IProfiledBlockDeviceAPI)
+
+
 def azure_driver_from_configuration(config):
     """
     Returns Flocker Azure BlockDeviceAPI from plugin config yml.
@@ -0,0 +1,70 @@
+from multiprocessing.pool import ThreadPool
+
+
+class BatchExecutor(object):
+    """
+    Runs batches of attach, detach and destroy operations against an
+    ``AzureStorageBlockDeviceAPI`` on a bounded thread pool, for a node
+    taking over or giving up many volumes at once.
+
+    The requests mutating the deployment still go through the scheduler
+    of the driver one at a time, but the waits which follow them, for
+    Azure to report a volume attached or detached and for its device to
+    appear, overlap instead of adding up. The driver reserves LUNs per
+    role, so the operations of a batch can safely target the same role.
+    """
+
+    def __init__(self, api, workers=8):
+        """
+        :param AzureStorageBlockDeviceAPI api: The driver to run the
+            operations with.
+        :param int workers: The maximum number of operations in flight.
+        """
+        self._api = api
+        self._workers = workers
+
+    def attach_volumes(self, blockdevice_ids, attach_to):
+        """
+        Attach volumes to a node.
+        :returns list: For each volume, in order, the ``BlockDeviceVolume``
+            returned by ``attach_volume`` or the exception it raised.
+        """
+        return self._run([(self._api.attach_volume, (b, attach_to))
+                          for b in blockdevice_ids])
+
+    def detach_volumes(self, blockdevice_ids):
+        """
+        Detach volumes from whichever node they are attached to.
+        :returns list: For each volume, in order, ``None`` or the exception
+            raised by ``detach_volume``.
+        """
+        return self._run([(self._api.detach_volume, (b,))
+                          for b in blockdevice_ids])
+
+    def destroy_volumes(self, blockdevice_ids):
+        """
+        Destroy volumes.
+        :returns list: For each volume, in order, ``None`` or the exception
+            raised by ``destroy_volume``.
+        """
+        return self._run([(self._api.destroy_volume, (b,))
+                          for b in blockdevice_ids])
+
+    def _run(self, calls):
+        if not calls:
+            return []
+
+        pool = ThreadPool(min(self._workers, len(calls)))
+        try:
+            return pool.map(_capture, calls)
+        finally:
+            pool.close()
+            pool.join()
+
+
+def _capture(call):
+    (f, args) = call
+    try:
+        return f(*args)
+    except Exception as e:
+        return e
@@ -0,0 +1,780 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+An in memory Azure backend, standing in for the ``ServiceManagementService``
+and ``BlobService`` clients of the Azure SDK so the driver can be tested and
+measured without a subscription.
+"""
+
+from collections import Counter, OrderedDict
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from azure import WindowsAzureConflictError, WindowsAzureError, \
+    WindowsAzureMissingResourceError
+from azure.servicemanagement import AsynchronousOperationResult, \
+    AttachedTo, DataVirtualHardDisk, Deployment, Disk, Operation, Role
+from azure.storage import Blob, BlobEnumResults
+
+# the storage account of ``FakeAzure.storage_client``
+ACCOUNT = 'fakeaccount'
+
+
+class _FakeBlob(object):
+
+    def __init__(self, name, content_length):
+        self.name = name
+        self.content_length = content_length
+        self.pages = {}
+        self.metadata = {}
+        # the content of a block blob
+        self.content = b''
+        self.lease_id = None
+        # when the lease expires, None for an infinite lease
+        self.lease_expires = None
+        self.lease_duration = None
+        # snapshot timestamp -> _FakeBlob, oldest first
+        self.snapshots = OrderedDict()
+        # the x-ms-copy-* properties of the copy which created the blob
+        self.copy = {}
+        self.version = itertools.count(1)
+        self.etag = None
+        self.touch()
+
+    def touch(self):
+        self.etag = '"0x%X"' % next(self.version)
+        self.last_modified = time.strftime(
+            '%a, %d %b %Y %H:%M:%S GMT', time.gmtime())
+
+    @property
+    def lease_state(self):
+        return 'leased' if self.lease_id is not None else 'available'
+
+    def frozen(self):
+        """
+        :returns _FakeBlob: A copy of the current content and metadata of
+            this blob.
+        """
+        blob = _FakeBlob(self.name, self.content_length)
+        blob.pages = dict(self.pages)
+        blob.metadata = dict(self.metadata)
+        blob.etag = self.etag
+        blob.last_modified = self.last_modified
+        return blob
+
+
+class _FakeDisk(object):
+
+    def __init__(self, name, label, media_link, size_in_gb):
+        self.name = name
+        self.label = label
+        self.media_link = media_link
+        self.size_in_gb = size_in_gb
+        self.role_name = None
+        self.host_caching = None
+
+
+class FakeAzure(object):
+    """
+    The state of a fake subscription holding one cloud service, its
+    deployment and storage accounts, with the SDK clients driving it as
+    ``service_client`` and ``storage_client``, the blob client of the
+    ``fakeaccount`` account. ``blob_service`` returns the clients of
+    other accounts.
+
+    Disks, roles, data disk LUNs and page blobs are modelled. Mutations of
+    the deployment return an asynchronous operation which stays in progress
+    for ``operation_time`` seconds, takes effect once it completes and
+    causes every other mutation of the deployment issued meanwhile to fail
+    with ``WindowsAzureConflictError``, as Azure does.
+
+    Every call is counted in ``calls`` and may be delayed or failed:
+
+    - ``latency`` seconds are slept before each call, either a number or
+      a ``dict`` of method name to seconds.
+    - ``throttle_rate`` is the probability a call fails with the
+      ``WindowsAzureError`` Azure reports for a throttled request.
+    - ``conflict_rate`` is the probability a mutation of the deployment
+      fails with ``WindowsAzureConflictError``.
+
+    Blob snapshots and server side copies are modelled too, a copy stays
+    pending for ``copy_time`` seconds.
+    """
+
+    def __init__(self, latency=0, throttle_rate=0, conflict_rate=0,
+                 operation_time=0, page_size=5000, seed=None,
+                 clock=time.time, sleep=time.sleep, copy_time=0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.conflict_rate = conflict_rate
+        self.operation_time = operation_time
+        self.copy_time = copy_time
+        self.page_size = page_size
+        self.calls = Counter()
+        self.errors = Counter()
+        self._random = random.Random(seed)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.RLock()
+        self._ids = itertools.count(1)
+        # disk name -> _FakeDisk
+        self.disks = {}
+        # role name -> {lun: disk name}, roles are created on first use
+        self.roles = {}
+        # account name -> {container name -> {blob name: _FakeBlob}}
+        self.accounts = {}
+        # account name -> FakeBlobService
+        self._blob_services = {}
+        # request id -> completion time
+        self._operations = {}
+        # a heap of the (completion time, sequence number, effect) of the
+        # operations not yet applied
+        self._pending = []
+        self._busy_until = 0
+
+        self.service_client = FakeServiceManagementService(self)
+        self.storage_client = self.blob_service(ACCOUNT)
+
+    def call(self, method, mutation=False):
+        """
+        Record a call and inject its latency and faults.
+        :param str method: The name of the SDK method called.
+        :param bool mutation: Whether the call mutates the deployment.
+        :raises WindowsAzureError: If the call is throttled.
+        :raises WindowsAzureConflictError: If the call conflicts with an
+            operation in progress.
+        """
+        latency = self.latency
+        if isinstance(latency, dict):
+            latency = latency.get(method, 0)
+        if latency:
+            self._sleep(latency)
+
+        with self._lock:
+            self.calls[method] += 1
+            self._settle()
+
+            if self.throttle_rate and \
+                    self._random.random() < self.throttle_rate:
+                self.errors['throttled'] += 1
+                raise WindowsAzureError(
+                    'Unknown error (Too Many Requests)')
+
+            if mutation and (
+                    self._clock() < self._busy_until or
+                    self.conflict_rate and
+                    self._random.random() < self.conflict_rate):
+                self.errors['conflict'] += 1
+                raise WindowsAzureConflictError(
+                    'Conflict (Windows Azure is currently performing an '
+                    'operation on this deployment that requires exclusive '
+                    'access.)')
+
+    def operation(self, effect=None, exclusive=True):
+        """
+        Start an asynchronous operation.
+        :param callable effect: Applied when the operation completes.
+        :param bool exclusive: Whether the operation holds the deployment
+            until it completes.
+        :returns AsynchronousOperationResult: The request of the operation.
+        """
+        request_id = 'fake-%d' % next(self._ids)
+        done_at = self._clock() + self.operation_time
+        self._operations[request_id] = done_at
+        if effect is not None:
+            self.later(self.operation_time, effect)
+        if exclusive:
+            self._busy_until = max(self._busy_until, done_at)
+        self._settle()
+        return AsynchronousOperationResult(request_id)
+
+    def later(self, seconds, effect):
+        """
+        Apply ``effect`` once ``seconds`` have passed. Effects due at the
+        same time are applied in the order they were scheduled.
+        """
+        heapq.heappush(
+            self._pending,
+            (self._clock() + seconds, next(self._ids), effect))
+
+    def timestamp(self):
+        """
+        :returns str: A unique timestamp in the format of blob snapshots.
+        """
+        return time.strftime(
+            '%Y-%m-%dT%H:%M:%S', time.gmtime(self._clock())) \
+            + '.%07dZ' % next(self._ids)
+
+    def role(self, role_name):
+        return self.roles.setdefault(role_name, {})
+
+    def blob_service(self, account_name):
+        """
+        :returns FakeBlobService: The blob client of a storage account.
+        """
+        with self._lock:
+            if account_name not in self._blob_services:
+                self._blob_services[account_name] = FakeBlobService(
+                    self, account_name)
+            return self._blob_services[account_name]
+
+    def container(self, container_name, account_name=ACCOUNT):
+        return self.accounts.setdefault(account_name, {}).setdefault(
+            container_name, {})
+
+    def blob(self, container_name, blob_name, account_name=ACCOUNT):
+        blob = self.container(container_name, account_name).get(blob_name)
+        if blob is None:
+            raise WindowsAzureMissingResourceError(
+                'Not found (The specified blob does not exist.)')
+        return blob
+
+    def blob_for_media_link(self, media_link):
+        (scheme, _, host, container_name, blob_name) = media_link.split('/')
+        return self.blob(container_name, blob_name, host.split('.')[0])
+
+    def blob_for_url(self, url):
+        """
+        :param str url: The URL of a blob, or of one of its snapshots
+            with a ``snapshot`` query parameter.
+        :returns _FakeBlob: The blob or snapshot.
+        """
+        (media_link, _, query) = url.partition('?')
+        blob = self.blob_for_media_link(media_link)
+        if not query.startswith('snapshot='):
+            return blob
+        snapshot = blob.snapshots.get(query[len('snapshot='):])
+        if snapshot is None:
+            raise WindowsAzureMissingResourceError(
+                'Not found (The specified blob does not exist.)')
+        return snapshot
+
+    def _settle(self):
+        """
+        Apply the effects of the operations which have completed, in the
+        order they completed.
+        """
+        now = self._clock()
+        while self._pending and self._pending[0][0] <= now:
+            (done_at, i, effect) = heapq.heappop(self._pending)
+            effect()
+
+
+class FakeServiceManagementService(object):
+    """
+    The subset of ``ServiceManagementService`` used by the driver.
+    """
+
+    def __init__(self, azure):
+        self._azure = azure
+
+    def list_disks(self):
+        self._azure.call('list_disks')
+        with self._azure._lock:
+            return [self._disk(d) for d in self._azure.disks.values()]
+
+    def get_deployment_by_name(self, service_name, deployment_name):
+        self._azure.call('get_deployment_by_name')
+        with self._azure._lock:
+            deployment = Deployment()
+            deployment.name = deployment_name
+            deployment.role_list = [
+                self._role(role_name) for role_name in self._azure.roles]
+            return deployment
+
+    def get_role(self, service_name, deployment_name, role_name):
+        self._azure.call('get_role')
+        with self._azure._lock:
+            self._azure.role(role_name)
+            return self._role(role_name)
+
+    def get_operation_status(self, request_id):
+        self._azure.call('get_operation_status')
+        with self._azure._lock:
+            if request_id not in self._azure._operations:
+                raise WindowsAzureMissingResourceError(
+                    'Not found (The operation does not exist.)')
+            done_at = self._azure._operations[request_id]
+
+            operation = Operation()
+            operation.id = request_id
+            if self._azure._clock() < done_at:
+                operation.status = 'InProgress'
+                operation.http_status_code = '202'
+            else:
+                operation.status = 'Succeeded'
+                operation.http_status_code = '200'
+                operation.error = None
+            return operation
+
+    def add_data_disk(self, service_name, deployment_name, role_name, lun,
+                      host_caching=None, media_link=None, disk_label=None,
+                      disk_name=None, logical_disk_size_in_gb=None,
+                      source_media_link=None):
+        self._azure.call('add_data_disk', mutation=True)
+        with self._azure._lock:
+            if lun in self._azure.role(role_name):
+                raise WindowsAzureError(
+                    'Bad Request (A disk is already attached at LUN '
+                    '{}.)'.format(lun))
+            self._check_attachable(disk_name, source_media_link)
+
+            return self._azure.operation(lambda: self._attach(
+                role_name, lun, disk_label, disk_name, source_media_link,
+                host_caching))
+
+    def update_role(self, service_name, deployment_name, role_name,
+                    os_virtual_hard_disk=None, network_config=None,
+                    availability_set_name=None,
+                    data_virtual_hard_disks=None, role_size=None,
+                    role_type='PersistentVMRole',
+                    resource_extension_references=None,
+                    provision_guest_agent=None):
+        self._azure.call('update_role', mutation=True)
+        with self._azure._lock:
+            disks = self._azure.role(role_name)
+            wanted = dict((d.lun, d) for d in data_virtual_hard_disks or [])
+            added = [d for (lun, d) in wanted.items() if lun not in disks]
+            for d in added:
+                self._check_attachable(
+                    d.disk_name or None, d.source_media_link)
+
+            def effect():
+                for lun in list(disks):
+                    if lun not in wanted:
+                        self._detach(role_name, lun)
+                for d in added:
+                    self._attach(role_name, d.lun, d.disk_label,
+                                 d.disk_name or None, d.source_media_link,
+                                 d.host_caching)
+
+            return self._azure.operation(effect)
+
+    def delete_data_disk(self, service_name, deployment_name, role_name,
+                         lun, delete_vhd=False):
+        self._azure.call('delete_data_disk', mutation=True)
+        with self._azure._lock:
+            if lun not in self._azure.role(role_name):
+                raise WindowsAzureMissingResourceError(
+                    'Not found (No data disk at LUN {}.)'.format(lun))
+            if delete_vhd:
+                self._check_deletable(
+                    self._azure.disks[self._azure.role(role_name)[lun]])
+
+            def effect():
+                disk = self._detach(role_name, lun)
+                if delete_vhd:
+                    self._delete(disk)
+
+            return self._azure.operation(effect)
+
+    def delete_disk(self, disk_name, delete_vhd=False):
+        self._azure.call('delete_disk')
+        with self._azure._lock:
+            disk = self._azure.disks.get(disk_name)
+            if disk is None:
+                raise WindowsAzureMissingResourceError(
+                    'Not found (The disk does not exist.)')
+            if disk.role_name is not None:
+                raise WindowsAzureError(
+                    'Bad Request (Disk {} is attached to a role.)'.format(
+                        disk_name))
+            if delete_vhd:
+                self._check_deletable(disk)
+
+            def effect():
+                if delete_vhd:
+                    self._delete(disk)
+                else:
+                    del self._azure.disks[disk_name]
+                    self._azure.blob_for_media_link(
+                        disk.media_link).lease_id = None
+
+            return self._azure.operation(effect, exclusive=False)
+
+    def _check_attachable(self, disk_name, source_media_link):
+        """
+        :raises WindowsAzureError: If the disk named ``disk_name``, or the
+            blob at ``source_media_link``, cannot be attached.
+        """
+        if disk_name is not None:
+            disk = self._azure.disks.get(disk_name)
+            if disk is None:
+                raise WindowsAzureMissingResourceError(
+                    'Not found (The disk does not exist.)')
+            if disk.role_name is not None:
+                raise WindowsAzureError(
+                    'Bad Request (Disk {} is already attached.)'.format(
+                        disk_name))
+        elif self._azure.blob_for_media_link(
+                source_media_link).lease_id is not None:
+            raise WindowsAzureConflictError(
+                'Conflict (The blob is already registered as a disk.)')
+
+    def _check_deletable(self, disk):
+        """
+        :raises WindowsAzureError: If the blob of ``disk`` has snapshots.
+        """
+        if self._azure.blob_for_media_link(disk.media_link).snapshots:
+            raise WindowsAzureError(
+                'Bad Request (The blob of disk {} has snapshots.)'.format(
+                    disk.name))
+
+    def _attach(self, role_name, lun, disk_label, disk_name,
+                source_media_link, host_caching=None):
+        """
+        Attach the disk named ``disk_name`` at ``lun``, or register the
+        blob at ``source_media_link`` as a new disk and attach it, with
+        the ``host_caching`` mode, ``ReadOnly`` by default like Azure.
+        """
+        if disk_name is not None:
+            disk = self._azure.disks[disk_name]
+        else:
+            blob = self._azure.blob_for_media_link(source_media_link)
+            name = '%s-%d' % (role_name, next(self._azure._ids))
+            disk = _FakeDisk(name, disk_label, source_media_link,
+                             # the size of the disk, without its footer
+                             -(-(blob.content_length - 512) // (1 << 30)))
+            self._azure.disks[name] = disk
+
+        disk.role_name = role_name
+        disk.host_caching = host_caching or 'ReadOnly'
+        self._azure.role(role_name)[lun] = disk.name
+        self._azure.blob_for_media_link(disk.media_link).lease_id = \
+            disk.name
+
+    def _detach(self, role_name, lun):
+        # like azure, keep the blob leased while it is registered as a disk
+        disk = self._azure.disks[self._azure.role(role_name).pop(lun)]
+        disk.role_name = None
+        return disk
+
+    def _delete(self, disk):
+        (scheme, _, host, container_name, blob_name) = \
+            disk.media_link.split('/')
+        self._azure.container(container_name, host.split('.')[0]).pop(
+            blob_name, None)
+        del self._azure.disks[disk.name]
+
+    def _disk(self, fake):
+        disk = Disk()
+        disk.name = fake.name
+        disk.label = fake.label
+        disk.media_link = fake.media_link
+        disk.logical_disk_size_in_gb = fake.size_in_gb
+        if fake.role_name is not None:
+            disk.attached_to = AttachedTo()
+            disk.attached_to.hosted_service_name = 'fake'
+            disk.attached_to.deployment_name = 'fake'
+            disk.attached_to.role_name = fake.role_name
+        return disk
+
+    def _role(self, role_name):
+        role = Role()
+        role.role_name = role_name
+        role.role_size = 'Small'
+        role.configuration_sets = []
+        role.data_virtual_hard_disks = []
+        for (lun, name) in sorted(self._azure.role(role_name).items()):
+            disk = self._azure.disks[name]
+            role.data_virtual_hard_disks.append(DataVirtualHardDisk(
+                media_link=disk.media_link, disk_label=disk.label,
+                disk_name=disk.name, lun=lun,
+                logical_disk_size_in_gb=disk.size_in_gb,
+                host_caching=disk.host_caching))
+        return role
+
+
+class FakeBlobService(object):
+    """
+    The subset of ``BlobService`` used by the driver, for one storage
+    account.
+    """
+
+    def __init__(self, azure, account_name=ACCOUNT):
+        self._azure = azure
+        self._account_name = account_name
+
+    def _container(self, container_name):
+        return self._azure.container(container_name, self._account_name)
+
+    def _fake(self, container_name, blob_name):
+        return self._azure.blob(container_name, blob_name, self._account_name)
+
+    def put_blob(self, container_name, blob_name, blob, x_ms_blob_type,
+                 x_ms_blob_content_type=None, x_ms_blob_content_length=None,
+                 x_ms_meta_name_values=None, x_ms_lease_id=None, **kwargs):
+        self._azure.call('put_blob')
+        with self._azure._lock:
+            existing = self._container(container_name).get(blob_name)
+            if existing is not None and existing.lease_id is not None and \
+                    x_ms_lease_id != existing.lease_id:
+                raise WindowsAzureConflictError(
+                    'Conflict (There is currently a lease on the blob and '
+                    'no lease ID was specified in the request.)')
+            if x_ms_blob_type == 'BlockBlob':
+                fake = _FakeBlob(blob_name, len(blob or b''))
+                fake.content = blob or b''
+            else:
+                fake = _FakeBlob(blob_name, x_ms_blob_content_length or 0)
+            fake.metadata = dict(x_ms_meta_name_values or {})
+            if existing is not None:
+                # the lease outlives the content it was taken on
+                fake.lease_id = existing.lease_id
+                fake.lease_expires = existing.lease_expires
+                fake.lease_duration = existing.lease_duration
+            self._container(container_name)[blob_name] = fake
+
+    def get_blob(self, container_name, blob_name, snapshot=None,
+                 x_ms_range=None, x_ms_lease_id=None,
+                 x_ms_range_get_content_md5=None):
+        """
+        Only block blobs are read back whole.
+        """
+        self._azure.call('get_blob')
+        with self._azure._lock:
+            return self._fake(container_name, blob_name).content
+
+    def put_page(self, container_name, blob_name, page, x_ms_range,
+                 x_ms_page_write, **kwargs):
+        self._azure.call('put_page')
+        with self._azure._lock:
+            blob = self._fake(container_name, blob_name)
+            start = int(x_ms_range.split('=')[1].split('-')[0])
+            blob.pages[start] = page
+            blob.touch()
+
+    def get_page(self, container_name, blob_name, start, length):
+        """
+        Not part of the SDK, reads back a page written with ``put_page``.
+        """
+        with self._azure._lock:
+            return self._fake(container_name, blob_name).pages.get(
+                start, b'\x00' * length)
+
+    def list_blobs(self, container_name, prefix=None, marker=None,
+                   maxresults=None, include=None, delimiter=None):
+        self._azure.call('list_blobs')
+        with self._azure._lock:
+            page_size = min(maxresults or self._azure.page_size,
+                            self._azure.page_size)
+            names = sorted(
+                n for n in self._container(container_name)
+                if n.startswith(prefix or '') and n >= (marker or ''))
+
+            results = BlobEnumResults()
+            results.prefix = prefix
+            results.marker = marker
+            results.max_results = maxresults
+            results.blobs = []
+            for n in names[:page_size]:
+                blob = self._fake(container_name, n)
+                if include and 'snapshots' in include:
+                    # azure lists the snapshots of a blob before it
+                    for (snapshot, s) in blob.snapshots.items():
+                        results.blobs.append(self._blob(s, include))
+                        results.blobs[-1].snapshot = snapshot
+                results.blobs.append(self._blob(blob, include))
+            results.next_marker = names[page_size] \
+                if len(names) > page_size else ''
+            return results
+
+    def get_blob_properties(self, container_name, blob_name,
+                            x_ms_lease_id=None):
+        self._azure.call('get_blob_properties')
+        with self._azure._lock:
+            blob = self._fake(container_name, blob_name)
+            properties = {
+                'content-length': str(blob.content_length),
+                'etag': blob.etag,
+                'last-modified': blob.last_modified,
+                'x-ms-blob-type': 'PageBlob',
+                'x-ms-lease-state': blob.lease_state,
+                'x-ms-lease-status':
+                    'locked' if blob.lease_id else 'unlocked',
+            }
+            for (name, value) in blob.metadata.items():
+                properties['x-ms-meta-' + name] = value
+            properties.update(blob.copy)
+            return properties
+
+    def set_blob_metadata(self, container_name, blob_name,
+                          x_ms_meta_name_values=None, x_ms_lease_id=None):
+        self._azure.call('set_blob_metadata')
+        with self._azure._lock:
+            blob = self._fake(container_name, blob_name)
+            if blob.lease_id is not None and x_ms_lease_id != blob.lease_id:
+                raise WindowsAzureConflictError(
+                    'Conflict (There is currently a lease on the blob and '
+                    'no lease ID was specified in the request.)')
+            blob.metadata = dict(x_ms_meta_name_values or {})
+            blob.touch()
+
+    def snapshot_blob(self, container_name, blob_name,
+                      x_ms_meta_name_values=None, **kwargs):
+        self._azure.call('snapshot_blob')
+        with self._azure._lock:
+            blob = self._fake(container_name, blob_name)
+            snapshot = self._azure.timestamp()
+            blob.snapshots[snapshot] = blob.frozen()
+            if x_ms_meta_name_values is not None:
+                blob.snapshots[snapshot].metadata = dict(
+                    x_ms_meta_name_values)
+            return {'x-ms-snapshot': snapshot, 'etag': blob.etag,
+                    'last-modified': blob.last_modified}
+
+    def lease_blob(self, container_name, blob_name, x_ms_lease_action,
+                   x_ms_lease_id=None, x_ms_lease_duration=60,
+                   x_ms_lease_break_period=None,
+                   x_ms_proposed_lease_id=None):
+        """
+        Only ``acquire``, ``renew``, ``release`` and ``break`` are
+        supported. An expired lease can be acquired again, it is otherwise
+        still enforced.
+        """
+        self._azure.call('lease_blob')
+        with self._azure._lock:
+            blob = self._fake(container_name, blob_name)
+            now = self._azure._clock()
+            if x_ms_lease_action == 'acquire':
+                if blob.lease_id is not None and (
+                        blob.lease_expires is None or
+                        now < blob.lease_expires):
+                    raise WindowsAzureConflictError(
+                        'Conflict (There is already a lease present.)')
+                blob.lease_id = x_ms_proposed_lease_id or \
+                    'lease-%d' % next(self._azure._ids)
+                blob.lease_duration = int(x_ms_lease_duration)
+                blob.lease_expires = None if blob.lease_duration < 0 \
+                    else now + blob.lease_duration
+                return {'x-ms-lease-id': blob.lease_id}
+            elif x_ms_lease_action == 'renew':
+                if blob.lease_id != x_ms_lease_id:
+                    raise WindowsAzureConflictError(
+                        'Conflict (The lease ID specified did not match '
+                        'the lease ID for the blob.)')
+                # a lease is renewed for the duration it was acquired for
+                if blob.lease_expires is not None:
+                    blob.lease_expires = now + blob.lease_duration
+                return {'x-ms-lease-id': blob.lease_id}
+            elif x_ms_lease_action == 'release':
+                if blob.lease_id != x_ms_lease_id:
+                    raise WindowsAzureConflictError(
+                        'Conflict (The lease ID specified did not match '
+                        'the lease ID for the blob.)')
+                blob.lease_id = None
+                return {}
+            elif x_ms_lease_action == 'break':
+                blob.lease_id = None
+                blob.lease_expires = None
+                return {'x-ms-lease-time': '0'}
+            raise WindowsAzureError(
+                'Bad Request (Unsupported lease action {}.)'.format(
+                    x_ms_lease_action))
+
+    def copy_blob(self, container_name, blob_name, x_ms_copy_source,
+                  x_ms_meta_name_values=None, x_ms_source_lease_id=None,
+                  if_none_match=None, **kwargs):
+        self._azure.call('copy_blob')
+        with self._azure._lock:
+            source = self._azure.blob_for_url(x_ms_copy_source)
+            if x_ms_source_lease_id is not None and \
+                    x_ms_source_lease_id != source.lease_id:
+                raise WindowsAzureError(
+                    'Precondition Failed (The lease ID specified did not '
+                    'match the lease ID for the blob.)')
+            existing = self._container(container_name).get(blob_name)
+            if existing is not None and if_none_match == '*':
+                raise WindowsAzureConflictError(
+                    'Conflict (The specified blob already exists.)')
+            if existing is not None and existing.lease_id is not None:
+                raise WindowsAzureConflictError(
+                    'Conflict (There is currently a lease on the blob and '
+                    'no lease ID was specified in the request.)')
+
+            blob = _FakeBlob(blob_name, source.content_length)
+            blob.metadata = dict(x_ms_meta_name_values or source.metadata)
+            blob.copy = {
+                'x-ms-copy-id': 'copy-%d' % next(self._azure._ids),
+                'x-ms-copy-source': x_ms_copy_source,
+                'x-ms-copy-status': 'pending',
+                'x-ms-copy-progress': '0/%d' % source.content_length,
+            }
+            self._container(container_name)[blob_name] = blob
+            pages = dict(source.pages)
+
+            def effect():
+                if blob.copy['x-ms-copy-status'] != 'pending':
+                    return
+                blob.pages.update(pages)
+                blob.copy['x-ms-copy-status'] = 'success'
+                blob.copy['x-ms-copy-progress'] = '%d/%d' % (
+                    blob.content_length, blob.content_length)
+                blob.touch()
+
+            if self._azure.copy_time:
+                self._azure.later(self._azure.copy_time, effect)
+            else:
+                effect()
+            return {'x-ms-copy-id': blob.copy['x-ms-copy-id'],
+                    'x-ms-copy-status': blob.copy['x-ms-copy-status'],
+                    'etag': blob.etag, 'last-modified': blob.last_modified}
+
+    def abort_copy_blob(self, container_name, blob_name, x_ms_copy_id,
+                        x_ms_lease_id=None):
+        self._azure.call('abort_copy_blob')
+        with self._azure._lock:
+            blob = self._fake(container_name, blob_name)
+            if blob.copy.get('x-ms-copy-status') != 'pending' or \
+                    blob.copy['x-ms-copy-id'] != x_ms_copy_id:
+                raise WindowsAzureConflictError(
+                    'Conflict (There is currently no pending copy '
+                    'operation.)')
+            # azure leaves an empty blob behind
+            blob.copy['x-ms-copy-status'] = 'aborted'
+            blob.content_length = 0
+            blob.touch()
+
+    def delete_blob(self, container_name, blob_name, snapshot=None,
+                    timeout=None, x_ms_lease_id=None,
+                    x_ms_delete_snapshots=None):
+        self._azure.call('delete_blob')
+        with self._azure._lock:
+            blob = self._fake(container_name, blob_name)
+            if snapshot is not None:
+                if blob.snapshots.pop(snapshot, None) is None:
+                    raise WindowsAzureMissingResourceError(
+                        'Not found (The specified blob does not exist.)')
+                return
+
+            if blob.lease_id is not None and x_ms_lease_id != blob.lease_id:
+                raise WindowsAzureConflictError(
+                    'Conflict (There is currently a lease on the blob and '
+                    'no lease ID was specified in the request.)')
+            if blob.snapshots and x_ms_delete_snapshots is None:
+                raise WindowsAzureConflictError(
+                    'Conflict (This operation is not permitted because the '
+                    'blob has snapshots.)')
+
+            blob.snapshots.clear()
+            if x_ms_delete_snapshots != 'only':
+                del self._container(container_name)[blob_name]
+
+    @staticmethod
+    def _blob(fake, include):
+        blob = Blob()
+        blob.name = fake.name
+        blob.properties.content_length = fake.content_length
+        blob.properties.etag = fake.etag
+        blob.properties.last_modified = fake.last_modified
+        blob.properties.blob_type = 'PageBlob'
+        blob.properties.lease_state = fake.lease_state
+        blob.properties.lease_status = \
+            'locked' if fake.lease_id else 'unlocked'
+        if include and 'metadata' in include:
+            blob.metadata = dict(fake.metadata)
+        return blob
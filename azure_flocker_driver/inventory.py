@@ -0,0 +1,340 @@
+from collections import namedtuple
+import threading
+import time
+
+
+# The parts of a page blob the driver needs, a fraction of the size of
+# the ``Blob`` objects returned by the SDK, and the ``Shard`` it is in.
+BlobRecord = namedtuple(
+    'BlobRecord', ['name', 'content_length', 'etag', 'lease_state',
+                   'shard', 'metadata'])
+
+# How the volumes listed changed since the previous listing: the volumes
+# which appeared, those which disappeared and those which are now attached
+# to another role, or to none.
+VolumeChanges = namedtuple('VolumeChanges', ['added', 'removed', 'reattached'])
+
+
+def volume_changes(old, new):
+    """
+    :param list old: The ``BlockDeviceVolume``s of a previous listing
+    :param list new: The ``BlockDeviceVolume``s of the current listing
+    :returns VolumeChanges: The new volumes added and reattached and the
+        old volumes removed, each sorted by ``blockdevice_id``.
+    """
+    before = dict((v.blockdevice_id, v) for v in old)
+    after = dict((v.blockdevice_id, v) for v in new)
+    return VolumeChanges(
+        added=[after[i] for i in sorted(set(after) - set(before))],
+        removed=[before[i] for i in sorted(set(before) - set(after))],
+        reattached=[after[i] for i in sorted(set(after) & set(before))
+                    if after[i].attached_to != before[i].attached_to])
+
+
+class InventoryCache(object):
+    """
+    Caches the result of an expensive inventory listing (disks and
+    blobs) for a bounded amount of time.
+
+    The cache is invalidated explicitly by the driver whenever it mutates
+    Azure state, so reads following one of our own operations never see a
+    stale inventory. Changes made by other nodes become visible at most
+    ``ttl`` seconds later.
+    """
+
+    def __init__(self, loader, ttl, clock=time.time):
+        """
+        :param callable loader: A no argument callable returning a fresh
+            inventory.
+        :param float ttl: The number of seconds a loaded inventory is
+            served from the cache. ``0`` disables caching.
+        :param callable clock: Returns the current time in seconds.
+        """
+        self._loader = loader
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._value = None
+        self._loaded_at = None
+        # when the driver last changed azure state
+        self.invalidated_at = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self):
+        """
+        Return the cached inventory, reloading it if it is missing or
+        older than the ttl.
+        """
+        with self._lock:
+            now = self._clock()
+            if self._loaded_at is not None \
+                    and now - self._loaded_at < self._ttl:
+                self.hits += 1
+                return self._value
+
+            self.misses += 1
+            self._value = self._loader()
+            self._loaded_at = self._clock()
+            return self._value
+
+    def invalidate(self):
+        """
+        Discard the cached inventory so the next ``get`` reloads it.
+        """
+        with self._lock:
+            self._value = None
+            self._loaded_at = None
+            self.invalidated_at = self._clock()
+
+    def stats(self):
+        """
+        :returns dict: The hit and miss counters of this cache.
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class InventoryIndex(object):
+    """
+    A point in time view of the flocker disks and blobs, indexed for
+    constant time lookups by label, disk name and role.
+
+    Disks attached to a role only carry the role name, the LUN has to be
+    read from the role itself. Roles are resolved through ``role_loader``
+    the first time one of their disks is looked up and remembered for the
+    lifetime of the index.
+
+    Disks and blobs are each enumerated the first time all of them are
+    needed. Looking up a single volume which is not a registered disk
+    fetches just that blob through ``blob_loader``.
+
+    The cached index is shared by the threads of the driver, so the lazy
+    loads happen under a lock and each part is loaded once.
+    """
+
+    def __init__(self, disk_lister, blob_lister, blob_loader, role_loader,
+                 deployment=None):
+        """
+        :param callable disk_lister: Returns an iterable of the ``Disk``
+            objects of the subscription.
+        :param callable blob_lister: Returns an iterable of the
+            ``BlobRecord``s of the flocker blobs in the disk container.
+        :param callable blob_loader: Called with a blob name, returns its
+            ``BlobRecord`` or ``None`` if it does not exist.
+        :param callable role_loader: Called with a role name, returns the
+            ``DataVirtualHardDisk`` objects attached to that role.
+        :param DeploymentSnapshot deployment: The deployment the
+            attachments of the ``fingerprint`` are read from.
+        """
+        self._deployment = deployment
+        self._lock = threading.RLock()
+        self._disk_lister = disk_lister
+        self._blob_lister = blob_lister
+        self._blob_loader = blob_loader
+        self._role_loader = role_loader
+        # label -> Disk, None until listed
+        self._disks = None
+        # label -> BlobRecord or None, complete once _blobs_listed is set
+        self.blobs = {}
+        self._blobs_listed = False
+        # disk name -> (role name, lun)
+        self.attachments = {}
+        # role name -> set of occupied luns
+        self.role_luns = {}
+        # role name -> set of the media links of its data disks
+        self.role_media_links = {}
+
+    @property
+    def disks(self):
+        """
+        The flocker disks of the subscription by label.
+        """
+        with self._lock:
+            if self._disks is None:
+                disks = {}
+                for d in self._disk_lister():
+                    if 'flocker-' not in d.label:
+                        continue
+                    disks[d.label] = d
+                self._disks = disks
+            return self._disks
+
+    def lookup(self, blockdevice_id):
+        """
+        Find the disk, or unregistered blob, for a block device.
+        :param unicode blockdevice_id: The identifier of the volume
+        :returns tuple: The disk or blob, the name of the role it is
+            attached to and its LUN. Any of these may be ``None``.
+        """
+        label = str(blockdevice_id)
+        target_disk = self.disks.get(label)
+
+        if target_disk is None:
+            # check for unregisterd disk
+            return self._blob(label), None, None
+
+        role_name = getattr(target_disk.attached_to, 'role_name', None) \
+            or None
+
+        if role_name is None:
+            return target_disk, None, None
+
+        with self._lock:
+            self._load_role(role_name)
+            (role_name, lun) = self.attachments.get(
+                target_disk.name, (role_name, None))
+
+        return target_disk, role_name, lun
+
+    def luns_for_role(self, role_name):
+        """
+        :param unicode role_name: The name of the role
+        :returns set: The LUNs occupied by data disks of the role.
+        """
+        with self._lock:
+            self._load_role(role_name)
+            return self.role_luns[role_name]
+
+    def holds(self, role_name, media_link):
+        """
+        :param unicode role_name: The name of a role
+        :param string media_link: The URL of the blob of a disk
+        :returns bool: Whether the disk is attached to the role.
+        """
+        with self._lock:
+            self._load_role(role_name)
+            return media_link in self.role_media_links[role_name]
+
+    def holder(self, media_link):
+        """
+        :param string media_link: The URL of the blob of a disk
+        :returns unicode: The name of the role the disk is attached to,
+            read from the deployment, or ``None`` if it is not attached.
+        """
+        return self._deployment.holders().get(media_link)
+
+    def fingerprint(self):
+        """
+        A summary of the inventory which changes whenever a flocker blob is
+        created, deleted, resized, leased or has its metadata changed, or a
+        data disk of the deployment is attached or detached.
+
+        ETags are left out, the ETag of a blob changes with every page
+        written to the volume.
+        :returns: A hashable value, equal for equal inventories.
+        """
+        blobs = frozenset(
+            (b.shard.name, b.name, b.content_length, b.lease_state,
+             frozenset((b.metadata or {}).items()))
+            for b in self.all_blobs())
+        return (blobs, self._deployment.attachments())
+
+    def all_blobs(self):
+        """
+        :returns list: The flocker blobs, whether or not they are
+            registered as disks.
+        """
+        self._list_blobs()
+        return [b for b in self.blobs.values() if b is not None]
+
+    def unregistered_blobs(self):
+        """
+        :returns list: The flocker blobs which are not registered as disks.
+        """
+        self._list_blobs()
+        return [b for (label, b) in self.blobs.items()
+                if b is not None and label not in self.disks]
+
+    def _blob(self, name):
+        with self._lock:
+            if name not in self.blobs and not self._blobs_listed:
+                self.blobs[name] = self._blob_loader(name)
+            return self.blobs.get(name)
+
+    def _list_blobs(self):
+        with self._lock:
+            if self._blobs_listed:
+                return
+
+            blobs = {}
+            for b in self._blob_lister():
+                blobs[b.name] = b
+            self.blobs = blobs
+            self._blobs_listed = True
+
+    def _load_role(self, role_name):
+        # called with the lock held
+        if role_name in self.role_luns:
+            return
+
+        luns = set()
+        media_links = set()
+        for d in self._role_loader(role_name):
+            self.attachments[d.disk_name] = (role_name, d.lun)
+            luns.add(d.lun)
+            media_links.add(d.media_link)
+
+        self.role_luns[role_name] = luns
+        self.role_media_links[role_name] = media_links
+
+
+class DeploymentSnapshot(object):
+    """
+    Answers data disk queries for every role of a deployment from a
+    single ``get_deployment_by_name`` call.
+
+    The deployment is fetched the first time a role is queried, so an
+    inventory which never needs role data costs no Service Management
+    round trip at all.
+    """
+
+    def __init__(self, loader):
+        """
+        :param callable loader: A no argument callable returning the
+            ``Deployment``.
+        """
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._roles = None
+        self._holders = None
+
+    def data_disks(self, role_name):
+        """
+        :param unicode role_name: The name of the role
+        :returns list: The ``DataVirtualHardDisk`` objects attached to the
+            role, empty if the role is not part of the deployment.
+        """
+        return self._load().get(role_name, [])
+
+    def attachments(self):
+        """
+        :returns frozenset: The role name, LUN and media link of every data
+            disk of the deployment.
+        """
+        return frozenset(
+            (role_name, d.lun, d.media_link)
+            for (role_name, disks) in self._load().items() for d in disks)
+
+    def holders(self):
+        """
+        :returns dict: The name of the role each data disk of the
+            deployment is attached to, by media link.
+        """
+        roles = self._load()
+        with self._lock:
+            if self._holders is None:
+                self._holders = dict(
+                    (d.media_link, role_name)
+                    for (role_name, disks) in roles.items() for d in disks)
+            return self._holders
+
+    def _load(self):
+        with self._lock:
+            if self._roles is None:
+                roles = {}
+                for role in self._loader().role_list:
+                    roles[role.role_name] = \
+                        list(role.data_virtual_hard_disks)
+                self._roles = roles
+
+            return self._roles
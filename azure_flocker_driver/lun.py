@@ -1,7 +1,10 @@
-import subprocess
-import os
+import threading
+import time
 
-from twisted.python.filepath import FilePath
+from scsi import ScsiDevices, UnknownScsiDevice
+
+LUN_SLOTS = 32
+_ALL_SLOTS = (1 << LUN_SLOTS) - 1
 
 
 class Lun(object):
@@ -9,55 +12,157 @@ class Lun(object):
     device_path = ''
     lun = ''
 
+    # resolves LUNs to block devices for callers without their own
+    # ``ScsiDevices``
+    devices = ScsiDevices()
+
     def __init__():
         return
 
     @staticmethod
-    def rescan_scsi():
-        with open(os.devnull, 'w') as shutup:
-            subprocess.call(['fdisk', '-l'], stdout=shutup, stderr=shutup)
+    def get_device_path_for_lun(lun, devices=None):
+        """
+        Returns a FilePath representing the path of the device
+        with the sepcified LUN. The LUN is rescanned once if no device is
+        found there, for a disk attached since the kernel last probed it.
+        :param int lun: The LUN of the data disk
+        :param ScsiDevices devices: The resolver to use, ``Lun.devices``
+            by default.
+        :raises UnknownScsiDevice: If no device is attached at ``lun``.
+        return FilePath: The FilePath representing the attached disk
+        """
+        if not 0 <= lun < LUN_SLOTS:
+            raise Exception('valid lun parameter is 0 - 31, inclusive')
+        if devices is None:
+            devices = Lun.devices
+        try:
+            return devices.device_path(lun)
+        except UnknownScsiDevice:
+            devices.rescan(lun)
+            return devices.device_path(lun)
 
-    @staticmethod
-    def compute_next_lun(azure_service_client, service_name, role_name):
-        vm_info = azure_service_client.get_role(
-            service_name,
-            service_name,
-            role_name)
 
-        vm_info.data_virtual_hard_disks = \
-            sorted(vm_info.data_virtual_hard_disks, key=lambda obj:
-                   obj.lun)
-        lun = 0
-        for i in range(0, len(vm_info.data_virtual_hard_disks)):
-            next_lun = vm_info.data_virtual_hard_disks[i].lun
+class NoFreeLun(Exception):
+    """
+    Every LUN of the role is occupied or reserved.
+    :param unicode role_name: The name of the role
+    """
 
-            if next_lun - i >= 1:
-                lun = next_lun - 1
-                break
+    def __init__(self, role_name):
+        Exception.__init__(self, role_name)
+        self.role_name = role_name
 
-            if i == len(vm_info.data_virtual_hard_disks) - 1:
-                lun = next_lun + 1
-                break
 
-        return lun
+class LunAllocator(object):
+    """
+    Allocates LUN slots of Azure roles from a 32 slot bitmap.
 
-    # Returns a string representing the block device path based
-    # on a provided lun slot
+    The bitmap of a role is the union of the LUNs Azure reports in use and
+    the LUNs reserved for attaches still in flight. Reservations expire
+    after ``reservation_ttl`` seconds so a crashed attach cannot leak a
+    slot forever.
+    """
 
-    @staticmethod
-    def get_device_path_for_lun(lun):
+    LOWEST_FREE = 'lowest-free'
+    ROUND_ROBIN = 'round-robin'
+
+    def __init__(self, policy=LOWEST_FREE, reservation_ttl=600,
+                 clock=time.time):
         """
-        Returns a FilePath representing the path of the device
-        with the sepcified LUN. TODO: Is it valid to predict the
-        path based on the LUN?
-        return FilePath: The FilePath representing the attached disk
+        :param str policy: ``LOWEST_FREE`` to always pick the lowest free
+            slot, ``ROUND_ROBIN`` to pick the next free slot after the one
+            allocated last, which avoids reusing a slot Azure may still be
+            detaching.
+        :param float reservation_ttl: Seconds a reservation is held.
+        :param callable clock: Returns the current time in seconds.
         """
-        Lun.rescan_scsi()
-        if lun > 31:
-            raise Exception('valid lun parameter is 0 - 31, inclusive')
-        base = '/dev/sd'
+        if policy not in (self.LOWEST_FREE, self.ROUND_ROBIN):
+            raise ValueError('Unknown LUN policy: ' + str(policy))
+        self._policy = policy
+        self._reservation_ttl = reservation_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        # role name -> {blockdevice_id: (lun, expiry)}
+        self._reserved = {}
+        # role name -> the slot after the last allocated one
+        self._cursor = {}
+
+    def reserve(self, role_name, blockdevice_id, occupied_luns):
+        """
+        Choose and reserve a free LUN on a role.
+        :param unicode role_name: The role the volume is attached to
+        :param unicode blockdevice_id: The volume being attached
+        :param iterable occupied_luns: The LUNs Azure reports in use
+        :raises NoFreeLun: If every slot is occupied or reserved.
+        return int: The reserved LUN
+        """
+        with self._lock:
+            reserved = self._live_reservations(role_name)
+            used = _bitmap(occupied_luns)
+            for (other, (lun, expiry)) in reserved.items():
+                if other != blockdevice_id:
+                    used |= 1 << lun
+
+            start = 0
+            if self._policy == self.ROUND_ROBIN:
+                start = self._cursor.get(role_name, 0)
+
+            lun = _first_free(used, start)
+            if lun is None:
+                raise NoFreeLun(role_name)
+
+            reserved[blockdevice_id] = (
+                lun, self._clock() + self._reservation_ttl)
+            self._cursor[role_name] = (lun + 1) % LUN_SLOTS
+            return lun
+
+    def release(self, role_name, blockdevice_id):
+        """
+        Release the LUN reserved for a volume, once its attach has either
+        failed or become visible in the role.
+        """
+        with self._lock:
+            reserved = self._reserved.get(role_name, {})
+            reserved.pop(blockdevice_id, None)
+            if not reserved:
+                self._reserved.pop(role_name, None)
+
+    def reservations(self, role_name):
+        """
+        :returns dict: The LUN reserved for each volume attaching to the
+            role.
+        """
+        with self._lock:
+            return dict((b, lun) for (b, (lun, expiry))
+                        in self._live_reservations(role_name).items())
+
+    def _live_reservations(self, role_name):
+        now = self._clock()
+        reserved = self._reserved.setdefault(role_name, {})
+        for (b, (lun, expiry)) in reserved.items():
+            if expiry <= now:
+                del reserved[b]
+        return reserved
+
+
+def _bitmap(luns):
+    used = 0
+    for lun in luns:
+        if 0 <= lun < LUN_SLOTS:
+            used |= 1 << lun
+    return used
+
 
-        # luns go 0-31
-        ascii_base = ord('c')
+def _first_free(used, start):
+    """
+    :returns: The first slot not set in ``used`` at or after ``start``,
+        wrapping around, or ``None`` if every slot is set.
+    """
+    free = ~used & _ALL_SLOTS
+    if not free:
+        return None
 
-        return FilePath(base + chr(ascii_base + lun), False)
+    # rotate the bitmap right so ``start`` becomes bit 0
+    rotated = ((free >> start) | (free << (LUN_SLOTS - start))) & _ALL_SLOTS
+    lowest = (rotated & -rotated).bit_length() - 1
+    return (lowest + start) % LUN_SLOTS
@@ -0,0 +1,124 @@
+import threading
+import time
+
+from _logging import AZURE_CALL
+
+# upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# the messages of the errors the SDK raises for throttled requests
+_THROTTLING_MESSAGES = (
+    'Too Many Requests', 'Service Unavailable', 'Server Busy', 'ServerBusy')
+
+
+def is_throttled(error):
+    """
+    :param Exception error: An error raised by an Azure SDK call
+    :returns bool: Whether Azure refused the call because of throttling.
+    """
+    message = str(error)
+    return any(m in message for m in _THROTTLING_MESSAGES)
+
+
+class CallMetrics(object):
+    """
+    The number of calls, latency histogram, errors by class and throttled
+    responses of each endpoint, such as ``service.list_disks``.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        :param tuple buckets: The ascending upper bounds of the latency
+            histogram buckets in seconds, latencies above the last bound
+            are counted in an extra ``+Inf`` bucket.
+        """
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, elapsed, error=None):
+        """
+        :param str endpoint: The name of the endpoint called.
+        :param float elapsed: The seconds the call took.
+        :param Exception error: The error the call raised, if any.
+        """
+        with self._lock:
+            m = self._endpoints.get(endpoint)
+            if m is None:
+                m = self._endpoints[endpoint] = {
+                    'count': 0, 'seconds': 0.0, 'max': 0.0,
+                    'histogram': [0] * (len(self._buckets) + 1),
+                    'errors': {}, 'throttled': 0}
+
+            m['count'] += 1
+            m['seconds'] += elapsed
+            m['max'] = max(m['max'], elapsed)
+
+            i = 0
+            while i < len(self._buckets) and elapsed > self._buckets[i]:
+                i += 1
+            m['histogram'][i] += 1
+
+            if error is not None:
+                name = type(error).__name__
+                m['errors'][name] = m['errors'].get(name, 0) + 1
+                if is_throttled(error):
+                    m['throttled'] += 1
+
+    def snapshot(self):
+        """
+        :returns dict: For each endpoint its call count, total and
+            maximum seconds, the number of calls in each latency bucket
+            keyed by the bucket's upper bound, the errors by class and the
+            number of throttled calls.
+        """
+        bounds = [str(b) for b in self._buckets] + ['+Inf']
+        with self._lock:
+            snapshot = {}
+            for (endpoint, m) in self._endpoints.items():
+                snapshot[endpoint] = dict(
+                    m, histogram=dict(zip(bounds, m['histogram'])),
+                    errors=dict(m['errors']))
+            return snapshot
+
+
+class InstrumentedClient(object):
+    """
+    A proxy for an Azure SDK client which times every method call,
+    records it in a ``CallMetrics`` and logs it as an eliot action.
+    """
+
+    def __init__(self, client, name, metrics, logger=None,
+                 clock=time.time):
+        """
+        :param client: The ``ServiceManagementService`` or ``BlobService``
+            to proxy.
+        :param str name: The prefix of the endpoint names of the client.
+        :param CallMetrics metrics: Where calls are recorded.
+        :param Logger logger: The eliot logger actions are written to.
+        """
+        self._client = client
+        self._name = name
+        self._metrics = metrics
+        self._logger = logger
+        self._clock = clock
+
+    def __getattr__(self, attribute):
+        value = getattr(self._client, attribute)
+        if attribute.startswith('_') or not callable(value):
+            return value
+
+        endpoint = self._name + '.' + attribute
+
+        def call(*args, **kwargs):
+            start = self._clock()
+            with AZURE_CALL(self._logger, endpoint=endpoint):
+                try:
+                    result = value(*args, **kwargs)
+                except Exception as e:
+                    self._metrics.record(endpoint, self._clock() - start, e)
+                    raise
+            self._metrics.record(endpoint, self._clock() - start)
+            return result
+
+        return call
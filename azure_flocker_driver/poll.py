@@ -0,0 +1,225 @@
+import random
+import threading
+import time
+
+from twisted.internet.defer import inlineCallbacks, maybeDeferred, returnValue
+from twisted.internet.task import deferLater
+
+from _logging import POLL_WAIT, POLLED
+
+
+class AsynchronousTimeout(Exception):
+
+    def __init__(self):
+        pass
+
+
+class Poller(object):
+    """
+    Polls a condition with exponential backoff and jitter until it holds
+    or a wall-clock deadline passes.
+
+    All waits sharing a ``Poller`` also share its rate limit, so however
+    many waits are in flight the driver never polls Azure more than
+    ``max_rate`` times per second.
+
+    Each wait is logged as a ``POLL_WAIT`` action. Individual polls are
+    only logged when their number is a power of two, so a wait logs
+    a number of messages logarithmic in its number of polls.
+    """
+
+    def __init__(self, timeout, initial_delay=0.5, max_delay=10,
+                 factor=2, jitter=0.2, max_rate=None,
+                 clock=time.time, sleep=time.sleep, random=random.random,
+                 logger=None):
+        """
+        :param float timeout: Seconds after which a wait gives up.
+        :param float initial_delay: Seconds to sleep after the first poll.
+        :param float max_delay: Upper bound of the backoff delay.
+        :param float factor: Multiplier applied to the delay after each
+            poll.
+        :param float jitter: Fraction of the delay to randomly add or
+            remove, so concurrent waits do not poll in lock step.
+        :param float max_rate: Maximum number of polls per second across
+            all waits, ``None`` for no limit.
+        :param Logger logger: The eliot logger waits are written to.
+        """
+        self._timeout = timeout
+        self._initial_delay = initial_delay
+        self._max_delay = max_delay
+        self._factor = factor
+        self._jitter = jitter
+        self._min_interval = 1.0 / max_rate if max_rate else 0
+        self._clock = clock
+        self._sleep = sleep
+        self._random = random
+        self._lock = threading.Lock()
+        self._next_slot = 0
+        self._metrics = {}
+        self._logger = logger
+
+    def wait(self, name, check, timeout=None):
+        """
+        Call ``check`` until it returns a true value.
+        :param str name: The name the wait is reported under in the
+            metrics.
+        :param callable check: A no argument callable polled for
+            completion.
+        :param float timeout: Seconds after which this wait gives up,
+            instead of the timeout of the poller.
+        :raises AsynchronousTimeout: If ``check`` does not succeed before
+            the deadline.
+        :returns: The first true value returned by ``check``.
+        """
+        start = self._clock()
+        deadline = start + (self._timeout if timeout is None else timeout)
+        delay = self._initial_delay
+        polls = 0
+
+        with POLL_WAIT(self._logger, wait=name) as action:
+            while True:
+                self._sleep(self._reserve_slot())
+                polls += 1
+                self._log_poll(name, polls)
+                result = check()
+                if result:
+                    self._finish(action, name, polls, start)
+                    return result
+
+                now = self._clock()
+                if now >= deadline:
+                    self._record(name, polls, now - start)
+                    raise AsynchronousTimeout()
+
+                self._sleep(min(self._jittered(delay), deadline - now))
+                delay = min(delay * self._factor, self._max_delay)
+
+    def retry(self, name, f, exceptions, retryable=None):
+        """
+        Call ``f``, retrying with backoff for as long as it raises one of
+        ``exceptions`` and the deadline has not passed.
+        :param str name: The name the retries are reported under in the
+            metrics.
+        :param callable f: A no argument callable.
+        :param tuple exceptions: The exception types worth retrying.
+        :param callable retryable: Called with an error of one of
+            ``exceptions``, whether it is worth retrying. Every such error
+            is by default.
+        :returns: The result of ``f``.
+        """
+        errors = []
+
+        def attempt():
+            try:
+                return (f(),)
+            except exceptions as e:
+                if retryable is not None and not retryable(e):
+                    raise
+                errors.append(e)
+                return None
+
+        try:
+            return self.wait(name, attempt)[0]
+        except AsynchronousTimeout:
+            raise errors[-1]
+
+    @inlineCallbacks
+    def wait_deferred(self, reactor, name, check, timeout=None):
+        """
+        Like ``wait`` but sleeps with ``reactor.callLater`` instead of
+        blocking the calling thread.
+        :param IReactorTime reactor: The reactor to schedule polls with.
+        :param str name: The name the wait is reported under in the
+            metrics.
+        :param callable check: A no argument callable polled for
+            completion, it may return a ``Deferred``.
+        :param float timeout: Seconds after which this wait gives up,
+            instead of the timeout of the poller.
+        :returns: A ``Deferred`` firing with the first true value returned
+            by ``check``, or failing with ``AsynchronousTimeout``.
+        """
+        start = self._clock()
+        deadline = start + (self._timeout if timeout is None else timeout)
+        delay = self._initial_delay
+        polls = 0
+
+        # the action spans several reactor turns, so it is finished
+        # explicitly rather than used as a context manager
+        action = POLL_WAIT(self._logger, wait=name)
+        try:
+            while True:
+                yield deferLater(reactor, self._reserve_slot(), lambda: None)
+                polls += 1
+                # the reactor resumes this wait outside of its action,
+                # which the poll is logged and made within
+                with action.context():
+                    self._log_poll(name, polls)
+                    d = maybeDeferred(check)
+                result = yield d
+                if result:
+                    break
+
+                now = self._clock()
+                if now >= deadline:
+                    self._record(name, polls, now - start)
+                    raise AsynchronousTimeout()
+
+                yield deferLater(
+                    reactor, min(self._jittered(delay), deadline - now),
+                    lambda: None)
+                delay = min(delay * self._factor, self._max_delay)
+        except Exception as e:
+            action.finish(e)
+            raise
+
+        self._finish(action, name, polls, start)
+        action.finish()
+        returnValue(result)
+
+    def stats(self):
+        """
+        :returns dict: For each wait name, the number of waits, the total
+            number of polls and the total elapsed seconds, plus the polls
+            and elapsed seconds of the most recent wait.
+        """
+        with self._lock:
+            return dict((name, dict(m)) for (name, m)
+                        in self._metrics.items())
+
+    def _log_poll(self, name, polls):
+        # only the polls numbered by a power of two are logged
+        if polls > 1 and polls & (polls - 1) == 0:
+            POLLED(wait=name, polls=polls).write(self._logger)
+
+    def _finish(self, action, name, polls, start):
+        elapsed = self._clock() - start
+        self._record(name, polls, elapsed)
+        action.add_success_fields(polls=polls, duration=float(elapsed))
+
+    def _jittered(self, delay):
+        return delay * (1 + self._jitter * (2 * self._random() - 1))
+
+    def _reserve_slot(self):
+        """
+        Reserve the next poll slot allowed by the rate limit.
+        :returns float: The number of seconds to wait for the slot.
+        """
+        if not self._min_interval:
+            return 0
+
+        with self._lock:
+            now = self._clock()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._min_interval
+
+        return slot - now
+
+    def _record(self, name, polls, elapsed):
+        with self._lock:
+            m = self._metrics.setdefault(
+                name, {'waits': 0, 'polls': 0, 'elapsed': 0.0})
+            m['waits'] += 1
+            m['polls'] += polls
+            m['elapsed'] += elapsed
+            m['last_polls'] = polls
+            m['last_elapsed'] = elapsed
@@ -0,0 +1,183 @@
+from collections import deque, namedtuple
+import threading
+import time
+
+from eliot import write_traceback
+
+# A pre-created blob waiting in a ``WarmPool``, ``kind`` is the kind it
+# was provisioned for and ``lease_id`` the id of the lease the pool holds
+# on it.
+PoolEntry = namedtuple(
+    'PoolEntry', ['name', 'kind', 'lease_id', 'created'])
+
+
+class WarmPool(object):
+    """
+    Keeps ``depth`` pre-created blobs of each of a few kinds, like the
+    common sizes of volumes, so volumes of those kinds are created without
+    waiting for a blob to be provisioned.
+
+    Claimed entries are handed back with ``retire`` once the caller is
+    done with them. Entries older than ``max_age`` are evicted. Both are
+    discarded, and the pool topped up again, by ``refill``, which a
+    background thread runs after every claim and every ``interval``
+    seconds.
+    """
+
+    def __init__(self, kinds, depth, max_age, provision, discard,
+                 cleanup=None, interval=60, clock=time.time):
+        """
+        :param iterable kinds: The kinds of the pooled blobs.
+        :param int depth: The number of blobs kept of each kind.
+        :param float max_age: Seconds after which an unclaimed entry is
+            evicted, ``0`` to keep entries until they are claimed.
+        :param callable provision: Called with a kind, creates a blob of
+            that kind and returns its ``PoolEntry``.
+        :param callable discard: Called with a ``PoolEntry``, deletes its
+            blob.
+        :param callable cleanup: Called once before the first refill, to
+            delete the blobs left behind by an earlier pool.
+        :param float interval: Seconds between two refills while the pool
+            is not claimed from.
+        """
+        self._depth = depth
+        self._max_age = max_age
+        self._provision = provision
+        self._discard = discard
+        self._cleanup = cleanup
+        self._interval = interval
+        self._clock = clock
+        self._condition = threading.Condition()
+        # kind -> deque of PoolEntry, oldest first
+        self._entries = dict((kind, deque()) for kind in kinds)
+        self._retired = []
+        # whether a claim or retire happened since the last refill began
+        self._changed = False
+        self._thread = None
+        self._stopped = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.provisioned = 0
+        self.failures = 0
+
+    def claim(self, kind):
+        """
+        Take an entry of ``kind`` out of the pool.
+        :param kind: The kind of the blob wanted.
+        :returns: A ``PoolEntry``, or ``None`` if the pool has none of
+            that kind.
+        """
+        with self._condition:
+            entries = self._entries.get(kind)
+            if not entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry = entries.popleft()
+            self._changed = True
+            self._condition.notify()
+            return entry
+
+    def retire(self, entry):
+        """
+        Hand back a claimed entry for its blob to be discarded.
+        :param PoolEntry entry: The entry
+        """
+        with self._condition:
+            self._retired.append(entry)
+            self._changed = True
+            self._condition.notify()
+
+    def refill(self):
+        """
+        Discard the retired and expired entries and provision new ones
+        until the pool holds ``depth`` entries of each kind.
+        """
+        with self._condition:
+            self._changed = False
+            discarded = self._retired
+            self._retired = []
+            if self._max_age:
+                now = self._clock()
+                for entries in self._entries.values():
+                    while entries and \
+                            now - entries[0].created >= self._max_age:
+                        discarded.append(entries.popleft())
+                        self.evictions += 1
+            wanted = [(kind, self._depth - len(entries))
+                      for (kind, entries) in self._entries.items()]
+
+        for entry in discarded:
+            self._attempt(self._discard, entry)
+
+        for (kind, missing) in wanted:
+            for i in range(missing):
+                entry = self._attempt(self._provision, kind)
+                if entry is None:
+                    # retried at the next refill
+                    break
+                with self._condition:
+                    self.provisioned += 1
+                    self._entries[kind].append(entry)
+
+    def start(self):
+        """
+        Refill the pool from a daemon thread.
+        """
+        if self._thread is not None:
+            return
+
+        self._thread = threading.Thread(
+            target=self._run, name='azure-flocker-warm-pool')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the refill thread, the pooled blobs are left in place.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def stats(self):
+        """
+        :returns dict: The hit, miss, eviction, provisioning and failure
+            counters of the pool and the number of entries available of
+            each kind.
+        """
+        with self._condition:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'provisioned': self.provisioned,
+                'failures': self.failures,
+                'available': dict((kind, len(entries)) for (kind, entries)
+                                  in self._entries.items()),
+            }
+
+    def _attempt(self, f, arg):
+        try:
+            return f(arg)
+        except Exception:
+            write_traceback(None, u'azure_flocker_driver:pool')
+            with self._condition:
+                self.failures += 1
+            return None
+
+    def _run(self):
+        if self._cleanup is not None:
+            self._attempt(lambda arg: self._cleanup(), None)
+
+        while True:
+            self.refill()
+            with self._condition:
+                # a refill which failed is only retried after the
+                # interval, unless the pool is claimed from meanwhile
+                if not self._changed and not self._stopped:
+                    self._condition.wait(self._interval)
+                if self._stopped:
+                    return
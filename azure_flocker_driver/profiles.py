@@ -0,0 +1,65 @@
+from collections import namedtuple
+
+STANDARD = 'standard'
+PREMIUM = 'premium'
+
+# the host caching modes of Azure data disks
+HOST_CACHING_MODES = ('None', 'ReadOnly', 'ReadWrite')
+
+# The storage tier and host caching of a volume. ``host_caching`` ``None``
+# leaves the mode of the disk to Azure. ``tier_rounding`` rounds the size of
+# a premium volume created with the profile up to its premium tier.
+VolumeProfile = namedtuple(
+    'VolumeProfile', ['name', 'tier', 'host_caching', 'tier_rounding'])
+
+# the profiles flocker asks for, see flocker's ``MandatoryProfiles``
+DEFAULT_PROFILES = dict((p.name, p) for p in [
+    VolumeProfile(u'gold', PREMIUM, 'ReadOnly', False),
+    VolumeProfile(u'silver', PREMIUM, 'None', False),
+    VolumeProfile(u'bronze', STANDARD, 'None', False),
+    VolumeProfile(u'default', STANDARD, None, False),
+])
+
+# the premium storage disk sizes in GiB, each faster than the one before
+PREMIUM_TIERS = (('P10', 128), ('P20', 512), ('P30', 1024))
+
+GiB = 1024 * 1024 * 1024
+
+
+def load_profiles(config):
+    """
+    :param dict config: Profile names mapped to a ``dict`` of their
+        ``tier``, ``host_caching`` and ``tier_rounding``, added to or
+        replacing the default profiles.
+    :raises ValueError: If a profile has an unknown tier or caching mode.
+    :returns dict: The ``VolumeProfile``s by name.
+    """
+    profiles = dict(DEFAULT_PROFILES)
+    for (name, settings) in (config or {}).items():
+        profile = VolumeProfile(
+            name=unicode(name),
+            tier=settings.get('tier', STANDARD),
+            host_caching=settings.get('host_caching'),
+            tier_rounding=bool(settings.get('tier_rounding', False)))
+        if profile.tier not in (STANDARD, PREMIUM):
+            raise ValueError('Unknown storage tier: ' + str(profile.tier))
+        if profile.host_caching not in HOST_CACHING_MODES + (None,):
+            raise ValueError(
+                'Unknown host caching mode: ' + str(profile.host_caching))
+        profiles[profile.name] = profile
+    return profiles
+
+
+def premium_size(size):
+    """
+    Azure provisions, bills and throttles a premium disk as the smallest
+    tier it fits in, so rounding its size up to that tier is free and
+    leaves room to grow.
+    :param int size: The size requested in bytes
+    :returns int: The size of the smallest premium tier holding ``size``,
+        or ``size`` itself if it is larger than every tier.
+    """
+    for (name, gib) in PREMIUM_TIERS:
+        if size <= gib * GiB:
+            return gib * GiB
+    return size
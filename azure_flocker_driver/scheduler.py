@@ -0,0 +1,206 @@
+from collections import deque
+import threading
+import time
+
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.python.failure import Failure
+
+
+class _Entry(object):
+
+    def __init__(self, operation, queued_at, f=None):
+        self.operation = operation
+        self.queued_at = queued_at
+        self.f = f
+        self.state = 'queued'
+        self.result = None
+        self.error = None
+        # the Deferreds fired with the outcome, by DeferredOperationScheduler
+        self.waiters = []
+
+
+class OperationScheduler(object):
+    """
+    Serializes the mutating operations issued against each cloud service
+    deployment.
+
+    Azure rejects an operation on a deployment while another one is in
+    progress, so rather than letting concurrent callers collide and retry,
+    operations wait in a queue per deployment and run one at a time.
+
+    An operation identical to one still waiting in the queue is coalesced
+    with it rather than run again: it waits for the queued operation and
+    fails with its error, or, should it succeed, with the error the
+    repeated operation would have raised, such as ``AlreadyAttachedVolume``
+    for a second attach.
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._condition = threading.Condition()
+        # deployment name -> deque of _Entry, the head runs next
+        self._queues = {}
+        self._metrics = {}
+
+    def run(self, deployment, operation, f, repeat_error=None):
+        """
+        Run ``f`` once every operation queued before it on the same
+        deployment has completed.
+        :param unicode deployment: The name of the deployment
+        :param tuple operation: The kind of operation, the blockdevice_id
+            it applies to and any further arguments, used to coalesce
+            operations.
+        :param callable f: A no argument callable performing the operation.
+        :param Exception repeat_error: The error running the operation a
+            second time raises. An operation without one is never
+            coalesced.
+        :raises: The error of ``f``, or ``repeat_error`` if the operation
+            was coalesced with one which succeeded.
+        :returns: The result of ``f``.
+        """
+        with self._condition:
+            queue = self._queues.setdefault(deployment, deque())
+            metrics = self._metrics_for(deployment)
+
+            if repeat_error is not None:
+                shared = self._coalesce(queue, metrics, operation)
+                if shared is not None:
+                    while shared.state != 'done':
+                        self._condition.wait()
+                    if shared.error is not None:
+                        raise shared.error
+                    raise repeat_error
+
+            entry = _Entry(operation, self._clock())
+            queue.append(entry)
+            metrics['max_depth'] = max(metrics['max_depth'], len(queue))
+
+            while queue[0] is not entry:
+                self._condition.wait()
+
+            entry.state = 'running'
+            metrics['operations'] += 1
+            metrics['wait_time'] += self._clock() - entry.queued_at
+
+        try:
+            entry.result = f()
+        except Exception as e:
+            entry.error = e
+
+        with self._condition:
+            entry.state = 'done'
+            queue.popleft()
+            self._condition.notify_all()
+
+        if entry.error is not None:
+            raise entry.error
+        return entry.result
+
+    def stats(self):
+        """
+        :returns dict: For each deployment the current and maximum queue
+            depth, the number of operations run, the total seconds they
+            spent queued and the number of operations coalesced away.
+        """
+        with self._condition:
+            stats = {}
+            for (deployment, m) in self._metrics.items():
+                stats[deployment] = dict(
+                    m, depth=len(self._queues.get(deployment, ())))
+            return stats
+
+    def _metrics_for(self, deployment):
+        return self._metrics.setdefault(deployment, {
+            'max_depth': 0, 'operations': 0, 'wait_time': 0.0,
+            'coalesced': 0})
+
+    def _coalesce(self, queue, metrics, operation):
+        """
+        :returns: The queued entry identical to ``operation``, or ``None``
+            if the operation has to be queued.
+        """
+        for entry in queue:
+            if entry.state == 'queued' and entry.operation == operation:
+                metrics['coalesced'] += 1
+                return entry
+        return None
+
+
+class DeferredOperationScheduler(OperationScheduler):
+    """
+    An ``OperationScheduler`` for operations returning ``Deferred``s, run
+    from the reactor thread.
+
+    No thread waits in the queue: the next operation on a deployment is
+    started once the ``Deferred`` of the previous one fired.
+    """
+
+    def run(self, deployment, operation, f, repeat_error=None):
+        """
+        Run ``f`` once every operation queued before it on the same
+        deployment has completed.
+        :param unicode deployment: The name of the deployment
+        :param tuple operation: The kind of operation, the blockdevice_id
+            it applies to and any further arguments, used to coalesce
+            operations.
+        :param callable f: A no argument callable performing the operation,
+            returning a ``Deferred``.
+        :param Exception repeat_error: The error running the operation a
+            second time raises. An operation without one is never
+            coalesced.
+        :returns: A ``Deferred`` firing with the result of ``f``, or
+            failing with its error, or with ``repeat_error`` if the
+            operation was coalesced with one which succeeded.
+        """
+        d = Deferred()
+        with self._condition:
+            queue = self._queues.setdefault(deployment, deque())
+            metrics = self._metrics_for(deployment)
+
+            if repeat_error is not None:
+                shared = self._coalesce(queue, metrics, operation)
+                if shared is not None:
+                    shared.waiters.append(d)
+
+                    def repeated(result):
+                        raise repeat_error
+                    return d.addCallback(repeated)
+
+            entry = _Entry(operation, self._clock(), f)
+            entry.waiters.append(d)
+            queue.append(entry)
+            metrics['max_depth'] = max(metrics['max_depth'], len(queue))
+            idle = len(queue) == 1
+
+        if idle:
+            self._start(deployment)
+        return d
+
+    def _start(self, deployment):
+        """
+        Start the operation at the head of the queue of ``deployment``.
+        """
+        with self._condition:
+            queue = self._queues[deployment]
+            if not queue:
+                return
+            entry = queue[0]
+            entry.state = 'running'
+            metrics = self._metrics_for(deployment)
+            metrics['operations'] += 1
+            metrics['wait_time'] += self._clock() - entry.queued_at
+
+        d = maybeDeferred(entry.f)
+        d.addBoth(self._finished, deployment, entry)
+
+    def _finished(self, result, deployment, entry):
+        with self._condition:
+            entry.state = 'done'
+            self._queues[deployment].popleft()
+
+        for waiter in entry.waiters:
+            if isinstance(result, Failure):
+                waiter.errback(result)
+            else:
+                waiter.callback(result)
+        self._start(deployment)
@@ -0,0 +1,283 @@
+import threading
+import time
+
+from twisted.python.filepath import FilePath
+
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+# The OS disk and the resource disk, the SCSI hosts holding them are not
+# used for data disks.
+_SYSTEM_DEVICES = frozenset(['sda', 'sdb'])
+
+# The driver of the Hyper-V SCSI controllers data disks are attached to,
+# unlike the IDE controller of the provisioning CD-ROM.
+_VMBUS_DRIVER = 'storvsc'
+
+
+class UnknownScsiDevice(Exception):
+    """
+    No block device is attached at a LUN of the data disk SCSI host.
+    :param int lun: The LUN
+    """
+
+    def __init__(self, lun):
+        Exception.__init__(self, lun)
+        self.lun = lun
+
+
+class ScsiDevices(object):
+    """
+    Resolves the block device attached at a LUN from the SCSI addresses
+    sysfs lists under ``class/scsi_device``.
+
+    Each entry there is named after the host:channel:target:lun address of
+    a SCSI device and its ``device/block`` directory holds the name of the
+    block device. Azure data disks are attached to their own SCSI host
+    with the LUN of the data disk as the SCSI LUN. Only the devices of
+    that one host are mapped, so a device of another host with the same
+    LUN is never returned for a data disk.
+
+    The mapping from LUN to block device is cached. A cached device is
+    checked to still be present at its address before it is returned and
+    the cache is rebuilt when it is not, or when udev reports a block
+    device was added or removed. Every wait shares the one udev monitor
+    doing so.
+    """
+
+    def __init__(self, sysfs=FilePath('/sys'), dev=FilePath('/dev'),
+                 host=None, poll_interval=0.1, clock=time.time,
+                 sleep=time.sleep):
+        """
+        :param FilePath sysfs: Where sysfs is mounted.
+        :param FilePath dev: The directory holding device nodes.
+        :param int host: The number of the SCSI host data disks are
+            attached to, or ``None`` to use the lowest numbered VMBus SCSI
+            host which does not hold the OS or resource disk.
+        :param float poll_interval: Seconds between checks for a device
+            while waiting for it without ``pyudev``.
+        """
+        self._sysfs = sysfs
+        self._dev = dev
+        self._host = host
+        self._poll_interval = poll_interval
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        # lun -> (address, block device name)
+        self._devices = None
+        # the host found by the last scan when none is configured
+        self._data_host = None
+        self._observer = None
+        # bumped on every udev event, guarded by _events
+        self._events = threading.Condition()
+        self._generation = 0
+
+    def device_path(self, lun):
+        """
+        :param int lun: The LUN of the data disk
+        :raises UnknownScsiDevice: If no block device is attached at
+            ``lun``.
+        :returns FilePath: The path of the block device
+        """
+        with self._lock:
+            if self._devices is None or not self._present(lun):
+                self._devices = self._scan()
+
+            if lun not in self._devices:
+                raise UnknownScsiDevice(lun)
+
+            (address, name) = self._devices[lun]
+            return self._dev.child(name)
+
+    def rescan(self, lun):
+        """
+        Ask the data disk SCSI host to probe a single LUN, so a disk
+        Azure just attached there is discovered without scanning every
+        device on the node.
+        :param int lun: The LUN to probe
+        """
+        host = self._host
+        if host is None:
+            with self._lock:
+                if self._devices is None:
+                    self._devices = self._scan()
+                host = self._data_host
+        if host is None:
+            return
+
+        scan = self._sysfs.descendant(
+            ['class', 'scsi_host', 'host%d' % host, 'scan'])
+        try:
+            with scan.open('w') as f:
+                # any channel and target, only the given LUN
+                f.write('- - %d' % lun)
+        except (IOError, OSError):
+            pass
+
+    def wait_for_device(self, lun, timeout, size=None):
+        """
+        Rescan ``lun`` and wait for the node of its block device to
+        appear. With ``pyudev`` the wait wakes on the udev block events
+        ``watch`` receives, otherwise sysfs is checked every
+        ``poll_interval`` seconds.
+        :param int lun: The LUN of the data disk
+        :param float timeout: Seconds to wait for the device.
+        :param int size: The size in bytes of the disk expected at
+            ``lun``, a device of another size being a stale one which has
+            not been replaced yet. ``None`` accepts any device.
+        :raises UnknownScsiDevice: If no device appears within
+            ``timeout``.
+        :returns FilePath: The path of the block device
+        """
+        # started before the rescan so no event can be missed
+        watching = self.watch()
+        with self._events:
+            generation = self._generation
+
+        self.rescan(lun)
+        deadline = self._clock() + timeout
+
+        while True:
+            try:
+                path = self.device_path(lun)
+                if path.exists() and self._has_size(path.basename(), size):
+                    return path
+            except UnknownScsiDevice:
+                pass
+
+            remaining = deadline - self._clock()
+            if remaining <= 0:
+                raise UnknownScsiDevice(lun)
+
+            if watching:
+                with self._events:
+                    if self._generation == generation:
+                        self._events.wait(remaining)
+                    generation = self._generation
+            else:
+                self._sleep(min(self._poll_interval, remaining))
+
+    def invalidate(self):
+        """
+        Discard the cached mapping, it is rebuilt on the next lookup.
+        """
+        with self._lock:
+            self._devices = None
+        with self._events:
+            self._generation += 1
+            self._events.notify_all()
+
+    def watch(self):
+        """
+        Invalidate the cache whenever udev reports a block device event.
+        A single udev monitor is opened however many times this is called.
+        Does nothing if ``pyudev`` is not installed.
+        :returns bool: Whether udev events are watched.
+        """
+        if pyudev is None:
+            return False
+
+        with self._events:
+            if self._observer is None:
+                monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+                monitor.filter_by('block')
+                self._observer = pyudev.MonitorObserver(
+                    monitor, callback=lambda device: self.invalidate())
+                self._observer.daemon = True
+                self._observer.start()
+        return True
+
+    def _has_size(self, name, size):
+        """
+        :param str name: The name of a block device
+        :returns bool: Whether the device holds a disk of ``size`` bytes,
+            which Azure exposes without its 512 byte VHD footer.
+        """
+        if size is None:
+            return True
+        try:
+            # in 512 byte sectors, whatever the sector size of the device
+            sectors = int(self._sysfs.descendant(
+                ['class', 'block', name, 'size']).getContent())
+        except (IOError, OSError, ValueError):
+            return False
+        return size - 512 <= sectors * 512 <= size
+
+    def _present(self, lun):
+        """
+        :returns bool: Whether the cached device for ``lun`` is still
+            attached at its address.
+        """
+        if lun not in self._devices:
+            return False
+        (address, name) = self._devices[lun]
+        return self._block(address).child(name).exists()
+
+    def _find_data_host(self, hosts, system_hosts):
+        """
+        :param set hosts: The numbers of the SCSI hosts with devices
+            attached, to which the hosts sysfs lists are added.
+        :param set system_hosts: The numbers of the SCSI hosts holding the
+            OS or resource disk.
+        :returns: The number of the lowest numbered VMBus SCSI host
+            without a system disk, or ``None`` if there is none.
+        """
+        hosts = set(hosts)
+        scsi_hosts = self._sysfs.descendant(['class', 'scsi_host'])
+        if scsi_hosts.isdir():
+            for name in scsi_hosts.listdir():
+                if name.startswith('host') and name[len('host'):].isdigit():
+                    hosts.add(int(name[len('host'):]))
+
+        for host in sorted(hosts - system_hosts):
+            proc_name = scsi_hosts.descendant(['host%d' % host, 'proc_name'])
+            try:
+                driver = proc_name.getContent().strip()
+            except (IOError, OSError):
+                # no driver reported, taken for a VMBus host
+                driver = _VMBUS_DRIVER
+            if driver == _VMBUS_DRIVER:
+                return host
+        return None
+
+    def _block(self, address):
+        return self._sysfs.descendant(
+            ['class', 'scsi_device', address, 'device', 'block'])
+
+    def _scan(self):
+        """
+        :returns dict: The address and block device name of every device
+            on the data disk SCSI host, by LUN.
+        """
+        scsi_devices = self._sysfs.descendant(['class', 'scsi_device'])
+        if not scsi_devices.isdir():
+            if self._host is None:
+                self._data_host = self._find_data_host(set(), set())
+            return {}
+
+        # host -> {lun: (address, block device name)}
+        hosts = {}
+        system_hosts = set()
+        for address in scsi_devices.listdir():
+            try:
+                (host, channel, target, lun) = [
+                    int(part) for part in address.split(':')]
+            except ValueError:
+                continue
+
+            block = self._block(address)
+            if not block.isdir():
+                continue
+            for name in block.listdir():
+                if name in _SYSTEM_DEVICES:
+                    system_hosts.add(host)
+                hosts.setdefault(host, {})[lun] = (address, name)
+
+        host = self._host
+        if host is None:
+            self._data_host = host = self._find_data_host(
+                set(hosts), system_hosts)
+        return hosts.get(host, {})
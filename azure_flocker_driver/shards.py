@@ -0,0 +1,106 @@
+import hashlib
+
+from profiles import STANDARD
+
+
+class Shard(object):
+    """
+    A container of a storage account volumes are placed in.
+
+    Azure caps the IOPS and bandwidth of each storage account, spreading
+    the volumes of a cluster over several accounts raises the cap.
+    """
+
+    def __init__(self, account_name, container_name, client,
+                 tier=STANDARD):
+        """
+        :param str account_name: The name of the storage account.
+        :param str container_name: The name of the container of the disks.
+        :param BlobService client: The blob client of the account.
+        :param str tier: The storage tier of the account, ``standard`` or
+            ``premium``.
+        """
+        self.account_name = account_name
+        self.container_name = container_name
+        self.client = client
+        self.tier = tier
+        self.name = account_name + '/' + container_name
+        self._prefix = self.url('')
+
+    def url(self, blob_name):
+        """
+        :param string blob_name: The name of a blob of the container
+        :returns string: The URL of the blob.
+        """
+        return 'https://' + self.account_name \
+            + '.blob.core.windows.net/' + self.container_name \
+            + '/' + blob_name
+
+    def owns(self, media_link):
+        """
+        :param string media_link: The URL of the blob of a disk
+        :returns bool: Whether the blob is in this shard.
+        """
+        return media_link.startswith(self._prefix)
+
+    def __repr__(self):
+        return '<Shard {}>'.format(self.name)
+
+
+class Placement(object):
+    """
+    Chooses the shard a new volume is placed in.
+    """
+
+    HASH = 'hash'
+    LEAST_VOLUMES = 'least-volumes'
+    LEAST_SIZE = 'least-size'
+
+    def __init__(self, shards, policy=HASH):
+        """
+        :param list shards: The ``Shard``s volumes are placed in.
+        :param str policy: ``HASH`` to place a volume by a hash of its
+            dataset id, so its shard is known without any listing,
+            ``LEAST_VOLUMES`` or ``LEAST_SIZE`` to place it in the shard
+            holding the fewest volumes, or bytes of provisioned volumes.
+        """
+        if policy not in (self.HASH, self.LEAST_VOLUMES, self.LEAST_SIZE):
+            raise ValueError('Unknown placement policy: ' + str(policy))
+        self.shards = list(shards)
+        self.policy = policy
+
+    @property
+    def needs_loads(self):
+        """
+        Whether ``choose`` needs the load of the shards.
+        """
+        return self.policy != self.HASH and len(self.shards) > 1
+
+    def hashed(self, dataset_id, shards=None):
+        """
+        :param UUID dataset_id: The dataset id of a volume
+        :param list shards: The shards to choose from, every shard by
+            default.
+        :returns Shard: The shard the volume is placed in by ``HASH``.
+        """
+        shards = shards or self.shards
+        digest = hashlib.md5(str(dataset_id)).hexdigest()
+        return shards[int(digest, 16) % len(shards)]
+
+    def choose(self, dataset_id, loads=None, shards=None):
+        """
+        :param UUID dataset_id: The dataset id of the new volume
+        :param dict loads: The number of volumes and the provisioned bytes
+            of each shard by name, required when ``needs_loads``.
+        :param list shards: The shards to choose from, every shard by
+            default.
+        :returns Shard: The shard to place the volume in.
+        """
+        shards = shards or self.shards
+        if self.policy == self.HASH or len(shards) == 1:
+            return self.hashed(dataset_id, shards)
+
+        i = 0 if self.policy == self.LEAST_VOLUMES else 1
+        # ties go to the first shard listed
+        return min(shards,
+                   key=lambda s: loads.get(s.name, (0, 0))[i])
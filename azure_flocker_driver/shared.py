@@ -0,0 +1,247 @@
+from collections import namedtuple
+import json
+import threading
+import time
+from uuid import uuid4
+
+from azure import WindowsAzureConflictError, WindowsAzureError, \
+    WindowsAzureMissingResourceError
+from eliot import write_traceback
+
+# the blob whose lease elects the leader and which holds the snapshot it
+# publishes, named so it is not listed as a volume
+INVENTORY_BLOB = 'flockerinventory'
+
+# seconds a leader holds the lease without renewing it, azure accepts 15
+# to 60
+LEASE_DURATION = 30
+
+# the format of the published snapshots
+SNAPSHOT_FORMAT = 1
+
+# An inventory published by the leader. ``version`` changes with the
+# volumes only, ``polled_at`` is when the leader started the poll they
+# were listed by and ``volumes`` holds the ``blockdevice_id``, size and
+# role of each volume.
+InventorySnapshot = namedtuple(
+    'InventorySnapshot', ['version', 'leader', 'polled_at', 'volumes'])
+
+
+class SharedInventory(object):
+    """
+    Shares the inventory polled by one node with the rest of the cluster,
+    so the Service Management API is polled by one node whatever the size
+    of the cluster.
+
+    Every node tries to acquire a lease on ``INVENTORY_BLOB`` every
+    ``interval`` seconds. The node holding it is the leader: it renews the
+    lease, polls Azure and publishes what it found as the content of the
+    blob, which takes the lease, so a leader which lost it can no longer
+    publish. Should the leader stop renewing its lease, another node
+    acquires it once it expired.
+    """
+
+    def __init__(self, shard, instance_id, poll, interval=10, max_age=30,
+                 clock=time.time):
+        """
+        :param Shard shard: The shard holding the lease and snapshot blobs.
+        :param unicode instance_id: The name of this node.
+        :param callable poll: Called by the leader, lists the volumes of
+            the cluster as ``(blockdevice_id, size, attached_to)`` tuples.
+        :param float interval: Seconds between two polls of the leader.
+        :param float max_age: Seconds after which a snapshot is too old to
+            be used.
+        """
+        self._shard = shard
+        self._instance_id = instance_id
+        self._poll = poll
+        self._interval = interval
+        self._max_age = max_age
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._lease_id = None
+        self._published = None
+        self._thread = None
+        self._stopped = False
+        self.elections = 0
+        self.publications = 0
+        self.reads = 0
+        self.stale = 0
+        self.failures = 0
+
+    @property
+    def is_leader(self):
+        """
+        Whether this node held the lease at its last attempt.
+        """
+        return self._lease_id is not None
+
+    def read(self, fresh=True):
+        """
+        Read the snapshot published by the leader.
+        :param bool fresh: Whether snapshots older than ``max_age`` are
+            ignored.
+        :returns InventorySnapshot: The snapshot, or ``None`` if there is
+            none, it cannot be parsed or it is too old.
+        """
+        try:
+            content = self._shard.client.get_blob(
+                self._shard.container_name, INVENTORY_BLOB)
+            if not content:
+                # nothing published yet
+                return None
+            data = json.loads(content)
+            if data['format'] != SNAPSHOT_FORMAT:
+                return None
+            snapshot = InventorySnapshot(
+                version=data['version'], leader=data['leader'],
+                polled_at=data['polled_at'],
+                volumes=[tuple(v) for v in data['volumes']])
+        except WindowsAzureMissingResourceError:
+            return None
+        except (ValueError, KeyError, TypeError):
+            write_traceback(None, u'azure_flocker_driver:shared_inventory')
+            return None
+
+        with self._condition:
+            self.reads += 1
+            if fresh and self._clock() - snapshot.polled_at > self._max_age:
+                self.stale += 1
+                return None
+        return snapshot
+
+    def step(self):
+        """
+        Acquire or renew the lease and, while holding it, poll Azure and
+        publish the snapshot.
+        """
+        if not self._hold_lease():
+            return
+
+        polled_at = self._clock()
+        volumes = sorted(self._poll())
+        (version, published) = self._published or (0, None)
+        if volumes != published:
+            version += 1
+
+        self._shard.client.put_blob(
+            self._shard.container_name, INVENTORY_BLOB,
+            json.dumps({
+                'format': SNAPSHOT_FORMAT,
+                'version': version,
+                'leader': self._instance_id,
+                'polled_at': polled_at,
+                'volumes': volumes,
+            }, separators=(',', ':')),
+            x_ms_blob_type='BlockBlob',
+            x_ms_blob_content_type='application/json',
+            x_ms_lease_id=self._lease_id)
+        with self._condition:
+            self._published = (version, volumes)
+            self.publications += 1
+
+    def start(self):
+        """
+        Run ``step`` every ``interval`` seconds from a daemon thread.
+        """
+        if self._thread is not None:
+            return
+
+        self._thread = threading.Thread(
+            target=self._run, name='azure-flocker-shared-inventory')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the thread and give up the lease, so another node takes over
+        without waiting for it to expire.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+        lease_id = self._lease_id
+        self._lease_id = None
+        if lease_id is not None:
+            try:
+                self._shard.client.lease_blob(
+                    self._shard.container_name, INVENTORY_BLOB, 'release',
+                    x_ms_lease_id=lease_id)
+            except WindowsAzureError:
+                write_traceback(
+                    None, u'azure_flocker_driver:shared_inventory')
+
+    def stats(self):
+        """
+        :returns dict: Whether this node is the leader, its elections and
+            publications, the snapshots read and found stale, and the
+            failed steps.
+        """
+        with self._condition:
+            return {
+                'leader': self.is_leader,
+                'elections': self.elections,
+                'publications': self.publications,
+                'reads': self.reads,
+                'stale': self.stale,
+                'failures': self.failures,
+            }
+
+    def _hold_lease(self):
+        """
+        :returns bool: Whether this node holds the lease.
+        """
+        client = self._shard.client
+        container_name = self._shard.container_name
+
+        if self._lease_id is not None:
+            try:
+                client.lease_blob(container_name, INVENTORY_BLOB, 'renew',
+                                  x_ms_lease_id=self._lease_id)
+                return True
+            except WindowsAzureConflictError:
+                # the lease expired and another node acquired it
+                self._lease_id = None
+
+        try:
+            lease = client.lease_blob(
+                container_name, INVENTORY_BLOB, 'acquire',
+                x_ms_lease_duration=LEASE_DURATION,
+                x_ms_proposed_lease_id=str(uuid4()))
+        except WindowsAzureConflictError:
+            return False
+        except WindowsAzureMissingResourceError:
+            try:
+                client.put_blob(container_name, INVENTORY_BLOB, b'',
+                                x_ms_blob_type='BlockBlob')
+            except WindowsAzureError:
+                # created and leased by another node meanwhile
+                return False
+            return self._hold_lease()
+
+        # continue the versions of the previous leader
+        previous = self.read(fresh=False)
+        with self._condition:
+            self._lease_id = lease['x-ms-lease-id']
+            self._published = None
+            if previous is not None:
+                self._published = (previous.version, previous.volumes)
+            self.elections += 1
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                self.step()
+            except Exception:
+                write_traceback(
+                    None, u'azure_flocker_driver:shared_inventory')
+                with self._condition:
+                    self.failures += 1
+
+            with self._condition:
+                if not self._stopped:
+                    self._condition.wait(self._interval)
+                if self._stopped:
+                    return
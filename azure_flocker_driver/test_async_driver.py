@@ -0,0 +1,194 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for ``azure_flocker_driver.azure_storage_async_driver``.
+"""
+
+import threading
+from uuid import uuid4
+
+from eliot.testing import LoggedAction, capture_logging
+
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.trial.unittest import SynchronousTestCase
+
+from ._logging import AZURE_CALL, POLL_WAIT, VOLUME_OPERATION
+from .azure_storage_async_driver import AzureStorageBlockDeviceAsyncAPI
+from .fake_azure import FakeAzure
+from .testtools_azure_storage_driver import fake_azure_driver
+
+GiB = 1 << 30
+
+
+class InlineReactor(Clock):
+    """
+    A ``Clock`` whose thread pool runs calls in the calling thread.
+    """
+
+    def callFromThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+    def getThreadPool(self):
+        return self
+
+    def callInThreadWithCallback(self, onResult, f, *args, **kwargs):
+        try:
+            result = f(*args, **kwargs)
+        except Exception:
+            onResult(False, Failure())
+        else:
+            onResult(True, result)
+
+
+class AsyncAPITests(SynchronousTestCase):
+    """
+    Tests for ``AzureStorageBlockDeviceAsyncAPI`` against ``FakeAzure``.
+    """
+
+    def setUp(self):
+        self.azure = FakeAzure()
+        self.reactor = InlineReactor()
+        self.api = AzureStorageBlockDeviceAsyncAPI(
+            self.reactor, fake_azure_driver(self.azure))
+
+    def resolve(self, d):
+        """
+        Advance the reactor until ``d`` fired.
+        :returns: The result of ``d``.
+        """
+        fired = []
+        d.addBoth(lambda result: fired.append(True) or result)
+        for i in range(1000):
+            if fired:
+                break
+            self.reactor.advance(0.01)
+        return self.successResultOf(d)
+
+    def test_attach_detach(self):
+        """
+        A volume is attached and detached through the split operations of
+        the driver, releasing the LUN it reserved.
+        """
+        volume = self.resolve(self.api.create_volume(uuid4(), GiB))
+        attached = self.resolve(
+            self.api.attach_volume(volume.blockdevice_id, u'vm'))
+        listed = self.resolve(self.api.list_volumes())
+        self.resolve(self.api.detach_volume(volume.blockdevice_id))
+
+        self.assertEqual(
+            ([volume.set(attached_to=u'vm')], [attached],
+             [volume], {}),
+            ([attached], listed, self.resolve(self.api.list_volumes()),
+             self.api._api._lun_allocator.reservations(u'vm')))
+
+    def test_serialized(self):
+        """
+        Concurrent attaches on the deployment are issued one at a time,
+        each once Azure completed the previous one.
+        """
+        volumes = [self.resolve(self.api.create_volume(uuid4(), GiB))
+                   for i in range(2)]
+        attaching = [self.api.attach_volume(v.blockdevice_id, u'vm')
+                     for v in volumes]
+        queued = self.api._scheduler.stats()[u'fake-service']['depth']
+        attached = [self.resolve(d) for d in attaching]
+        self.assertEqual(
+            (2, [v.set(attached_to=u'vm') for v in volumes], 0),
+            (queued, attached, self.azure.errors['conflict']))
+
+    @capture_logging(None)
+    def test_nested_logging(self, logger):
+        """
+        The Azure calls and the waits of an operation are logged under its
+        ``VOLUME_OPERATION``, those of an operation which was queued
+        behind another one included.
+        """
+        volumes = [self.resolve(self.api.create_volume(uuid4(), GiB))
+                   for i in range(2)]
+        attaching = [self.api.attach_volume(v.blockdevice_id, u'vm')
+                     for v in volumes]
+        for d in attaching:
+            self.resolve(d)
+
+        def nested(action):
+            descendants = [a for a in action.descendants()
+                           if isinstance(a, LoggedAction)]
+            return (
+                set(a.startMessage['endpoint'] for a in descendants
+                    if a.startMessage['action_type'] == AZURE_CALL.action_type
+                    and a.startMessage['endpoint'].startswith('service.')),
+                set(a.startMessage['wait'] for a in descendants
+                    if a.startMessage['action_type'] == POLL_WAIT.action_type))
+
+        self.assertEqual(
+            [({'service.add_data_disk', 'service.get_deployment_by_name',
+               'service.get_operation_status', 'service.list_disks'},
+              {'add_data_disk', 'async', 'attach'})] * 2,
+            [nested(a) for a in LoggedAction.ofType(
+                logger.messages, VOLUME_OPERATION)
+             if a.startMessage['operation'] == u'attach'])
+
+    def test_destroy(self):
+        """
+        An attached volume is destroyed.
+        """
+        volume = self.resolve(self.api.create_volume(uuid4(), GiB))
+        self.resolve(self.api.attach_volume(volume.blockdevice_id, u'vm'))
+        self.resolve(self.api.destroy_volume(volume.blockdevice_id))
+        self.assertEqual([], self.resolve(self.api.list_volumes()))
+
+    def test_clone(self):
+        """
+        A clone is copied server side and listed with its own dataset id.
+        """
+        volume = self.resolve(self.api.create_volume(uuid4(), GiB))
+        dataset_id = uuid4()
+        clone = self.resolve(
+            self.api.clone_volume(volume.blockdevice_id, dataset_id))
+        self.assertEqual(
+            (dataset_id, {volume, clone}),
+            (clone.dataset_id, set(self.resolve(self.api.list_volumes()))))
+
+
+class ConcurrentAttachTests(SynchronousTestCase):
+    """
+    Tests for attaches started from concurrent threads, as those of
+    ``AzureStorageBlockDeviceAsyncAPI`` are.
+    """
+
+    def test_same_role(self):
+        """
+        Volumes attached concurrently to one role get distinct LUNs, the
+        requests Azure rejects while another attach is in progress being
+        retried.
+        """
+        azure = FakeAzure(operation_time=0.05)
+        api = fake_azure_driver(azure, inventory_ttl=0)
+        volumes = [api.create_volume(uuid4(), GiB) for i in range(4)]
+        pending = []
+
+        def attach(blockdevice_id):
+            pending.append(api.start_attach(blockdevice_id, u'vm'))
+
+        threads = [threading.Thread(target=attach,
+                                    args=(v.blockdevice_id,))
+                   for v in volumes]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        luns = [api._lun_allocator.reservations(u'vm')[p.blockdevice_id]
+                for p in pending]
+        for p in pending:
+            api.poller.wait(
+                'attach', lambda: api.is_attached(p.blockdevice_id))
+            api.finish_attach(p)
+
+        self.assertEqual(
+            (4, sorted(azure.role(u'vm')), True),
+            (len(set(luns)), sorted(luns), azure.errors['conflict'] > 0))
+        self.assertEqual(
+            set(v.set(attached_to=u'vm') for v in volumes),
+            set(api.list_volumes()))
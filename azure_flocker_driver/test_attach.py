@@ -0,0 +1,143 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for ``AzureStorageBlockDeviceAPI.attach_volume``.
+"""
+
+from uuid import uuid4
+
+from azure import WindowsAzureConflictError, WindowsAzureError
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from flocker.node.agents.blockdevice import AlreadyAttachedVolume, \
+    UnattachedVolume
+
+from .fake_azure import FakeAzure
+from .scsi import ScsiDevices, UnknownScsiDevice
+from .testtools_azure_storage_driver import fake_azure_driver
+
+GiB = 1 << 30
+
+
+class AttachVolumeTests(SynchronousTestCase):
+    """
+    Tests for ``attach_volume``.
+    """
+
+    def setUp(self):
+        self.azure = FakeAzure()
+        self.api = fake_azure_driver(self.azure, inventory_ttl=0)
+        self.blockdevice_id = self.api.create_volume(
+            uuid4(), GiB).blockdevice_id
+
+    def attach(self):
+        """
+        Attach the volume to ``vm``.
+        :returns: The volume attached.
+        """
+        return self.api.attach_volume(self.blockdevice_id, u'vm')
+
+    def test_errors(self):
+        """
+        An error adding the disk is raised and releases the LUN reserved
+        for the volume.
+        """
+        def add_data_disk(*args, **kwargs):
+            raise WindowsAzureError('Unknown error (Too Many Requests)')
+        self.patch(self.azure.service_client, 'add_data_disk',
+                   add_data_disk)
+        self.assertRaises(WindowsAzureError, self.attach)
+        self.assertEqual(
+            ({}, {}),
+            (self.azure.role(u'vm'),
+             self.api._lun_allocator.reservations(u'vm')))
+
+    def test_lease_conflict(self):
+        """
+        A conflict other than the deployment being busy, like a lease
+        another client holds on a blob, is raised without retrying.
+        """
+        self.azure.storage_client.lease_blob(
+            'vhds', self.blockdevice_id, 'acquire',
+            x_ms_lease_duration=-1, x_ms_proposed_lease_id='other')
+        self.assertRaises(WindowsAzureConflictError, self.attach)
+        self.assertEqual(
+            (1, {}),
+            (self.azure.calls['add_data_disk'],
+             self.api._lun_allocator.reservations(u'vm')))
+
+    def test_repeat_keeps_reservation(self):
+        """
+        Repeating the attach of a volume which is attached already does
+        not release the LUN another attach of it still waits on.
+        """
+        self.attach()
+        self.api._lun_allocator.reserve(u'vm', self.blockdevice_id, [])
+        reserved = self.api._lun_allocator.reservations(u'vm')
+
+        self.assertRaises(AlreadyAttachedVolume, self.attach)
+        self.assertEqual(
+            reserved, self.api._lun_allocator.reservations(u'vm'))
+
+    def test_no_device(self):
+        """
+        ``get_device_path`` raises ``UnattachedVolume`` when no device of
+        an attached volume appears on this node.
+        """
+        self.attach()
+        self.api._devices = ScsiDevices(sysfs=FilePath(self.mktemp()))
+        self.assertRaises(
+            UnattachedVolume, self.api.get_device_path, self.blockdevice_id)
+
+
+class LocalAttachTests(SynchronousTestCase):
+    """
+    Tests for ``attach_volume`` to the node the driver runs on.
+    """
+
+    def setUp(self):
+        self.azure = FakeAzure(operation_time=0.2)
+        self.api = fake_azure_driver(
+            self.azure, inventory_ttl=0, device_timeout=0.01)
+        self.blockdevice_id = self.api.create_volume(
+            uuid4(), GiB).blockdevice_id
+        self.waits = []
+
+    def attach(self):
+        return self.api.attach_volume(
+            self.blockdevice_id, self.api.compute_instance_id())
+
+    def test_device_first(self):
+        """
+        The attach completes once the device appears, without waiting for
+        Azure to report the operation complete.
+        """
+        def wait_for_device(lun, timeout, size=None):
+            self.waits.append((lun, timeout, size))
+            return FilePath('/dev/sdc')
+        self.patch(self.api._devices, 'wait_for_device', wait_for_device)
+
+        self.attach()
+        self.assertEqual(
+            ([(0, 0.01, GiB)], 0),
+            (self.waits, self.azure.calls['get_operation_status']))
+
+    def test_operation_first(self):
+        """
+        The attach completes once Azure reports the operation complete if
+        no device appears meanwhile, each wait for the device lasting
+        ``device_timeout`` seconds.
+        """
+        def wait_for_device(lun, timeout, size=None):
+            self.waits.append((lun, timeout, size))
+            raise UnknownScsiDevice(lun)
+        self.patch(self.api._devices, 'wait_for_device', wait_for_device)
+
+        volume = self.attach()
+        self.assertEqual(
+            (self.api.compute_instance_id(),
+             self.azure.calls['get_operation_status'], {(0, 0.01, GiB)}),
+            (volume.attached_to, len(self.waits), set(self.waits)))
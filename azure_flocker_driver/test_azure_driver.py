@@ -4,7 +4,8 @@
 """
 Functional tests for
 ``flocker.node.agents.blockdevice.EMCAzureBlockDeviceAPI``
-using a real Azure cluster.
+using a real Azure cluster, and the same tests run offline against
+``FakeAzure``.
 Ideally emc drivers should be seperate like cinder driver,
 we may change thay in the future.
 """
@@ -18,7 +19,49 @@ from flocker.node.agents.test.test_blockdevice import (
     make_iblockdeviceasyncapi_tests, make_iblockdeviceapi_tests
 )
 
-from .testtools_azure_storage_driver import azure_test_driver_from_yaml
+from .testtools_azure_storage_driver import (
+    azure_test_driver_from_yaml, azure_test_async_driver_from_yaml,
+    azure_fake_driver_for_test, azure_fake_async_driver_for_test
+)
+
+SUPPORTED_TESTS = [
+    'test_interface',
+    'test_list_volume_empty',
+    'test_listed_volume_attributes',
+    'test_created_is_listed',
+    'test_created_volume_attributes',
+    'test_destroy_unknown_volume',
+    'test_destroy_volume',
+    'test_destroy_destroyed_volume',
+    'test_attach_unknown_volume',
+    'test_attach_attached_volume',
+    'test_attach_elsewhere_attached_volume',
+    'test_attach_unattached_volume',
+    'test_attached_volume_listed',
+    'test_attach_volume_validate_size',
+    'test_list_attached_and_unattached',
+    'test_multiple_volumes_attached_to_host',
+    'test_detach_unknown_volume',
+    'test_detach_detached_volume',
+    'test_detach_volume',
+    'test_reattach_detached_volume',
+    'test_attach_destroyed_volume',
+    'test_get_device_path_unknown_volume',
+    'test_get_device_path_unattached_volume',
+    'test_get_device_path_device',
+    'test_get_device_path_device_repeatable_results',
+    'test_device_size',
+    'test_compute_instance_id_nonempty',
+    'test_compute_instance_id_unicode'
+]
+
+# Tests which need the block device of an attached volume on this node,
+# which the fake backend does not provide.
+DEVICE_TESTS = [
+    'test_get_device_path_device',
+    'test_get_device_path_device_repeatable_results',
+    'test_device_size'
+]
 
 
 def azureblockdeviceasyncapi_for_test(test_case):
@@ -29,43 +72,20 @@ def azureblockdeviceasyncapi_for_test(test_case):
     return azure_test_driver_from_yaml(test_case)
 
 
+class AzureStorageBlockDeviceAsyncAPIInterfaceTests(
+    make_iblockdeviceasyncapi_tests(azure_test_async_driver_from_yaml)
+):
+    """
+    Interface adherence tests for ``AzureStorageBlockDeviceAsyncAPI``.
+    """
+
+
 def azure_factory():
 
     return make_iblockdeviceasyncapi_tests(azureblockdeviceasyncapi_for_test)
 
 
-@skip_except(
-    supported_tests=[
-        'test_interface',
-        'test_list_volume_empty',
-        'test_listed_volume_attributes',
-        'test_created_is_listed',
-        'test_created_volume_attributes',
-        'test_destroy_unknown_volume',
-        'test_destroy_volume',
-        'test_destroy_destroyed_volume',
-        'test_attach_unknown_volume',
-        'test_attach_attached_volume',
-        'test_attach_elsewhere_attached_volume',
-        'test_attach_unattached_volume',
-        'test_attached_volume_listed',
-        'test_attach_volume_validate_size',
-        'test_list_attached_and_unattached',
-        'test_multiple_volumes_attached_to_host',
-        'test_detach_unknown_volume',
-        'test_detach_detached_volume',
-        'test_detach_volume',
-        'test_reattach_detached_volume',
-        'test_attach_destroyed_volume',
-        'test_get_device_path_unknown_volume',
-        'test_get_device_path_unattached_volume',
-        'test_get_device_path_device',
-        'test_get_device_path_device_repeatable_results',
-        'test_device_size',
-        'test_compute_instance_id_nonempty',
-        'test_compute_instance_id_unicode'
-    ]
-)
+@skip_except(supported_tests=SUPPORTED_TESTS)
 class AzureStorageBlockDeviceAPIInterfaceTests(
 
     make_iblockdeviceapi_tests(
@@ -81,3 +101,30 @@ class AzureStorageBlockDeviceAPIInterfaceTests(
     """
     something
     """
+
+
+class FakeAzureStorageBlockDeviceAsyncAPIInterfaceTests(
+    make_iblockdeviceasyncapi_tests(azure_fake_async_driver_for_test)
+):
+    """
+    Interface adherence tests for ``AzureStorageBlockDeviceAsyncAPI``
+    against ``FakeAzure``.
+    """
+
+
+@skip_except(
+    supported_tests=[t for t in SUPPORTED_TESTS if t not in DEVICE_TESTS])
+class FakeAzureStorageBlockDeviceAPIInterfaceTests(
+
+    make_iblockdeviceapi_tests(
+        blockdevice_api_factory=azure_fake_driver_for_test,
+        minimum_allocatable_size=int(GiB(1).to_Byte().value),
+        device_allocation_unit=int(GiB(1).to_Byte().value),
+        unknown_blockdevice_id_factory=lambda test: unicode(uuid4())
+    )
+
+):
+    """
+    Interface adherence tests for ``AzureStorageBlockDeviceAPI`` against
+    ``FakeAzure``.
+    """
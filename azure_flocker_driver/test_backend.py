@@ -0,0 +1,76 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for the ``FLOCKER_BACKEND`` of ``azure_flocker_driver``.
+"""
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+import azure_flocker_driver
+from azure_flocker_driver import FLOCKER_BACKEND
+from .azure_storage_driver import AzureStorageBlockDeviceAPI
+
+
+class BackendTests(SynchronousTestCase):
+    """
+    Tests for the ``api_factory`` of ``FLOCKER_BACKEND``.
+    """
+
+    def setUp(self):
+        self.created = []
+        self.patch(
+            azure_flocker_driver, 'azure_async_driver_from_configuration',
+            lambda reactor, config: self.created.append(
+                ('async', reactor, config)))
+        self.patch(
+            azure_flocker_driver, 'azure_driver_from_configuration',
+            lambda config: self.created.append(('blocking', config)))
+
+    def test_async(self):
+        """
+        The asynchronous API is created with the reactor flocker passes
+        when ``async_api`` is true.
+        """
+        reactor = object()
+        FLOCKER_BACKEND.api_factory(
+            reactor=reactor, service_name=u'svc', async_api=True)
+        self.assertEqual(
+            ([('async', reactor, {u'service_name': u'svc'})], True),
+            (self.created, FLOCKER_BACKEND.needs_reactor))
+
+    def test_blocking(self):
+        """
+        The blocking API is created when ``async_api`` is false.
+        """
+        FLOCKER_BACKEND.api_factory(
+            reactor=object(), service_name=u'svc', async_api=False)
+        self.assertEqual([('blocking', {u'service_name': u'svc'})],
+                         self.created)
+
+
+class DefaultBackendTests(SynchronousTestCase):
+    """
+    Tests for the driver the unpatched ``api_factory`` creates.
+    """
+
+    def test_blocking_by_default(self):
+        """
+        Without ``async_api`` the factory returns the blocking
+        ``AzureStorageBlockDeviceAPI`` flocker's ``BlockDeviceDeployer``
+        calls synchronously.
+        """
+        certificate = FilePath(self.mktemp())
+        certificate.setContent(b'')
+        api = FLOCKER_BACKEND.api_factory(
+            reactor=object(),
+            service_name=u'svc',
+            subscription_id=u'subscription',
+            management_certificate_path=certificate.path,
+            storage_account_name=u'account',
+            storage_account_key=u'a2V5',
+            disk_container_name=u'vhds',
+            device_timeout=0,
+            debug=False)
+        self.assertIsInstance(api, AzureStorageBlockDeviceAPI)
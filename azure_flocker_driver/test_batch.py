@@ -0,0 +1,95 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for ``azure_flocker_driver.batch`` and the batch operations of
+``AzureStorageBlockDeviceAPI`` running on it.
+"""
+
+import threading
+import time
+from uuid import uuid4
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from flocker.node.agents.blockdevice import UnattachedVolume, UnknownVolume
+
+from .fake_azure import FakeAzure
+from .testtools_azure_storage_driver import fake_azure_driver
+
+GiB = 1 << 30
+
+
+class BatchExecutorTests(SynchronousTestCase):
+    """
+    Tests for ``BatchExecutor`` through ``attach_volumes``,
+    ``detach_volumes`` and ``destroy_volumes`` against ``FakeAzure``.
+    """
+
+    def setUp(self):
+        self.azure = FakeAzure(operation_time=0.01)
+        self.api = fake_azure_driver(
+            self.azure, inventory_ttl=0, batch_workers=3)
+        self.volumes = [self.api.create_volume(uuid4(), GiB)
+                        for i in range(4)]
+        self.ids = [v.blockdevice_id for v in self.volumes]
+
+    def test_attach(self):
+        """
+        The volumes are attached to one role at distinct LUNs, the error
+        of a volume being returned in its place.
+        """
+        results = self.api.attach_volumes(self.ids + [u'unknown'], u'vm')
+        self.assertEqual(
+            ([v.set(attached_to=u'vm') for v in self.volumes], UnknownVolume,
+             4, {}),
+            (results[:4], type(results[4]), len(set(self.azure.role(u'vm'))),
+             self.api._lun_allocator.reservations(u'vm')))
+
+    def test_detach(self):
+        """
+        The volumes are detached, those not attached returning
+        ``UnattachedVolume``.
+        """
+        self.api.attach_volumes(self.ids[:3], u'vm')
+        results = self.api.detach_volumes(self.ids)
+        self.assertEqual(
+            ([None, None, None], UnattachedVolume, self.volumes),
+            (results[:3], type(results[3]),
+             sorted(self.api.list_volumes(),
+                    key=lambda v: self.ids.index(v.blockdevice_id))))
+
+    def test_destroy(self):
+        """
+        Attached and detached volumes are destroyed.
+        """
+        self.api.attach_volumes(self.ids[:2], u'vm')
+        self.assertEqual(
+            ([None] * 4, []),
+            (self.api.destroy_volumes(self.ids), self.api.list_volumes()))
+
+    def test_workers(self):
+        """
+        No more than ``workers`` operations are in flight at once.
+        """
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+
+        def detach_volume(blockdevice_id):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+        self.patch(self.api, 'detach_volume', detach_volume)
+
+        self.api.detach_volumes(self.ids * 3)
+        self.assertTrue(1 < peak[0] <= 3, peak[0])
+
+    def test_empty(self):
+        """
+        An empty batch does nothing.
+        """
+        self.assertEqual([], self.api.destroy_volumes([]))
@@ -0,0 +1,68 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for the change detection of ``list_volumes``.
+"""
+
+from uuid import uuid4
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .fake_azure import FakeAzure
+from .inventory import VolumeChanges
+from .testtools_azure_storage_driver import fake_azure_driver
+
+GiB = 1 << 30
+
+
+class ChangeDetectionTests(SynchronousTestCase):
+    """
+    Tests for ``list_volumes`` and ``list_volume_changes`` with
+    ``change_detection``.
+    """
+
+    def setUp(self):
+        self.azure = FakeAzure()
+        self.api = fake_azure_driver(self.azure, inventory_ttl=0)
+        # another node of the cluster
+        self.other = fake_azure_driver(self.azure, inventory_ttl=0)
+        self.volume = self.other.create_volume(uuid4(), GiB)
+        self.api.list_volumes()
+
+    def test_unchanged(self):
+        """
+        An unchanged inventory is not listed again, even when volumes are
+        written to.
+        """
+        self.other.attach_volume(self.volume.blockdevice_id, u'vm')
+        volumes = self.api.list_volumes()
+        self.azure.storage_client.put_page(
+            'vhds', self.volume.blockdevice_id, b'data', 'bytes=0-3',
+            'update')
+
+        before = self.azure.calls['list_disks']
+        self.assertEqual(
+            (volumes, VolumeChanges([], [], []), 0),
+            (self.api.list_volumes(), self.api.list_volume_changes(),
+             self.azure.calls['list_disks'] - before))
+
+    def test_changes(self):
+        """
+        The volumes added, removed and reattached by other nodes are
+        reported once.
+        """
+        added = self.other.create_volume(uuid4(), GiB)
+        attached = self.other.attach_volume(self.volume.blockdevice_id,
+                                            u'vm')
+        first = self.api.list_volume_changes()
+
+        self.other.detach_volume(self.volume.blockdevice_id)
+        self.other.destroy_volume(self.volume.blockdevice_id)
+
+        self.assertEqual(
+            [VolumeChanges([added], [], [attached]),
+             VolumeChanges([], [attached], []),
+             VolumeChanges([], [], [])],
+            [first, self.api.list_volume_changes(),
+             self.api.list_volume_changes()])
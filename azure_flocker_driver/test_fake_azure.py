@@ -0,0 +1,131 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for ``azure_flocker_driver.fake_azure``.
+"""
+
+from azure import WindowsAzureConflictError, WindowsAzureError
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .fake_azure import FakeAzure
+
+MEDIA = 'https://fakeaccount.blob.core.windows.net/vhds/'
+
+
+class FakeAzureTests(SynchronousTestCase):
+    """
+    Tests for ``FakeAzure``.
+    """
+
+    def setUp(self):
+        self.now = [0]
+        self.azure = FakeAzure(operation_time=10, clock=lambda: self.now[0])
+        self.blobs = self.azure.storage_client
+        self.service = self.azure.service_client
+        for i in range(3):
+            self.blobs.put_blob(
+                'vhds', 'flocker-%d' % i, None, 'PageBlob',
+                x_ms_blob_content_length=1 << 30)
+
+    def attach(self, name, lun):
+        return self.service.add_data_disk(
+            'svc', 'svc', 'vm', lun, disk_label=name,
+            source_media_link=MEDIA + name)
+
+    def status(self, request):
+        return self.service.get_operation_status(request.request_id).status
+
+    def test_attach_completes(self):
+        """
+        An attach is in progress for ``operation_time`` seconds and only
+        then registers the blob as a disk attached to the role and leases
+        the blob.
+        """
+        request = self.attach('flocker-0', 0)
+        self.assertEqual(('InProgress', []),
+                         (self.status(request), self.service.list_disks()))
+
+        self.now[0] = 10
+        self.assertEqual('Succeeded', self.status(request))
+        [disk] = self.service.list_disks()
+        [data_disk] = self.service.get_role(
+            'svc', 'svc', 'vm').data_virtual_hard_disks
+        self.assertEqual(
+            ('flocker-0', 'vm', 1, 0, 'leased'),
+            (disk.label, disk.attached_to.role_name,
+             disk.logical_disk_size_in_gb, data_disk.lun,
+             self.blobs.get_blob_properties(
+                 'vhds', 'flocker-0')['x-ms-lease-state']))
+
+    def test_registered_disk_lease(self):
+        """
+        The blob of a detached disk stays leased until the disk is deleted.
+        """
+        self.attach('flocker-0', 0)
+        self.now[0] = 10
+        [disk] = self.service.list_disks()
+        self.service.delete_data_disk('svc', 'svc', 'vm', 0)
+        self.now[0] = 20
+        detached = self.blobs.get_blob_properties(
+            'vhds', 'flocker-0')['x-ms-lease-state']
+        self.service.delete_disk(disk.name)
+        self.now[0] = 30
+        self.assertEqual(
+            ('leased', 'available'),
+            (detached, self.blobs.get_blob_properties(
+                'vhds', 'flocker-0')['x-ms-lease-state']))
+
+    def test_conflict_while_in_progress(self):
+        """
+        A mutation of the deployment while an operation is in progress
+        fails with ``WindowsAzureConflictError``.
+        """
+        self.attach('flocker-0', 0)
+        self.assertRaises(
+            WindowsAzureConflictError, self.attach, 'flocker-1', 1)
+        self.now[0] = 10
+        self.attach('flocker-1', 1)
+        self.assertEqual(1, self.azure.errors['conflict'])
+
+    def test_lun_in_use(self):
+        """
+        Attaching at an occupied LUN fails.
+        """
+        self.attach('flocker-0', 0)
+        self.now[0] = 10
+        self.assertRaises(WindowsAzureError, self.attach, 'flocker-1', 0)
+
+    def test_throttling(self):
+        """
+        Every call fails as throttled with a ``throttle_rate`` of 1, and is
+        still counted.
+        """
+        self.azure.throttle_rate = 1
+        self.assertRaises(WindowsAzureError, self.service.list_disks)
+        self.assertEqual((1, 1), (self.azure.calls['list_disks'],
+                                  self.azure.errors['throttled']))
+
+    def test_latency(self):
+        """
+        The latency configured for a method is slept before calling it.
+        """
+        sleeps = []
+        azure = FakeAzure(latency={'list_disks': 0.2}, sleep=sleeps.append)
+        azure.service_client.list_disks()
+        azure.storage_client.list_blobs('vhds')
+        self.assertEqual([0.2], sleeps)
+
+    def test_list_blobs_pages(self):
+        """
+        Blobs are listed ``page_size`` at a time, following the markers.
+        """
+        self.azure.page_size = 2
+        first = self.blobs.list_blobs('vhds', prefix='flocker-')
+        second = self.blobs.list_blobs(
+            'vhds', prefix='flocker-', marker=first.next_marker)
+        self.assertEqual(
+            (['flocker-0', 'flocker-1'], ['flocker-2'], ''),
+            ([b.name for b in first], [b.name for b in second],
+             second.next_marker))
@@ -0,0 +1,242 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for ``azure_flocker_driver.inventory`` and the blob listing of
+``AzureStorageBlockDeviceAPI``.
+"""
+
+from collections import namedtuple
+import threading
+import time
+from uuid import uuid4
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from flocker.node.agents.blockdevice import UnattachedVolume
+
+from .fake_azure import FakeAzure
+from .inventory import BlobRecord, DeploymentSnapshot, InventoryCache, \
+    InventoryIndex
+from .testtools_azure_storage_driver import fake_azure_driver
+
+GiB = 1 << 30
+
+Disk = namedtuple('Disk', ['name', 'label', 'attached_to'])
+AttachedTo = namedtuple('AttachedTo', ['role_name'])
+DataDisk = namedtuple('DataDisk', ['disk_name', 'lun', 'media_link'])
+Role = namedtuple('Role', ['role_name', 'data_virtual_hard_disks'])
+Deployment = namedtuple('Deployment', ['role_list'])
+
+
+def blob(name):
+    return BlobRecord(name=name, content_length=GiB, etag=None,
+                      lease_state='available', shard=None, metadata={})
+
+
+class InventoryCacheTests(SynchronousTestCase):
+    """
+    Tests for ``InventoryCache``.
+    """
+
+    def setUp(self):
+        self.now = [0]
+        self.loads = []
+        self.cache = InventoryCache(self.load, 5, clock=lambda: self.now[0])
+
+    def load(self):
+        self.loads.append(self.now[0])
+        return len(self.loads)
+
+    def test_ttl(self):
+        """
+        The inventory is served from the cache until the ttl expired.
+        """
+        values = [self.cache.get()]
+        self.now[0] = 4
+        values.append(self.cache.get())
+        self.now[0] = 5
+        values.append(self.cache.get())
+        self.assertEqual(
+            ([1, 1, 2], {'hits': 1, 'misses': 2}),
+            (values, self.cache.stats()))
+
+    def test_invalidate(self):
+        """
+        An invalidated inventory is reloaded and ``invalidated_at`` records
+        when it was invalidated.
+        """
+        self.cache.get()
+        self.now[0] = 3
+        self.cache.invalidate()
+        self.assertEqual((2, 3), (self.cache.get(), self.cache.invalidated_at))
+
+    def test_no_caching(self):
+        """
+        A ttl of ``0`` reloads the inventory on every ``get``.
+        """
+        cache = InventoryCache(self.load, 0, clock=lambda: self.now[0])
+        self.assertEqual([1, 2], [cache.get(), cache.get()])
+
+
+class InventoryIndexTests(SynchronousTestCase):
+    """
+    Tests for ``InventoryIndex``.
+    """
+
+    def setUp(self):
+        self.calls = []
+        self.disks = [
+            Disk(u'vm-1', u'flocker-attached', AttachedTo(u'vm')),
+            Disk(u'detached-1', u'flocker-detached', None),
+            Disk(u'os-disk', u'os', AttachedTo(u'vm')),
+        ]
+        self.blobs = [blob('flocker-detached'), blob('flocker-blob')]
+        self.roles = {u'vm': [
+            DataDisk(u'vm-1', 3, 'https://a/vhds/flocker-attached'),
+            DataDisk(u'other', 0, 'https://a/vhds/other'),
+        ]}
+        self.index = InventoryIndex(
+            self.list_disks, self.list_blobs, self.load_blob,
+            self.load_role)
+
+    def list_disks(self):
+        self.calls.append('list_disks')
+        # let concurrent loads overlap
+        time.sleep(0.01)
+        return self.disks
+
+    def list_blobs(self):
+        self.calls.append('list_blobs')
+        return self.blobs
+
+    def load_blob(self, name):
+        self.calls.append(('load_blob', name))
+        return dict((b.name, b) for b in self.blobs).get(name)
+
+    def load_role(self, role_name):
+        self.calls.append(('load_role', role_name))
+        return self.roles.get(role_name, [])
+
+    def test_lookup(self):
+        """
+        Attached and detached disks and unregistered blobs are found,
+        roles are loaded once and blobs looked up one by one.
+        """
+        self.assertEqual(
+            [(self.disks[0], u'vm', 3), (self.disks[0], u'vm', 3),
+             (self.disks[1], None, None), (self.blobs[1], None, None),
+             (None, None, None)],
+            [self.index.lookup(u'flocker-attached'),
+             self.index.lookup(u'flocker-attached'),
+             self.index.lookup(u'flocker-detached'),
+             self.index.lookup(u'flocker-blob'),
+             self.index.lookup(u'flocker-unknown')])
+        self.assertEqual(
+            ['list_disks', ('load_role', u'vm'),
+             ('load_blob', 'flocker-blob'), ('load_blob', 'flocker-unknown')],
+            self.calls)
+
+    def test_roles(self):
+        """
+        The LUNs and disks of a role are indexed, a role without disks has
+        none.
+        """
+        self.assertEqual(
+            ({0, 3}, True, False, set()),
+            (self.index.luns_for_role(u'vm'),
+             self.index.holds(u'vm', 'https://a/vhds/flocker-attached'),
+             self.index.holds(u'vm', 'https://a/vhds/flocker-detached'),
+             self.index.luns_for_role(u'other-vm')))
+
+    def test_blobs(self):
+        """
+        Every flocker blob is listed once, the unregistered ones are those
+        without a disk.
+        """
+        self.assertEqual(
+            (self.blobs, [self.blobs[1]], ['list_blobs', 'list_disks']),
+            (sorted(self.index.all_blobs(), reverse=True),
+             self.index.unregistered_blobs(), self.calls))
+
+    def test_concurrent_loads(self):
+        """
+        Threads sharing an index load each part of it once.
+        """
+        threads = [threading.Thread(
+            target=self.index.lookup, args=(u'flocker-attached',))
+            for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(['list_disks', ('load_role', u'vm')], self.calls)
+
+
+class DeploymentSnapshotTests(SynchronousTestCase):
+    """
+    Tests for ``DeploymentSnapshot``.
+    """
+
+    def setUp(self):
+        self.loads = 0
+        self.snapshot = DeploymentSnapshot(self.load)
+
+    def load(self):
+        self.loads += 1
+        return Deployment([
+            Role(u'vm1', [DataDisk(u'd1', 0, 'https://a/vhds/d1'),
+                          DataDisk(u'd2', 1, 'https://a/vhds/d2')]),
+            Role(u'vm2', []),
+        ])
+
+    def test_roles(self):
+        """
+        The data disks and attachments of every role are answered from a
+        single deployment fetched on first use.
+        """
+        self.assertEqual(0, self.loads)
+        self.assertEqual(
+            ([u'd1', u'd2'], [], [],
+             frozenset([(u'vm1', 0, 'https://a/vhds/d1'),
+                        (u'vm1', 1, 'https://a/vhds/d2')]), 1),
+            ([d.disk_name for d in self.snapshot.data_disks(u'vm1')],
+             self.snapshot.data_disks(u'vm2'),
+             self.snapshot.data_disks(u'vm3'),
+             self.snapshot.attachments(), self.loads))
+
+
+class BlobListingTests(SynchronousTestCase):
+    """
+    Tests for the blob listing and lookups of ``AzureStorageBlockDeviceAPI``.
+    """
+
+    def setUp(self):
+        self.azure = FakeAzure(page_size=2)
+        self.api = fake_azure_driver(self.azure, inventory_ttl=0)
+
+    def test_paging(self):
+        """
+        Every page of blobs is listed.
+        """
+        volumes = [self.api.create_volume(uuid4(), GiB) for i in range(5)]
+        before = self.azure.calls['list_blobs']
+        self.assertEqual(
+            (set(volumes), 3),
+            (set(self.api.list_volumes()),
+             self.azure.calls['list_blobs'] - before))
+
+    def test_single_blob(self):
+        """
+        Looking up one unregistered volume reads that blob rather than
+        listing the container.
+        """
+        volume = self.api.create_volume(uuid4(), GiB)
+        before = (self.azure.calls['list_blobs'],
+                  self.azure.calls['get_blob_properties'])
+        self.assertRaises(UnattachedVolume, self.api.get_device_path,
+                          volume.blockdevice_id)
+        self.assertEqual(
+            (before[0], before[1] + 1),
+            (self.azure.calls['list_blobs'],
+             self.azure.calls['get_blob_properties']))
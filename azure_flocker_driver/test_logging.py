@@ -0,0 +1,78 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for the ``VOLUME_OPERATION`` actions ``AzureStorageBlockDeviceAPI``
+logs.
+"""
+
+from uuid import uuid4
+
+from eliot.testing import LoggedAction, capture_logging
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from ._logging import VOLUME_OPERATION
+from .fake_azure import FakeAzure
+from .testtools_azure_storage_driver import fake_azure_driver
+
+GiB = 1 << 30
+
+
+class VolumeOperationTests(SynchronousTestCase):
+    """
+    Tests for the fields of the ``VOLUME_OPERATION`` actions.
+    """
+
+    def setUp(self):
+        self.api = fake_azure_driver(FakeAzure())
+
+    def operations(self, logger):
+        """
+        :returns list: The operation, blockdevice_id and role of every
+            ``VOLUME_OPERATION`` action logged.
+        """
+        return [(a.startMessage['operation'], a.startMessage['blockdevice_id'],
+                 a.startMessage['role'])
+                for a in LoggedAction.ofType(logger.messages,
+                                             VOLUME_OPERATION)]
+
+    @capture_logging(None)
+    def test_positional(self, logger):
+        """
+        The volume and role of each operation are logged, a new volume
+        under the identifier it is created with.
+        """
+        dataset_id = uuid4()
+        volume = self.api.create_volume(dataset_id, GiB)
+        blockdevice_id = volume.blockdevice_id
+        other = self.api.create_volume(uuid4(), GiB).blockdevice_id
+        self.api.attach_volume(blockdevice_id, u'vm')
+        self.api.detach_volume(blockdevice_id)
+        self.api.attach_volume(other, u'vm')
+
+        self.assertEqual(
+            [(u'create', u'flocker-' + unicode(dataset_id), None),
+             (u'create', other, None),
+             (u'attach', blockdevice_id, u'vm'),
+             (u'detach', blockdevice_id, None),
+             (u'attach', other, u'vm')],
+            self.operations(logger))
+
+    @capture_logging(None)
+    def test_keywords(self, logger):
+        """
+        Arguments passed by keyword are logged too.
+        """
+        dataset_id = uuid4()
+        volume = self.api.create_volume_with_profile(
+            size=GiB, profile_name=u'gold', dataset_id=dataset_id)
+        self.api.attach_volume(attach_to=u'vm',
+                               blockdevice_id=volume.blockdevice_id)
+        self.api.detach_volume(blockdevice_id=volume.blockdevice_id)
+
+        self.assertEqual(
+            [(u'create', volume.blockdevice_id, None),
+             (u'attach', volume.blockdevice_id, u'vm'),
+             (u'detach', volume.blockdevice_id, None)],
+            self.operations(logger))
@@ -0,0 +1,138 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for ``azure_flocker_driver.lun.LunAllocator``.
+"""
+
+from hypothesis import given
+from hypothesis.strategies import integers, lists, one_of, sampled_from, \
+    sets, tuples, just
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .lun import LUN_SLOTS, LunAllocator, NoFreeLun
+
+luns = integers(min_value=0, max_value=LUN_SLOTS - 1)
+volumes = sampled_from([u'flocker-%d' % i for i in range(40)])
+policies = sampled_from([LunAllocator.LOWEST_FREE, LunAllocator.ROUND_ROBIN])
+
+# An operation against the fake role: start an attach, let Azure complete
+# it, let it fail, or detach a volume.
+operations = lists(one_of(
+    tuples(just('reserve'), volumes),
+    tuples(just('complete'), volumes),
+    tuples(just('fail'), volumes),
+    tuples(just('detach'), volumes),
+), max_size=100)
+
+
+class FakeRole(object):
+    """
+    A role whose data disks are only updated once an attach completes.
+    """
+
+    def __init__(self, occupied):
+        # blockdevice_id -> lun
+        self.disks = dict(
+            (u'existing-%d' % lun, lun) for lun in occupied)
+
+    def luns(self):
+        return set(self.disks.values())
+
+
+def run(allocator, role, ops):
+    """
+    Apply ``ops`` to ``role``, checking every reservation against the
+    current state of the role and the other reservations.
+    """
+    for (op, volume) in ops:
+        reservations = allocator.reservations(u'vm')
+        if op == 'reserve' and volume not in role.disks:
+            try:
+                lun = allocator.reserve(u'vm', volume, role.luns())
+            except NoFreeLun:
+                others = set(lun for (b, lun) in reservations.items()
+                             if b != volume)
+                assert len(role.luns() | others) == LUN_SLOTS
+                continue
+            assert 0 <= lun < LUN_SLOTS
+            assert lun not in role.luns()
+            assert lun not in [
+                other for (b, other) in reservations.items() if b != volume]
+        elif op == 'complete' and volume in reservations:
+            role.disks[volume] = reservations[volume]
+            allocator.release(u'vm', volume)
+        elif op == 'fail':
+            allocator.release(u'vm', volume)
+        elif op == 'detach':
+            role.disks.pop(volume, None)
+
+        assert len(set(role.disks.values())) == len(role.disks)
+
+
+class LunAllocatorTests(SynchronousTestCase):
+    """
+    Tests for ``LunAllocator``.
+    """
+
+    @given(policy=policies, occupied=sets(luns), ops=operations)
+    def test_never_allocates_taken_slot(self, policy, occupied, ops):
+        """
+        A reserved LUN is never occupied by the role nor reserved for
+        another volume, and ``NoFreeLun`` is only raised when all slots
+        are taken.
+        """
+        run(LunAllocator(policy=policy), FakeRole(occupied), ops)
+
+    @given(occupied=sets(luns, max_size=LUN_SLOTS - 1))
+    def test_lowest_free(self, occupied):
+        """
+        The lowest free slot is allocated with the ``LOWEST_FREE`` policy.
+        """
+        allocator = LunAllocator(policy=LunAllocator.LOWEST_FREE)
+        self.assertEqual(
+            min(set(range(LUN_SLOTS)) - occupied),
+            allocator.reserve(u'vm', u'flocker-0', occupied))
+
+    @given(occupied=sets(luns, max_size=LUN_SLOTS - 2))
+    def test_round_robin(self, occupied):
+        """
+        With the ``ROUND_ROBIN`` policy the allocation after a released
+        slot continues with the next free slot rather than reusing it.
+        """
+        allocator = LunAllocator(policy=LunAllocator.ROUND_ROBIN)
+        first = allocator.reserve(u'vm', u'flocker-0', occupied)
+        allocator.release(u'vm', u'flocker-0')
+        second = allocator.reserve(u'vm', u'flocker-1', occupied)
+        free = sorted(set(range(LUN_SLOTS)) - occupied - {first})
+        self.assertEqual(
+            [lun for lun in free if lun > first][:1] or free[:1], [second])
+
+    @given(occupied=sets(luns, min_size=LUN_SLOTS, max_size=LUN_SLOTS))
+    def test_full_role(self, occupied):
+        """
+        ``NoFreeLun`` is raised when every slot of the role is occupied.
+        """
+        allocator = LunAllocator()
+        self.assertRaises(
+            NoFreeLun, allocator.reserve, u'vm', u'flocker-0', occupied)
+
+    def test_reservation_expires(self):
+        """
+        A reservation is no longer honoured once its ttl has passed.
+        """
+        now = [0]
+        allocator = LunAllocator(reservation_ttl=10, clock=lambda: now[0])
+        self.assertEqual(0, allocator.reserve(u'vm', u'flocker-0', []))
+        self.assertEqual(1, allocator.reserve(u'vm', u'flocker-1', []))
+        now[0] = 11
+        self.assertEqual(0, allocator.reserve(u'vm', u'flocker-2', []))
+
+    def test_roles_independent(self):
+        """
+        Reservations on one role do not affect another role.
+        """
+        allocator = LunAllocator()
+        allocator.reserve(u'vm1', u'flocker-0', [])
+        self.assertEqual(0, allocator.reserve(u'vm2', u'flocker-1', []))
@@ -0,0 +1,145 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for the ``metadata_listing`` mode of ``AzureStorageBlockDeviceAPI``.
+"""
+
+from uuid import uuid4
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .azure_storage_driver import ATTACHED_METADATA, DATASET_METADATA
+from .fake_azure import FakeAzure
+from .testtools_azure_storage_driver import fake_azure_driver
+
+GiB = 1 << 30
+
+
+class MetadataListingTests(SynchronousTestCase):
+    """
+    Tests for ``list_volumes`` with ``metadata_listing``.
+    """
+
+    def setUp(self):
+        self.azure = FakeAzure()
+        self.api = fake_azure_driver(
+            self.azure, metadata_listing=True, inventory_ttl=0)
+        self.reference = fake_azure_driver(self.azure, inventory_ttl=0)
+
+    def list_volumes(self):
+        """
+        :returns tuple: The volumes listed and the number of registered
+            disk listings it took.
+        """
+        before = self.azure.calls['list_disks']
+        volumes = self.api.list_volumes()
+        return (set(volumes), self.azure.calls['list_disks'] - before)
+
+    def test_single_listing(self):
+        """
+        Attached and unattached volumes are listed from their metadata
+        without listing the registered disks.
+        """
+        volumes = [self.api.create_volume(uuid4(), GiB) for i in range(3)]
+        self.api.attach_volume(volumes[0].blockdevice_id, u'vm')
+        self.api.attach_volume(volumes[1].blockdevice_id, u'vm')
+        self.api.detach_volume(volumes[1].blockdevice_id)
+
+        self.assertEqual(
+            (set(self.reference.list_volumes()), 0), self.list_volumes())
+
+    def test_missing_metadata(self):
+        """
+        A blob without metadata is reconciled from the registered disks and
+        stamped, so the next listing does without them.
+        """
+        volume = self.api.create_volume(uuid4(), GiB)
+        self.azure.blob('vhds', volume.blockdevice_id).metadata = {}
+
+        self.assertEqual(
+            [({volume}, 1), ({volume}, 0)],
+            [self.list_volumes(), self.list_volumes()])
+
+    def test_stale_attachment(self):
+        """
+        The attachment of a volume is read from the deployment, a role its
+        metadata names which does not hold it needs no reconciliation.
+        """
+        volume = self.api.create_volume(uuid4(), GiB)
+        self.api.attach_volume(volume.blockdevice_id, u'vm')
+        blob = self.azure.blob('vhds', volume.blockdevice_id)
+        blob.metadata[ATTACHED_METADATA] = u'other'
+
+        self.assertEqual(
+            (set(self.reference.list_volumes()), 0), self.list_volumes())
+
+    def test_detached_leased(self):
+        """
+        A detached volume whose blob azure keeps leased, as it is still
+        registered as a disk, is listed as detached without reconciliation.
+        """
+        volume = self.api.create_volume(uuid4(), GiB)
+        self.api.attach_volume(volume.blockdevice_id, u'vm')
+        self.api.detach_volume(volume.blockdevice_id)
+        blob = self.azure.blob('vhds', volume.blockdevice_id)
+
+        self.assertEqual(
+            ('leased', u'vm', ({volume}, 0), ({volume}, 0)),
+            (blob.lease_state, blob.metadata[ATTACHED_METADATA],
+             self.list_volumes(), self.list_volumes()))
+
+    def test_finish_detach(self):
+        """
+        The role recorded in the metadata of a blob azure does not lease is
+        cleared once the volume is detached.
+        """
+        volume = self.api.create_volume(uuid4(), GiB)
+        blob = self.azure.blob('vhds', volume.blockdevice_id)
+        blob.metadata[ATTACHED_METADATA] = u'vm'
+        self.api.finish_detach(volume.blockdevice_id)
+
+        self.assertEqual(
+            (u'', ({volume}, 0)),
+            (blob.metadata[ATTACHED_METADATA], self.list_volumes()))
+
+    def test_restamp(self):
+        """
+        The role recorded in the metadata of a blob azure does not lease is
+        corrected by the listing.
+        """
+        volume = self.api.create_volume(uuid4(), GiB)
+        blob = self.azure.blob('vhds', volume.blockdevice_id)
+        blob.metadata[ATTACHED_METADATA] = u'vm'
+
+        self.assertEqual(
+            (({volume}, 0), u''),
+            (self.list_volumes(), blob.metadata[ATTACHED_METADATA]))
+
+    def test_clone(self):
+        """
+        A clone is stamped with its own dataset id rather than the one of
+        the volume it was copied from.
+        """
+        volume = self.api.create_volume(uuid4(), GiB)
+        clone = self.api.clone_volume(volume.blockdevice_id, uuid4())
+
+        self.assertEqual(
+            (str(clone.dataset_id), ({volume, clone}, 0)),
+            (self.azure.blob('vhds', clone.blockdevice_id).metadata[
+                DATASET_METADATA], self.list_volumes()))
+
+    def test_streamed(self):
+        """
+        The blobs are listed one page at a time as they are consumed.
+        """
+        self.azure.page_size = 2
+        volumes = [self.api.create_volume(uuid4(), GiB) for i in range(5)]
+
+        before = self.azure.calls['list_blobs']
+        blobs = self.api._iter_flocker_blobs()
+        first = [next(blobs), next(blobs)]
+        self.assertEqual(
+            (1, set(v.blockdevice_id for v in volumes)),
+            (self.azure.calls['list_blobs'] - before,
+             set(b.name for b in first + list(blobs))))
@@ -0,0 +1,85 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for ``azure_flocker_driver.metrics``.
+"""
+
+from azure import WindowsAzureError, WindowsAzureMissingResourceError
+from eliot import MemoryLogger
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .metrics import CallMetrics, InstrumentedClient
+
+
+class FakeClient(object):
+
+    account_name = 'account'
+
+    def __init__(self, now):
+        self._now = now
+
+    def list_disks(self, elapsed=0):
+        self._now[0] += elapsed
+        return ['disk']
+
+    def get_blob_properties(self, error):
+        raise error
+
+
+class InstrumentedClientTests(SynchronousTestCase):
+    """
+    Tests for ``InstrumentedClient`` and ``CallMetrics``.
+    """
+
+    def setUp(self):
+        self.now = [0]
+        self.metrics = CallMetrics(buckets=(1, 4))
+        self.logger = MemoryLogger()
+        self.client = InstrumentedClient(
+            FakeClient(self.now), 'service', self.metrics, self.logger,
+            clock=lambda: self.now[0])
+
+    def test_histogram(self):
+        """
+        Each call is counted in the bucket of its latency.
+        """
+        for elapsed in (0.5, 1, 2, 8):
+            self.assertEqual(['disk'], self.client.list_disks(elapsed))
+        m = self.metrics.snapshot()['service.list_disks']
+        self.assertEqual(
+            (4, 11.5, 8, {'1': 2, '4': 1, '+Inf': 1}),
+            (m['count'], m['seconds'], m['max'], m['histogram']))
+
+    def test_errors(self):
+        """
+        Errors are counted by class and throttled responses separately.
+        """
+        for error in (WindowsAzureMissingResourceError('Not found'),
+                      WindowsAzureError('Unknown error (Too Many Requests)'),
+                      WindowsAzureError('Unknown error (Server Busy)')):
+            self.assertRaises(
+                type(error), self.client.get_blob_properties, error)
+        m = self.metrics.snapshot()['service.get_blob_properties']
+        self.assertEqual(
+            ({'WindowsAzureMissingResourceError': 1,
+              'WindowsAzureError': 2}, 2),
+            (m['errors'], m['throttled']))
+
+    def test_action(self):
+        """
+        Each call is logged as an eliot action naming the endpoint.
+        """
+        self.client.list_disks()
+        [start, end] = self.logger.messages
+        self.assertEqual(
+            ('azure_flocker_driver:call', 'service.list_disks', 'succeeded'),
+            (start['action_type'], start['endpoint'], end['action_status']))
+
+    def test_attributes(self):
+        """
+        Attributes which are not methods are not proxied.
+        """
+        self.assertEqual('account', self.client.account_name)
+        self.assertEqual({}, self.metrics.snapshot())
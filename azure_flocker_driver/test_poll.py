@@ -0,0 +1,225 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for ``azure_flocker_driver.poll``.
+"""
+
+from eliot import MemoryLogger
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .poll import AsynchronousTimeout, Poller
+
+
+class PollerLoggingTests(SynchronousTestCase):
+    """
+    Tests for the eliot logging of ``Poller``.
+    """
+
+    def setUp(self):
+        self.now = [0]
+        self.logger = MemoryLogger()
+        self.poller = Poller(
+            timeout=100, initial_delay=1, max_delay=1, jitter=0,
+            clock=lambda: self.now[0], sleep=self.sleep, logger=self.logger)
+
+    def sleep(self, seconds):
+        self.now[0] += seconds
+
+    def countdown(self, polls):
+        remaining = [polls]
+
+        def check():
+            remaining[0] -= 1
+            return remaining[0] == 0
+        return check
+
+    def test_sampled_polls(self):
+        """
+        Only the polls numbered by a power of two are logged and the wait
+        action reports the number of polls and its duration.
+        """
+        self.poller.wait('attach', self.countdown(20))
+        self.logger.validate()
+
+        polled = [m['polls'] for m in self.logger.messages
+                  if m.get('message_type') == 'azure_flocker_driver:polled']
+        [end] = [m for m in self.logger.messages
+                 if m.get('action_status') == 'succeeded']
+        self.assertEqual(([2, 4, 8, 16], 20, 19.0),
+                         (polled, end['polls'], end['duration']))
+
+    def test_timeout(self):
+        """
+        A wait which times out is logged as a failed action.
+        """
+        self.assertRaises(AsynchronousTimeout, self.poller.wait,
+                          'attach', lambda: False)
+        self.assertEqual(
+            'failed', self.logger.messages[-1]['action_status'])
+
+
+class PollerTests(SynchronousTestCase):
+    """
+    Tests for the backoff, deadlines, rate limit and metrics of ``Poller``.
+    """
+
+    def setUp(self):
+        self.now = [0]
+        self.sleeps = []
+
+    def sleep(self, seconds):
+        if seconds:
+            self.sleeps.append(seconds)
+        self.now[0] += seconds
+
+    def poller(self, **kwargs):
+        settings = dict(timeout=100, initial_delay=1, max_delay=5, jitter=0)
+        settings.update(kwargs)
+        return Poller(clock=lambda: self.now[0], sleep=self.sleep,
+                      **settings)
+
+    def countdown(self, polls):
+        remaining = [polls]
+
+        def check():
+            remaining[0] -= 1
+            return remaining[0] == 0
+        return check
+
+    def test_backoff(self):
+        """
+        The delay between polls doubles up to ``max_delay`` and the first
+        true value of the check is returned.
+        """
+        polls = []
+
+        def check():
+            polls.append(self.now[0])
+            return len(polls) == 6 and 'done'
+
+        self.assertEqual('done', self.poller().wait('attach', check))
+        self.assertEqual(([1, 2, 4, 5, 5], [0, 1, 3, 7, 12, 17]),
+                         (self.sleeps, polls))
+
+    def test_jitter(self):
+        """
+        The delays are spread by up to ``jitter`` of their length either
+        way.
+        """
+        draws = iter([0, 1, 0.5])
+        poller = self.poller(jitter=0.2, max_delay=100,
+                             random=lambda: next(draws))
+        poller.wait('attach', self.countdown(4))
+        self.assertEqual([0.8, 2.4, 4.0],
+                         [round(s, 6) for s in self.sleeps])
+
+    def test_deadline(self):
+        """
+        ``AsynchronousTimeout`` is raised once the wall clock deadline
+        passed, the last sleep being cut short to end on it.
+        """
+        poller = self.poller(timeout=10, initial_delay=4, max_delay=100)
+        self.assertRaises(AsynchronousTimeout, poller.wait, 'attach',
+                          lambda: False)
+        self.assertEqual(([4, 6], 10), (self.sleeps, self.now[0]))
+
+    def test_wait_timeout(self):
+        """
+        The timeout given to a wait replaces the one of the poller.
+        """
+        self.assertRaises(AsynchronousTimeout, self.poller().wait, 'copy',
+                          lambda: False, 2)
+        self.assertEqual(2, self.now[0])
+
+    def test_rate_limit(self):
+        """
+        Polls of concurrent waits are spaced by at least ``1 / max_rate``
+        seconds.
+        """
+        poller = self.poller(max_rate=2)
+        polls = []
+
+        def check():
+            polls.append(self.now[0])
+            return True
+
+        for i in range(3):
+            poller.wait('attach', check)
+        self.assertEqual([0, 0.5, 1.0], polls)
+
+    def test_stats(self):
+        """
+        The number of waits, their polls and elapsed time are counted per
+        wait name, along with those of the most recent wait.
+        """
+        poller = self.poller()
+        poller.wait('attach', self.countdown(3))
+        poller.wait('attach', self.countdown(1))
+        self.assertRaises(AsynchronousTimeout, poller.wait, 'detach',
+                          lambda: False, 0)
+        self.assertEqual(
+            {'attach': {'waits': 2, 'polls': 4, 'elapsed': 3.0,
+                        'last_polls': 1, 'last_elapsed': 0},
+             'detach': {'waits': 1, 'polls': 1, 'elapsed': 0.0,
+                        'last_polls': 1, 'last_elapsed': 0}},
+            poller.stats())
+
+    def test_retry(self):
+        """
+        The listed exceptions are retried with backoff until ``f``
+        succeeds.
+        """
+        failures = [KeyError(1), KeyError(2)]
+
+        def f():
+            if failures:
+                raise failures.pop(0)
+            return 'done'
+
+        self.assertEqual(
+            ('done', [1, 2]),
+            (self.poller().retry('attach', f, (KeyError,)), self.sleeps))
+
+    def test_retry_timeout(self):
+        """
+        The last error is raised once the deadline passed.
+        """
+        errors = iter(range(10))
+
+        def f():
+            raise KeyError(next(errors))
+
+        e = self.assertRaises(KeyError, self.poller(timeout=3).retry,
+                              'attach', f, (KeyError,))
+        self.assertEqual((KeyError(2).args, 3), (e.args, self.now[0]))
+
+    def test_retry_other_errors(self):
+        """
+        Exceptions which are not listed are raised without retrying.
+        """
+        calls = []
+
+        def f():
+            calls.append(None)
+            raise ValueError()
+
+        self.assertRaises(ValueError, self.poller().retry, 'attach', f,
+                          (KeyError,))
+        self.assertEqual(1, len(calls))
+
+    def test_retry_unretryable(self):
+        """
+        Listed exceptions ``retryable`` rejects are raised without
+        retrying.
+        """
+        calls = []
+
+        def f():
+            calls.append(None)
+            raise KeyError('permanent')
+
+        self.assertRaises(KeyError, self.poller().retry, 'attach', f,
+                          (KeyError,), lambda e: e.args != ('permanent',))
+        self.assertEqual(1, len(calls))
@@ -0,0 +1,135 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for ``azure_flocker_driver.pool``.
+"""
+
+import itertools
+import time
+from uuid import uuid4
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .fake_azure import FakeAzure
+from .pool import PoolEntry, WarmPool
+from .testtools_azure_storage_driver import fake_azure_driver
+
+GiB = 1 << 30
+
+POOLED = ('fakeaccount/vhds', GiB)
+
+
+class WarmPoolTests(SynchronousTestCase):
+    """
+    Tests for ``WarmPool``.
+    """
+
+    def setUp(self):
+        self.now = [0]
+        self.names = itertools.count()
+        self.discarded = []
+        self.pool = WarmPool(
+            kinds=[GiB, 2 * GiB], depth=2, max_age=100,
+            provision=self.provision, discard=self.discarded.append,
+            clock=lambda: self.now[0])
+
+    def provision(self, kind):
+        return PoolEntry(name=next(self.names), kind=kind, lease_id=None,
+                         created=self.now[0])
+
+    def test_claim(self):
+        """
+        Claims are served from the entries of the requested size, oldest
+        first, and counted as hits and misses.
+        """
+        self.pool.refill()
+        claimed = [self.pool.claim(GiB) for i in range(3)]
+        self.assertEqual(
+            ([0, 1], None, 2, 1),
+            ([e.name for e in claimed[:2]], claimed[2],
+             self.pool.stats()['hits'], self.pool.stats()['misses']))
+
+    def test_refill(self):
+        """
+        A refill discards the retired entries and provisions new ones.
+        """
+        self.pool.refill()
+        entry = self.pool.claim(GiB)
+        self.pool.retire(entry)
+        self.pool.refill()
+        self.assertEqual(
+            ([entry], {GiB: 2, 2 * GiB: 2}, 5),
+            (self.discarded, self.pool.stats()['available'],
+             self.pool.stats()['provisioned']))
+
+    def test_eviction(self):
+        """
+        Entries older than ``max_age`` are evicted and replaced.
+        """
+        self.pool.refill()
+        self.now[0] = 100
+        self.pool.refill()
+        self.assertEqual(
+            (4, 4, {GiB: 2, 2 * GiB: 2}),
+            (len(self.discarded), self.pool.stats()['evictions'],
+             self.pool.stats()['available']))
+
+    def test_failure(self):
+        """
+        A provisioning failure is counted and leaves the pool short until
+        the next refill.
+        """
+        def provision(size):
+            raise RuntimeError('throttled')
+        self.pool._provision = provision
+        self.pool.refill()
+        self.assertEqual(
+            (2, {GiB: 0, 2 * GiB: 0}),
+            (self.pool.stats()['failures'], self.pool.stats()['available']))
+        self.flushLoggedErrors(RuntimeError)
+
+
+class DriverWarmPoolTests(SynchronousTestCase):
+    """
+    Tests for the warm pool of ``AzureStorageBlockDeviceAPI``.
+    """
+
+    def setUp(self):
+        self.azure = FakeAzure()
+        self.api = fake_azure_driver(
+            self.azure, warm_pool_sizes=[1], warm_pool_depth=1)
+        self.addCleanup(self.api._pool.stop)
+
+    def wait_until(self, predicate):
+        deadline = time.time() + 5
+        while not predicate():
+            self.assertTrue(time.time() < deadline)
+            time.sleep(0.01)
+
+    def test_copy(self):
+        """
+        A volume of a pooled size is copied from the pool, which discards
+        the copied blob and provisions another in the background.
+        """
+        self.wait_until(
+            lambda: self.api.stats()['pool']['available'] == {POOLED: 1})
+
+        volume = self.api.create_volume(uuid4(), GiB)
+        self.wait_until(
+            lambda: self.api.stats()['pool']['available'] == {POOLED: 1} and
+            len(self.azure.container('vhds')) == 2)
+
+        self.assertEqual(
+            ([volume], 1, 1),
+            (self.api.list_volumes(), self.api.stats()['pool']['hits'],
+             self.azure.calls['copy_blob']))
+
+    def test_miss(self):
+        """
+        A volume of another size is created as a blank blob.
+        """
+        volume = self.api.create_volume(uuid4(), 2 * GiB)
+        self.assertEqual(
+            ([volume], 1),
+            (self.api.list_volumes(), self.api.stats()['pool']['misses']))
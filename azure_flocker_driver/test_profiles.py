@@ -0,0 +1,159 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for ``azure_flocker_driver.profiles`` and the volume profiles of
+``AzureStorageBlockDeviceAPI``.
+"""
+
+from uuid import uuid4
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .fake_azure import FakeAzure
+from .profiles import PREMIUM, load_profiles, premium_size
+from .testtools_azure_storage_driver import fake_azure_driver
+
+GiB = 1 << 30
+
+
+class ProfilesTests(SynchronousTestCase):
+    """
+    Tests for ``load_profiles`` and ``premium_size``.
+    """
+
+    def test_premium_size(self):
+        """
+        Sizes are rounded up to the smallest premium tier holding them,
+        sizes larger than every tier are kept.
+        """
+        self.assertEqual(
+            [128 * GiB, 128 * GiB, 512 * GiB, 2048 * GiB],
+            [premium_size(s) for s in
+             (GiB, 128 * GiB, 129 * GiB, 2048 * GiB)])
+
+    def test_load(self):
+        """
+        Configured profiles are added to the default ones.
+        """
+        profiles = load_profiles(
+            {'logs': {'tier': PREMIUM, 'host_caching': 'ReadWrite',
+                      'tier_rounding': True}})
+        self.assertEqual(
+            ([u'bronze', u'default', u'gold', u'logs', u'silver'],
+             'ReadWrite', True, False),
+            (sorted(profiles), profiles[u'logs'].host_caching,
+             profiles[u'logs'].tier_rounding,
+             profiles[u'gold'].tier_rounding))
+
+    def test_invalid(self):
+        """
+        Unknown tiers and host caching modes are rejected.
+        """
+        self.assertRaises(ValueError, load_profiles,
+                          {'logs': {'tier': 'ultra'}})
+        self.assertRaises(ValueError, load_profiles,
+                          {'logs': {'host_caching': 'WriteOnly'}})
+
+
+class DriverProfilesTests(SynchronousTestCase):
+    """
+    Tests for ``create_volume_with_profile`` and ``list_volume_profiles``.
+    """
+
+    def setUp(self):
+        self.azure = FakeAzure()
+        self.api = self.driver()
+
+    def driver(self, **config):
+        return fake_azure_driver(
+            self.azure, storage_accounts=[
+                {'storage_account_name': 'standard0',
+                 'storage_account_key': 'key',
+                 'disk_container_name': 'vhds'},
+                {'storage_account_name': 'premium0',
+                 'storage_account_key': 'key',
+                 'disk_container_name': 'vhds',
+                 'storage_account_tier': PREMIUM}],
+            profiles={'fast': {'tier': PREMIUM, 'tier_rounding': True}},
+            **config)
+
+    def host_caching(self):
+        return [d.host_caching for d in
+                self.azure.service_client.get_role(
+                    'fake-service', 'fake-service',
+                    u'vm').data_virtual_hard_disks]
+
+    def test_premium(self):
+        """
+        A premium volume is placed in the premium account and keeps its
+        size.
+        """
+        volume = self.api.create_volume_with_profile(uuid4(), GiB, u'gold')
+        self.assertEqual(
+            (GiB, [volume.blockdevice_id]),
+            (volume.size, list(self.azure.container('vhds', 'premium0'))))
+
+    def test_tier_rounding(self):
+        """
+        A volume whose profile has ``tier_rounding`` is rounded up to its
+        premium tier.
+        """
+        volume = self.api.create_volume_with_profile(uuid4(), GiB, u'fast')
+        self.assertEqual(128 * GiB, volume.size)
+
+    def test_default_premium_profile(self):
+        """
+        A volume created without a profile keeps its size, even when the
+        default profile rounds premium volumes.
+        """
+        volume = self.driver(default_profile=u'fast').create_volume(
+            uuid4(), GiB)
+        self.assertEqual(
+            (GiB, [volume.blockdevice_id]),
+            (volume.size, list(self.azure.container('vhds', 'premium0'))))
+
+    def test_standard(self):
+        """
+        A volume without a profile is placed in the standard account and
+        keeps its size.
+        """
+        volume = self.api.create_volume(uuid4(), GiB)
+        self.assertEqual(
+            (GiB, [volume.blockdevice_id]),
+            (volume.size, list(self.azure.container('vhds', 'standard0'))))
+
+    def test_host_caching(self):
+        """
+        The host caching mode of the profile is applied on every attach.
+        """
+        volume = self.api.create_volume_with_profile(uuid4(), GiB, u'bronze')
+        self.api.attach_volume(volume.blockdevice_id, u'vm')
+        first = self.host_caching()
+        self.api.detach_volume(volume.blockdevice_id)
+        self.api.attach_volume(volume.blockdevice_id, u'vm')
+        self.assertEqual((['None'], ['None']), (first, self.host_caching()))
+
+    def test_list_profiles(self):
+        """
+        The profile of each volume is listed, unknown profiles falling back
+        to the default one.
+        """
+        gold = self.api.create_volume_with_profile(uuid4(), GiB, u'gold')
+        other = self.api.create_volume_with_profile(uuid4(), GiB, u'tin')
+        self.assertEqual(
+            {gold.blockdevice_id: u'gold', other.blockdevice_id: u'default'},
+            self.api.list_volume_profiles())
+
+    def test_list_profiles_snapshot(self):
+        """
+        The profiles and the volumes they belong to are read from a single
+        inventory.
+        """
+        api = self.driver(inventory_ttl=0)
+        volume = api.create_volume_with_profile(uuid4(), GiB, u'gold')
+        before = self.azure.calls['list_disks']
+        self.assertEqual(
+            ({volume.blockdevice_id: u'gold'}, 1),
+            (api.list_volume_profiles(),
+             self.azure.calls['list_disks'] - before))
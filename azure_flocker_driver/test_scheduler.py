@@ -0,0 +1,256 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for ``azure_flocker_driver.scheduler``.
+"""
+
+import threading
+import time
+
+from twisted.internet.defer import Deferred, succeed
+from twisted.trial.unittest import SynchronousTestCase
+
+from .scheduler import DeferredOperationScheduler, OperationScheduler
+
+
+class RepeatError(Exception):
+    pass
+
+
+class OperationSchedulerTests(SynchronousTestCase):
+    """
+    Tests for ``OperationScheduler`` with operations run from threads.
+    """
+
+    def setUp(self):
+        self.now = [0]
+        self.scheduler = OperationScheduler(clock=lambda: self.now[0])
+        self.calls = []
+        self.outcomes = {}
+        self.threads = []
+        self.head = threading.Event()
+        self.addCleanup(self.head.set)
+        # the head of the queue runs until it is released
+        self.spawn('head', ('attach', u'head'), self.blocked)
+        self.wait_for_depth(1)
+
+    def blocked(self):
+        self.calls.append('head')
+        self.head.wait(10)
+        return 'head'
+
+    def operation(self, name, error=None):
+        """
+        :returns callable: An operation recording its call and returning
+            ``name`` or raising ``error``.
+        """
+        def f():
+            self.calls.append(name)
+            if error is not None:
+                raise error
+            return name
+        return f
+
+    def spawn(self, name, operation, f, repeat_error=None):
+        """
+        Run ``f`` through the scheduler in a new thread, recording the
+        result or error under ``name``.
+        """
+        def run():
+            try:
+                self.outcomes[name] = self.scheduler.run(
+                    u'service', operation, f, repeat_error)
+            except Exception as e:
+                self.outcomes[name] = e
+        t = threading.Thread(target=run)
+        t.start()
+        self.threads.append(t)
+
+    def wait_for(self, metric, value):
+        """
+        Wait until the ``metric`` of the queue reaches ``value``.
+        """
+        for i in range(1000):
+            stats = self.scheduler.stats().get(u'service', {})
+            if stats.get(metric) == value:
+                return
+            time.sleep(0.001)
+        self.fail('{} never reached {}'.format(metric, value))
+
+    def wait_for_depth(self, depth):
+        """
+        Wait until ``depth`` operations are queued or running.
+        """
+        self.wait_for('depth', depth)
+
+    def finish(self):
+        """
+        Release the head of the queue and wait for every operation.
+        """
+        self.head.set()
+        for t in self.threads:
+            t.join(10)
+
+    def test_in_order(self):
+        """
+        Operations run one at a time in the order they were queued.
+        """
+        self.spawn('first', ('detach', u'a'), self.operation('first'))
+        self.wait_for_depth(2)
+        self.spawn('second', ('detach', u'b'), self.operation('second'))
+        self.wait_for_depth(3)
+        queued = list(self.calls)
+        self.finish()
+        self.assertEqual(
+            (['head'], ['head', 'first', 'second'],
+             {'head': 'head', 'first': 'first', 'second': 'second'}),
+            (queued, self.calls, self.outcomes))
+
+    def test_repeat(self):
+        """
+        An operation identical to a queued one does not run, and raises
+        its repeat error once the queued one succeeded.
+        """
+        repeat = RepeatError()
+        self.spawn('first', ('attach', u'a'), self.operation('first'),
+                   RepeatError())
+        self.wait_for_depth(2)
+        self.spawn('second', ('attach', u'a'), self.operation('second'),
+                   repeat)
+        self.wait_for('coalesced', 1)
+        self.finish()
+        self.assertEqual(
+            (['head', 'first'], 'first', repeat),
+            (self.calls, self.outcomes['first'], self.outcomes['second']))
+
+    def test_shared_failure(self):
+        """
+        An operation identical to a queued one which fails raises the
+        same error.
+        """
+        error = ValueError()
+        self.spawn('first', ('attach', u'a'), self.operation('first', error),
+                   RepeatError())
+        self.wait_for_depth(2)
+        self.spawn('second', ('attach', u'a'), self.operation('second'),
+                   RepeatError())
+        self.wait_for('coalesced', 1)
+        self.finish()
+        self.assertEqual(
+            (['head', 'first'], error, error),
+            (self.calls, self.outcomes['first'], self.outcomes['second']))
+
+    def test_no_repeat_error(self):
+        """
+        Operations without a repeat error are never coalesced.
+        """
+        self.spawn('first', ('attach', u'a'), self.operation('first'))
+        self.wait_for_depth(2)
+        self.spawn('second', ('attach', u'a'), self.operation('second'))
+        self.wait_for_depth(3)
+        self.finish()
+        self.assertEqual(['head', 'first', 'second'], self.calls)
+
+    def test_stats(self):
+        """
+        The depth of the queue, its maximum, the operations run, the time
+        they spent queued and the operations coalesced are counted.
+        """
+        self.spawn('first', ('attach', u'a'), self.operation('first'),
+                   RepeatError())
+        self.wait_for_depth(2)
+        self.spawn('second', ('attach', u'a'), self.operation('second'),
+                   RepeatError())
+        self.wait_for('coalesced', 1)
+        self.now[0] = 5
+        queued = self.scheduler.stats()
+        self.finish()
+        self.assertEqual(
+            ({u'service': {'depth': 2, 'max_depth': 2, 'operations': 1,
+                           'wait_time': 0.0, 'coalesced': 1}},
+             {u'service': {'depth': 0, 'max_depth': 2, 'operations': 2,
+                           'wait_time': 5.0, 'coalesced': 1}}),
+            (queued, self.scheduler.stats()))
+
+
+class DeferredOperationSchedulerTests(SynchronousTestCase):
+    """
+    Tests for ``DeferredOperationScheduler``.
+    """
+
+    def setUp(self):
+        self.scheduler = DeferredOperationScheduler(clock=lambda: 0)
+        self.calls = []
+        self.head = Deferred()
+        self.scheduler.run(u'service', ('attach', u'head'),
+                           self.operation('head', self.head))
+
+    def operation(self, name, result=None):
+        """
+        :returns callable: An operation recording its call and returning
+            ``result``, a ``Deferred`` firing with ``name`` by default.
+        """
+        def f():
+            self.calls.append(name)
+            if result is None:
+                return succeed(name)
+            return result
+        return f
+
+    def test_in_order(self):
+        """
+        An operation starts once the ``Deferred`` of the operation queued
+        before it fired.
+        """
+        first = self.scheduler.run(
+            u'service', ('detach', u'a'), self.operation('first'))
+        second = self.scheduler.run(
+            u'service', ('detach', u'b'), self.operation('second'))
+        queued = list(self.calls)
+        self.head.callback('head')
+        self.assertEqual(
+            (['head'], ['head', 'first', 'second'], 'first', 'second',
+             0),
+            (queued, self.calls, self.successResultOf(first),
+             self.successResultOf(second),
+             self.scheduler.stats()[u'service']['depth']))
+
+    def test_repeat(self):
+        """
+        An operation identical to a queued one does not run, and fails
+        with its repeat error once the queued one succeeded.
+        """
+        first = self.scheduler.run(
+            u'service', ('attach', u'a'), self.operation('first'),
+            RepeatError())
+        second = self.scheduler.run(
+            u'service', ('attach', u'a'), self.operation('second'),
+            RepeatError())
+        self.head.callback('head')
+        self.failureResultOf(second, RepeatError)
+        self.assertEqual(
+            (['head', 'first'], 'first'),
+            (self.calls, self.successResultOf(first)))
+
+    def test_shared_failure(self):
+        """
+        An operation identical to a queued one which fails fails with the
+        same error, and the operations queued after them still run.
+        """
+        running = Deferred()
+        first = self.scheduler.run(
+            u'service', ('attach', u'a'), self.operation('first', running),
+            RepeatError())
+        second = self.scheduler.run(
+            u'service', ('attach', u'a'), self.operation('second'),
+            RepeatError())
+        third = self.scheduler.run(
+            u'service', ('detach', u'b'), self.operation('third'))
+        self.head.callback('head')
+        running.errback(ValueError())
+        self.failureResultOf(first, ValueError)
+        self.failureResultOf(second, ValueError)
+        self.assertEqual(
+            (['head', 'first', 'third'], 'third'),
+            (self.calls, self.successResultOf(third)))
@@ -0,0 +1,361 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for ``azure_flocker_driver.scsi``.
+"""
+
+import threading
+import time
+from uuid import uuid4
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from . import scsi
+from .lun import Lun
+from .scsi import ScsiDevices, UnknownScsiDevice
+from .testtools_azure_storage_driver import fake_azure_driver
+
+
+class FakeSysfs(object):
+    """
+    A directory laid out like the ``class/scsi_device`` part of sysfs.
+    """
+
+    def __init__(self, path):
+        self.root = FilePath(path)
+        self.root.makedirs()
+
+    def attach(self, address, name, size=None):
+        self._block(address).makedirs()
+        self._block(address).child(name).touch()
+        if size is not None:
+            block = self.root.descendant(['class', 'block', name])
+            if not block.exists():
+                block.makedirs()
+            block.child('size').setContent(str(size // 512))
+
+    def detach(self, address):
+        self.root.descendant(['class', 'scsi_device', address]).remove()
+
+    def host(self, number, driver='storvsc'):
+        """
+        Add a SCSI host driven by ``driver``.
+        """
+        host = self.root.descendant(['class', 'scsi_host', 'host%d' % number])
+        host.makedirs()
+        host.child('proc_name').setContent(driver + '\n')
+
+    def _block(self, address):
+        return self.root.descendant(
+            ['class', 'scsi_device', address, 'device', 'block'])
+
+
+class FakeMonitor(object):
+
+    def filter_by(self, subsystem):
+        self.subsystem = subsystem
+
+
+class FakeObserver(object):
+
+    def __init__(self, monitor, callback):
+        self.monitor = monitor
+        self.callback = callback
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+
+class FakePyudev(object):
+    """
+    The parts of ``pyudev`` used by ``ScsiDevices``, recording the monitors
+    opened and the observers started.
+    """
+
+    def __init__(self):
+        self.Monitor = self
+        self.monitors = []
+        self.observers = []
+
+    def Context(self):
+        return None
+
+    def from_netlink(self, context):
+        monitor = FakeMonitor()
+        self.monitors.append(monitor)
+        return monitor
+
+    def MonitorObserver(self, monitor, callback):
+        observer = FakeObserver(monitor, callback)
+        self.observers.append(observer)
+        return observer
+
+
+class ScsiDevicesTests(SynchronousTestCase):
+    """
+    Tests for ``ScsiDevices``.
+    """
+
+    def setUp(self):
+        self.sysfs = FakeSysfs(self.mktemp())
+        self.sysfs.attach('2:0:0:0', 'sda')
+        self.sysfs.attach('3:0:1:0', 'sdb')
+        self.devices = ScsiDevices(
+            sysfs=self.sysfs.root, dev=FilePath('/dev'))
+
+    def test_data_disk(self):
+        """
+        The device at a LUN of a host without system disks is returned,
+        whatever its name.
+        """
+        self.sysfs.attach('5:0:0:0', 'sde')
+        self.sysfs.attach('5:0:0:3', 'sdc')
+        self.assertEqual(
+            (FilePath('/dev/sde'), FilePath('/dev/sdc')),
+            (self.devices.device_path(0), self.devices.device_path(3)))
+
+    def test_unknown_lun(self):
+        """
+        ``UnknownScsiDevice`` is raised if nothing is attached at the LUN,
+        even if a system disk has the same LUN.
+        """
+        self.assertRaises(UnknownScsiDevice, self.devices.device_path, 0)
+
+    def test_single_host(self):
+        """
+        Only the devices of the lowest numbered host without system disks
+        are mapped, a device at the same LUN of another host is not
+        returned.
+        """
+        self.sysfs.attach('4:0:0:1', 'sdc')
+        self.sysfs.attach('5:0:0:0', 'sdd')
+        self.assertEqual(
+            FilePath('/dev/sdc'), self.devices.device_path(1))
+        self.assertRaises(UnknownScsiDevice, self.devices.device_path, 0)
+
+    def test_cdrom_host(self):
+        """
+        A device of a host which is not a VMBus SCSI host, like the IDE
+        host of the provisioning CD-ROM, is not mapped.
+        """
+        self.sysfs.host(1, 'ata_piix')
+        self.sysfs.host(5)
+        self.sysfs.attach('1:0:0:0', 'sr0')
+        self.sysfs.attach('5:0:0:0', 'sdc')
+        self.assertEqual(FilePath('/dev/sdc'), self.devices.device_path(0))
+
+    def test_configured_host(self):
+        """
+        Only the configured host is used when one is given.
+        """
+        self.sysfs.attach('4:0:0:1', 'sdc')
+        self.sysfs.attach('5:0:0:1', 'sdd')
+        devices = ScsiDevices(
+            sysfs=self.sysfs.root, dev=FilePath('/dev'), host=5)
+        self.assertEqual(FilePath('/dev/sdd'), devices.device_path(1))
+
+    def test_new_device(self):
+        """
+        A device attached after the mapping was cached is found.
+        """
+        self.sysfs.attach('5:0:0:0', 'sdc')
+        self.devices.device_path(0)
+        self.sysfs.attach('5:0:0:1', 'sdd')
+        self.assertEqual(FilePath('/dev/sdd'), self.devices.device_path(1))
+
+    def test_stale_device(self):
+        """
+        A cached device which was replaced at its LUN is not returned.
+        """
+        self.sysfs.attach('5:0:0:0', 'sdc')
+        self.devices.device_path(0)
+        self.sysfs.detach('5:0:0:0')
+        self.sysfs.attach('5:0:0:0', 'sdf')
+        self.assertEqual(FilePath('/dev/sdf'), self.devices.device_path(0))
+
+    def test_no_sysfs(self):
+        """
+        ``UnknownScsiDevice`` is raised if sysfs has no SCSI devices.
+        """
+        devices = ScsiDevices(sysfs=FilePath(self.mktemp()))
+        self.assertRaises(UnknownScsiDevice, devices.device_path, 0)
+
+
+class RescanTests(SynchronousTestCase):
+    """
+    Tests for ``ScsiDevices.rescan`` and ``ScsiDevices.wait_for_device``.
+    """
+
+    def setUp(self):
+        self.sysfs = FakeSysfs(self.mktemp())
+        self.sysfs.attach('2:0:0:0', 'sda')
+        self.sysfs.attach('3:0:1:0', 'sdb')
+        # the IDE hosts of the CD-ROM and the VMBus hosts of the system and
+        # data disks of an Azure VM
+        for host in [0, 1]:
+            self.sysfs.host(host, 'ata_piix')
+        for host in [2, 3, 5]:
+            self.sysfs.host(host)
+        self.dev = FilePath(self.mktemp())
+        self.dev.makedirs()
+        self.now = [0]
+        self.sleeps = []
+        # wait by polling sysfs rather than for real udev events
+        self.patch(scsi, 'pyudev', None)
+        self.devices = ScsiDevices(
+            sysfs=self.sysfs.root, dev=self.dev, clock=lambda: self.now[0],
+            sleep=self.sleep)
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now[0] += seconds
+
+    def scans(self):
+        return dict(
+            (host, self.sysfs.root.descendant(
+                ['class', 'scsi_host', 'host%d' % host, 'scan']).getContent())
+            for host in range(6)
+            if self.sysfs.root.descendant(
+                ['class', 'scsi_host', 'host%d' % host, 'scan']).exists())
+
+    def test_rescan_data_host(self):
+        """
+        Only the LUN is written to the scan file of the VMBus host without
+        a system disk.
+        """
+        self.devices.rescan(7)
+        self.assertEqual({5: '- - 7'}, self.scans())
+
+    def test_rescan_configured_host(self):
+        """
+        Only the configured host is rescanned when one is given.
+        """
+        ScsiDevices(sysfs=self.sysfs.root, host=5).rescan(7)
+        self.assertEqual({5: '- - 7'}, self.scans())
+
+    def test_device_path_rescan(self):
+        """
+        ``Lun.get_device_path_for_lun`` rescans a LUN without a device
+        once before looking it up again.
+        """
+        def rescan(lun):
+            self.sysfs.attach('5:0:0:%d' % lun, 'sdc')
+        self.patch(self.devices, 'rescan', rescan)
+        self.assertEqual(
+            self.dev.child('sdc'),
+            Lun.get_device_path_for_lun(2, self.devices))
+
+    def test_device_path_missing(self):
+        """
+        ``UnknownScsiDevice`` is raised if the rescan did not find a device
+        either, after writing the LUN to the scan files.
+        """
+        self.assertRaises(
+            UnknownScsiDevice, Lun.get_device_path_for_lun, 2, self.devices)
+        self.assertEqual({5: '- - 2'}, self.scans())
+
+    def test_wait_for_device(self):
+        """
+        The device is returned once it is in sysfs and its node exists.
+        """
+        def sleep(seconds):
+            self.sleep(seconds)
+            if len(self.sleeps) == 2:
+                self.sysfs.attach('5:0:0:2', 'sdc')
+            if len(self.sleeps) == 4:
+                self.dev.child('sdc').touch()
+
+        self.devices._sleep = sleep
+        self.assertEqual(
+            self.dev.child('sdc'), self.devices.wait_for_device(2, 10))
+        self.assertEqual(4, len(self.sleeps))
+
+    def test_wait_for_device_timeout(self):
+        """
+        ``UnknownScsiDevice`` is raised once the timeout has passed.
+        """
+        self.assertRaises(
+            UnknownScsiDevice, self.devices.wait_for_device, 2, 1)
+        self.assertAlmostEqual(1, self.now[0])
+
+    def test_stale_device(self):
+        """
+        A device of another size at the LUN is not returned, the wait goes
+        on until the expected disk replaced it.
+        """
+        self.sysfs.attach('5:0:0:2', 'sdc', size=2 << 30)
+        self.dev.child('sdc').touch()
+
+        def sleep(seconds):
+            self.sleep(seconds)
+            if len(self.sleeps) == 2:
+                self.sysfs.detach('5:0:0:2')
+                self.sysfs.attach('5:0:0:2', 'sdd', size=(1 << 30) - 512)
+                self.dev.child('sdd').touch()
+
+        self.devices._sleep = sleep
+        self.assertEqual(
+            self.dev.child('sdd'),
+            self.devices.wait_for_device(2, 10, size=1 << 30))
+
+
+class UdevWaitTests(SynchronousTestCase):
+    """
+    Tests for ``ScsiDevices.wait_for_device`` with ``pyudev``.
+    """
+
+    def setUp(self):
+        self.sysfs = FakeSysfs(self.mktemp())
+        self.sysfs.attach('2:0:0:0', 'sda')
+        self.sysfs.attach('3:0:1:0', 'sdb')
+        self.dev = FilePath(self.mktemp())
+        self.dev.makedirs()
+        self.pyudev = FakePyudev()
+        self.patch(scsi, 'pyudev', self.pyudev)
+        self.devices = ScsiDevices(sysfs=self.sysfs.root, dev=self.dev)
+
+    def attach(self, address, name):
+        self.sysfs.attach(address, name)
+        self.dev.child(name).touch()
+
+    def test_single_monitor(self):
+        """
+        Every wait shares one udev monitor.
+        """
+        self.attach('5:0:0:1', 'sdc')
+        self.attach('5:0:0:2', 'sdd')
+        self.devices.wait_for_device(1, 1)
+        self.devices.wait_for_device(2, 1)
+        self.assertEqual(
+            (1, 'block', [True]),
+            (len(self.pyudev.monitors), self.pyudev.monitors[0].subsystem,
+             [o.started for o in self.pyudev.observers]))
+
+    def test_lazy_monitor(self):
+        """
+        The driver opens no udev monitor until it waits for a device, so
+        nodes which never attach a volume to themselves run none.
+        """
+        api = fake_azure_driver(device_timeout=30)
+        api.attach_volume(
+            api.create_volume(uuid4(), 1 << 30).blockdevice_id,
+            api.compute_instance_id() + u'-other')
+        self.assertEqual([], self.pyudev.monitors)
+
+    def test_udev_event(self):
+        """
+        A wait wakes when udev reports the device was added.
+        """
+        def add():
+            time.sleep(0.05)
+            self.attach('5:0:0:2', 'sdc')
+            self.pyudev.observers[0].callback(None)
+
+        t = threading.Thread(target=add)
+        t.start()
+        self.addCleanup(t.join)
+        self.assertEqual(
+            self.dev.child('sdc'), self.devices.wait_for_device(2, 10))
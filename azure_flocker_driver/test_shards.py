@@ -0,0 +1,195 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for ``azure_flocker_driver.shards`` and the placement of volumes
+over several storage accounts.
+"""
+
+from uuid import uuid4
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from flocker.node.agents.blockdevice import UnknownVolume
+
+from .fake_azure import FakeAzure
+from .shards import Placement, Shard
+from .testtools_azure_storage_driver import fake_azure_driver
+
+GiB = 1 << 30
+
+ACCOUNTS = ['account0', 'account1', 'account2']
+
+
+class PlacementTests(SynchronousTestCase):
+    """
+    Tests for ``Placement``.
+    """
+
+    def setUp(self):
+        self.shards = [Shard(a, 'vhds', None) for a in ACCOUNTS]
+
+    def test_hash(self):
+        """
+        ``HASH`` places a dataset in the same shard every time and spreads
+        datasets over every shard.
+        """
+        placement = Placement(self.shards, Placement.HASH)
+        dataset_ids = [uuid4() for i in range(60)]
+        chosen = [placement.choose(d) for d in dataset_ids]
+        self.assertEqual(
+            (chosen, set(self.shards)),
+            ([placement.choose(d) for d in dataset_ids], set(chosen)))
+
+    def test_least_loaded(self):
+        """
+        ``LEAST_VOLUMES`` and ``LEAST_SIZE`` choose the shard with the
+        fewest volumes and provisioned bytes, the first one on ties.
+        """
+        loads = {'account0/vhds': (1, 8 * GiB),
+                 'account1/vhds': (2, GiB),
+                 'account2/vhds': (1, 4 * GiB)}
+        self.assertEqual(
+            (self.shards[0], self.shards[1]),
+            (Placement(self.shards, Placement.LEAST_VOLUMES).choose(
+                uuid4(), loads),
+             Placement(self.shards, Placement.LEAST_SIZE).choose(
+                 uuid4(), loads)))
+
+    def test_unknown_policy(self):
+        """
+        An unknown policy is rejected.
+        """
+        self.assertRaises(ValueError, Placement, self.shards, 'random')
+
+    def test_owns(self):
+        """
+        A shard owns the media links of the blobs of its container.
+        """
+        self.assertEqual(
+            (True, False),
+            (self.shards[1].owns(
+                'https://account1.blob.core.windows.net/vhds/flocker-1'),
+             self.shards[1].owns(
+                'https://account10.blob.core.windows.net/vhds/flocker-1')))
+
+
+class ShardedDriverTests(SynchronousTestCase):
+    """
+    Tests for an ``AzureStorageBlockDeviceAPI`` spreading volumes over
+    several storage accounts.
+    """
+
+    def setUp(self):
+        self.azure = FakeAzure()
+        self.api = fake_azure_driver(
+            self.azure, placement_policy=Placement.LEAST_VOLUMES,
+            storage_accounts=[
+                {'storage_account_name': a, 'storage_account_key': 'key',
+                 'disk_container_name': 'vhds'} for a in ACCOUNTS])
+
+    def blobs(self, account):
+        return sorted(self.azure.container('vhds', account))
+
+    def test_spread(self):
+        """
+        Volumes are spread over the accounts and listed from all of them.
+        """
+        volumes = [self.api.create_volume(uuid4(), GiB) for i in range(6)]
+
+        self.assertEqual(
+            ([2, 2, 2], set(volumes)),
+            ([len(self.blobs(a)) for a in ACCOUNTS],
+             set(self.api.list_volumes())))
+
+    def test_lifecycle(self):
+        """
+        Volumes of every account are attached, detached and destroyed.
+        """
+        volumes = [self.api.create_volume(uuid4(), GiB) for i in range(3)]
+        for v in volumes:
+            self.api.attach_volume(v.blockdevice_id, u'vm')
+        self.assertEqual(
+            [u'vm'] * 3, [v.attached_to for v in self.api.list_volumes()])
+
+        for v in volumes:
+            self.api.detach_volume(v.blockdevice_id)
+            self.api.destroy_volume(v.blockdevice_id)
+        self.assertEqual(
+            ([], [[], [], []]),
+            (self.api.list_volumes(), [self.blobs(a) for a in ACCOUNTS]))
+
+    def test_clone_placement(self):
+        """
+        A clone is placed in the account of the volume it is copied from.
+        """
+        volumes = [self.api.create_volume(uuid4(), GiB) for i in range(3)]
+        clone = self.api.clone_volume(volumes[2].blockdevice_id, uuid4())
+        self.assertIn(clone.blockdevice_id, self.blobs(ACCOUNTS[2]))
+
+    def test_streamed(self):
+        """
+        Every account is listed one page at a time, the next page of each
+        fetched together.
+        """
+        self.azure.page_size = 1
+        volumes = [self.api.create_volume(uuid4(), GiB) for i in range(6)]
+
+        before = self.azure.calls['list_blobs']
+        blobs = self.api._iter_flocker_blobs()
+        # the first page of every account
+        first = [next(blobs) for a in ACCOUNTS]
+        self.assertEqual(
+            (len(ACCOUNTS), set(v.blockdevice_id for v in volumes)),
+            (self.azure.calls['list_blobs'] - before,
+             set(b.name for b in first + list(blobs))))
+
+    def test_unconfigured_account(self):
+        """
+        A disk whose blob is in an account which is not configured, like
+        one created before the accounts were, is neither listed nor
+        managed.
+        """
+        single = fake_azure_driver(self.azure)
+        volume = single.create_volume(uuid4(), GiB)
+        single.attach_volume(volume.blockdevice_id, u'vm')
+        single.detach_volume(volume.blockdevice_id)
+
+        self.assertRaises(
+            UnknownVolume, self.api.destroy_volume, volume.blockdevice_id)
+        self.assertRaises(
+            UnknownVolume, self.api.attach_volume, volume.blockdevice_id,
+            u'vm')
+        self.assertEqual([], self.api.list_volumes())
+
+
+class TieredLookupTests(SynchronousTestCase):
+    """
+    Tests for the lookup of volumes placed among the shards of the tier of
+    their profile.
+    """
+
+    def test_hashed_lookup(self):
+        """
+        A volume placed by hash among the premium accounts is found with a
+        single probe of the hashed shards, without probing the others.
+        """
+        azure = FakeAzure()
+        accounts = [
+            {'storage_account_name': a, 'storage_account_key': 'key',
+             'disk_container_name': 'vhds'} for a in ACCOUNTS]
+        accounts += [
+            {'storage_account_name': 'premium%d' % i,
+             'storage_account_key': 'key', 'disk_container_name': 'vhds',
+             'storage_account_tier': 'premium'} for i in range(3)]
+        api = fake_azure_driver(azure, storage_accounts=accounts)
+        volumes = [api.create_volume_with_profile(uuid4(), GiB, u'gold')
+                   for i in range(6)]
+
+        probes = []
+        for v in volumes:
+            before = azure.calls['get_blob_properties']
+            fake_azure_driver(azure, storage_accounts=accounts).attach_volume(
+                v.blockdevice_id, u'vm')
+            probes.append(azure.calls['get_blob_properties'] - before)
+        self.assertTrue(max(probes) <= 3, probes)
@@ -0,0 +1,160 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for ``azure_flocker_driver.shared``.
+"""
+
+import time
+from uuid import uuid4
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .fake_azure import ACCOUNT, FakeAzure
+from .shards import Shard
+from .shared import LEASE_DURATION, SharedInventory
+from .testtools_azure_storage_driver import fake_azure_driver
+
+GiB = 1 << 30
+
+
+class SharedInventoryTests(SynchronousTestCase):
+    """
+    Tests for ``SharedInventory``.
+    """
+
+    def setUp(self):
+        self.now = [0]
+        self.azure = FakeAzure(clock=lambda: self.now[0])
+        self.volumes = [(u'flocker-1', GiB, None)]
+        self.nodes = [self.node(u'node0'), self.node(u'node1')]
+
+    def node(self, name):
+        return SharedInventory(
+            Shard(ACCOUNT, 'vhds', self.azure.storage_client), name,
+            lambda: list(self.volumes), interval=10, max_age=30,
+            clock=lambda: self.now[0])
+
+    def test_election(self):
+        """
+        One node is elected and publishes the volumes, the others read
+        them.
+        """
+        for node in self.nodes:
+            node.step()
+        snapshot = self.nodes[1].read()
+        self.assertEqual(
+            ([True, False], 1, u'node0', self.volumes),
+            ([n.is_leader for n in self.nodes], snapshot.version,
+             snapshot.leader, snapshot.volumes))
+
+    def test_versions(self):
+        """
+        The version changes with the volumes only.
+        """
+        leader = self.nodes[0]
+        leader.step()
+        leader.step()
+        self.volumes.append((u'flocker-2', GiB, u'vm'))
+        leader.step()
+        self.assertEqual(2, leader.read().version)
+
+    def test_stale(self):
+        """
+        A snapshot older than ``max_age`` is not used.
+        """
+        self.nodes[0].step()
+        self.now[0] = 31
+        self.assertEqual((None, 1), (self.nodes[1].read(),
+                                     self.nodes[1].stats()['stale']))
+
+    def test_failover(self):
+        """
+        Another node is elected once the lease of the leader expired, and
+        continues its versions.
+        """
+        self.nodes[0].step()
+        self.now[0] = LEASE_DURATION
+        for node in reversed(self.nodes):
+            node.step()
+        snapshot = self.nodes[0].read()
+        self.assertEqual(
+            ([False, True], u'node1', 1),
+            ([n.is_leader for n in self.nodes], snapshot.leader,
+             snapshot.version))
+
+    def test_release(self):
+        """
+        A stopped leader gives up its lease.
+        """
+        self.nodes[0].step()
+        self.nodes[0].stop()
+        self.nodes[1].step()
+        self.assertTrue(self.nodes[1].is_leader)
+
+
+class DriverSharedInventoryTests(SynchronousTestCase):
+    """
+    Tests for ``list_volumes`` with ``shared_inventory``.
+    """
+
+    def setUp(self):
+        self.azure = FakeAzure()
+        self.volume = fake_azure_driver(self.azure).create_volume(
+            uuid4(), GiB)
+        self.leader = self.driver()
+        self.wait_until(
+            lambda: self.leader.stats()['shared']['publications'] == 1)
+
+    def driver(self, **config):
+        api = fake_azure_driver(
+            self.azure, shared_inventory=True,
+            shared_inventory_interval=3600, **config)
+        self.addCleanup(api._shared.stop)
+        return api
+
+    def wait_until(self, predicate):
+        deadline = time.time() + 5
+        while not predicate():
+            self.assertTrue(time.time() < deadline)
+            time.sleep(0.01)
+
+    def list_volumes(self, api):
+        """
+        :returns tuple: The volumes listed and the number of Service
+            Management calls it took.
+        """
+        before = sum(self.azure.calls[m] for m in
+                     ('list_disks', 'get_deployment_by_name', 'get_role'))
+        volumes = api.list_volumes()
+        return (volumes, sum(self.azure.calls[m] for m in
+                             ('list_disks', 'get_deployment_by_name',
+                              'get_role')) - before)
+
+    def test_follower(self):
+        """
+        A follower lists the volumes published by the leader without
+        calling the Service Management API.
+        """
+        follower = self.driver()
+        self.assertEqual(([self.volume], 0), self.list_volumes(follower))
+
+    def test_own_change(self):
+        """
+        A follower lists the volumes directly until the leader saw the
+        changes it made.
+        """
+        follower = self.driver()
+        volume = follower.create_volume(uuid4(), GiB)
+        (volumes, calls) = self.list_volumes(follower)
+        self.assertEqual(({self.volume, volume}, True),
+                         (set(volumes), calls > 0))
+
+    def test_stale(self):
+        """
+        A follower lists the volumes directly when the published inventory
+        is too old.
+        """
+        follower = self.driver(shared_inventory_max_age=0)
+        (volumes, calls) = self.list_volumes(follower)
+        self.assertEqual(([self.volume], True), (volumes, calls > 0))
@@ -0,0 +1,150 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for the snapshots and clones of ``AzureStorageBlockDeviceAPI``.
+"""
+
+from uuid import uuid4
+
+from azure import WindowsAzureConflictError
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .azure_storage_driver import VolumeSnapshot
+from .fake_azure import FakeAzure
+from .poll import AsynchronousTimeout
+from .testtools_azure_storage_driver import fake_azure_driver
+from .vhd import FOOTER_SIZE
+
+GiB = 1 << 30
+
+
+class SnapshotTests(SynchronousTestCase):
+    """
+    Tests for ``snapshot_volume``, ``create_volume_from_snapshot`` and
+    ``clone_volume``.
+    """
+
+    def setUp(self):
+        self.azure = FakeAzure()
+        self.api = fake_azure_driver(self.azure)
+        self.volume = self.api.create_volume(uuid4(), GiB)
+        self.blobs = self.azure.storage_client
+
+    def write(self, blockdevice_id, data):
+        self.blobs.put_page('vhds', blockdevice_id, data,
+                            'bytes=0-%d' % (len(data) - 1), 'update')
+
+    def read(self, blockdevice_id, length):
+        return self.blobs.get_page('vhds', blockdevice_id, 0, length)
+
+    def footer(self, blockdevice_id):
+        return self.blobs.get_page('vhds', blockdevice_id, GiB, FOOTER_SIZE)
+
+    def test_create_from_snapshot(self):
+        """
+        A volume created from a snapshot holds the content of the volume
+        at the time of the snapshot, with a footer of its own.
+        """
+        self.write(self.volume.blockdevice_id, b'golden')
+        snapshot = self.api.snapshot_volume(self.volume.blockdevice_id)
+        self.write(self.volume.blockdevice_id, b'edited')
+
+        dataset_id = uuid4()
+        volume = self.api.create_volume_from_snapshot(dataset_id, snapshot)
+
+        self.assertEqual(
+            (dataset_id, GiB, None, b'golden'),
+            (volume.dataset_id, volume.size, volume.attached_to,
+             self.read(volume.blockdevice_id, 6)))
+        self.assertNotEqual(self.footer(self.volume.blockdevice_id),
+                            self.footer(volume.blockdevice_id))
+        self.assertIn(volume, self.api.list_volumes())
+
+    def test_create_from_snapshot_existing(self):
+        """
+        Creating a volume from a snapshot for a dataset which has a volume
+        already fails and leaves that volume untouched.
+        """
+        snapshot = self.api.snapshot_volume(self.volume.blockdevice_id)
+        other = self.api.create_volume(uuid4(), GiB)
+        self.write(other.blockdevice_id, b'golden')
+
+        self.assertRaises(WindowsAzureConflictError,
+                          self.api.create_volume_from_snapshot,
+                          other.dataset_id, snapshot)
+        self.assertEqual(
+            (b'golden', True),
+            (self.read(other.blockdevice_id, 6),
+             other in self.api.list_volumes()))
+
+    def test_clone(self):
+        """
+        A clone holds the current content of an attached volume and the
+        snapshot it was copied from is deleted.
+        """
+        self.api.attach_volume(self.volume.blockdevice_id, u'vm')
+        self.write(self.volume.blockdevice_id, b'golden')
+
+        volume = self.api.clone_volume(self.volume.blockdevice_id, uuid4())
+
+        self.assertEqual(
+            (b'golden', []),
+            (self.read(volume.blockdevice_id, 6),
+             self.api.list_snapshots(self.volume.blockdevice_id)))
+
+    def test_copy_wait(self):
+        """
+        Creating a volume from a snapshot waits for the copy to complete.
+        """
+        self.azure.copy_time = 0.05
+        snapshot = self.api.snapshot_volume(self.volume.blockdevice_id)
+
+        volume = self.api.create_volume_from_snapshot(uuid4(), snapshot)
+
+        properties = self.blobs.get_blob_properties(
+            'vhds', volume.blockdevice_id)
+        self.assertEqual('success', properties['x-ms-copy-status'])
+
+    def test_copy_timeout(self):
+        """
+        A copy which does not complete in time is aborted and its blob
+        deleted.
+        """
+        self.azure.copy_time = 60
+        self.api._copy_timeout = 0.05
+        snapshot = self.api.snapshot_volume(self.volume.blockdevice_id)
+
+        self.assertRaises(AsynchronousTimeout,
+                          self.api.create_volume_from_snapshot,
+                          uuid4(), snapshot)
+        self.assertEqual([self.volume], self.api.list_volumes())
+
+    def test_destroy_with_snapshots(self):
+        """
+        Destroying a volume deletes its snapshots, whether or not it is
+        registered as a disk.
+        """
+        other = self.api.create_volume(uuid4(), GiB)
+        self.api.attach_volume(other.blockdevice_id, u'vm')
+        self.api.detach_volume(other.blockdevice_id)
+        for volume in (self.volume, other):
+            self.api.snapshot_volume(volume.blockdevice_id)
+            self.api.destroy_volume(volume.blockdevice_id)
+
+        self.assertEqual(([], {}),
+                         (self.api.list_volumes(),
+                          self.azure.container('vhds')))
+
+    def test_list_snapshots(self):
+        """
+        The snapshots of a volume are listed oldest first.
+        """
+        snapshots = [self.api.snapshot_volume(self.volume.blockdevice_id)
+                     for i in range(2)]
+        self.api.delete_snapshot(snapshots[0])
+        self.assertEqual(
+            [VolumeSnapshot(self.volume.blockdevice_id,
+                            snapshots[1].snapshot)],
+            self.api.list_snapshots(self.volume.blockdevice_id))
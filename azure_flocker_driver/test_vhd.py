@@ -0,0 +1,157 @@
+# Copyright Hybrid Logic Ltd. and EMC Corporation.
+# See LICENSE file for details.
+
+"""
+Tests for ``azure_flocker_driver.vhd`` and ``azure_flocker_driver.vhdtool``.
+"""
+
+import os
+from uuid import uuid4
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .fake_azure import FakeAzure
+from .testtools_azure_storage_driver import fake_azure_driver
+from .vhd import FOOTER_SIZE, InvalidVhdFooter, Vhd
+from .vhdtool import create_fixed_vhd, verify_fixed_vhd
+
+MiB = 1024 * 1024
+
+
+class VhdFooterTests(SynchronousTestCase):
+    """
+    Tests for ``Vhd``.
+    """
+
+    def test_round_trip(self):
+        """
+        A generated footer validates and describes the requested size.
+        """
+        footer = Vhd.validate(Vhd.generate_vhd_footer(10 * MiB), 10 * MiB)
+        self.assertEqual((10 * MiB, 10 * MiB),
+                         (footer.original_size, footer.current_size))
+
+    def test_corrupt_checksum(self):
+        """
+        ``InvalidVhdFooter`` is raised if a footer byte is changed.
+        """
+        data = bytearray(Vhd.generate_vhd_footer(10 * MiB))
+        data[100] ^= 0xff
+        self.assertRaises(InvalidVhdFooter, Vhd.validate, bytes(data))
+
+    def test_compute_geometry(self):
+        """
+        The geometry of a large disk uses 16 heads and 63 sectors.
+        """
+        self.assertEqual((2080, 16, 63), Vhd.compute_geometry(1024 * MiB))
+
+    def test_compute_geometry_sizes(self):
+        """
+        Small disks use fewer heads and sectors per track, larger ones more
+        cylinders.
+        """
+        self.assertEqual(
+            [(301, 4, 17), (4161, 16, 63)],
+            [Vhd.compute_geometry(10 * MiB),
+             Vhd.compute_geometry(2048 * MiB)])
+
+
+class FixedVhdImageTests(SynchronousTestCase):
+    """
+    Tests for ``create_fixed_vhd`` and ``verify_fixed_vhd``.
+    """
+
+    def test_create_verify(self):
+        """
+        A created image is 512 bytes larger than its size and verifies.
+        """
+        path = self.mktemp()
+        create_fixed_vhd(path, 4 * MiB)
+        self.assertEqual(4 * MiB + FOOTER_SIZE, os.path.getsize(path))
+        self.assertEqual([], verify_fixed_vhd(path))
+
+    def test_geometry(self):
+        """
+        An image of a size other than 1 GiB carries the geometry computed
+        from its size.
+        """
+        path = self.mktemp()
+        footer = create_fixed_vhd(path, 10 * MiB)
+        self.assertEqual(
+            ((301, 4, 17), []),
+            ((footer.cylinders, footer.heads, footer.sectors_per_track),
+             verify_fixed_vhd(path)))
+
+    def test_unaligned_size(self):
+        """
+        Sizes which are not a whole number of MiB are rejected.
+        """
+        self.assertRaises(
+            ValueError, create_fixed_vhd, self.mktemp(), MiB + 512)
+
+    def test_truncated(self):
+        """
+        An image whose footer was cut off does not verify.
+        """
+        path = self.mktemp()
+        create_fixed_vhd(path, 4 * MiB)
+        with open(path, 'r+b') as f:
+            f.truncate(4 * MiB)
+        self.assertNotEqual([], verify_fixed_vhd(path))
+
+
+class DriverFooterTests(SynchronousTestCase):
+    """
+    Tests for the footer ``AzureStorageBlockDeviceAPI`` writes to new
+    volumes.
+    """
+
+    def setUp(self):
+        self.azure = FakeAzure()
+        self.api = fake_azure_driver(self.azure)
+
+    def download(self, blockdevice_id):
+        """
+        Copy the blob of a volume to a sparse local image.
+        :returns str: The path of the image
+        """
+        blob = self.azure.blob('vhds', blockdevice_id)
+        path = self.mktemp()
+        with open(path, 'wb') as f:
+            f.truncate(blob.content_length)
+            for (start, page) in blob.pages.items():
+                f.seek(start)
+                f.write(page)
+        return path
+
+    def test_layout(self):
+        """
+        The blob of a volume is the disk followed by a footer describing
+        it, a fixed VHD ``verify_fixed_vhd`` accepts, and the volume is
+        listed with the size requested.
+        """
+        volume = self.api.create_volume(uuid4(), 2048 * MiB)
+        path = self.download(volume.blockdevice_id)
+        footer = Vhd.parse_vhd_footer(
+            self.azure.storage_client.get_page(
+                'vhds', volume.blockdevice_id, 2048 * MiB, FOOTER_SIZE))
+        self.assertEqual(
+            ([], 2048 * MiB + FOOTER_SIZE, 2048 * MiB,
+             Vhd.compute_geometry(2048 * MiB), [volume]),
+            (verify_fixed_vhd(path), os.path.getsize(path),
+             footer.current_size,
+             (footer.cylinders, footer.heads, footer.sectors_per_track),
+             self.api.list_volumes()))
+
+    def test_legacy_layout(self):
+        """
+        A volume whose footer was written over the end of the disk is
+        still listed with the size of its blob.
+        """
+        dataset_id = uuid4()
+        self.azure.storage_client.put_blob(
+            'vhds', 'flocker-' + str(dataset_id), None, 'PageBlob',
+            x_ms_blob_content_length=1024 * MiB)
+        [volume] = self.api.list_volumes()
+        self.assertEqual((dataset_id, 1024 * MiB),
+                         (volume.dataset_id, volume.size))
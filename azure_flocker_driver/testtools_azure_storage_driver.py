@@ -9,9 +9,13 @@ import os
 import yaml
 
 from eliot import Message, Logger
+from twisted.internet import reactor
 from twisted.trial.unittest import SkipTest
 
-from .azure_storage_driver import azure_driver_from_configuration
+from .azure_storage_async_driver import AzureStorageBlockDeviceAsyncAPI
+from .azure_storage_driver import AzureStorageBlockDeviceAPI, \
+    azure_driver_from_configuration
+from .fake_azure import FakeAzure
 
 _logger = Logger()
 azure_config = None
@@ -55,3 +59,65 @@ def azure_test_driver_from_yaml(test_case):
 
     test_case.addCleanup(lambda: detach_delete_all_disks(driver))
     return driver
+
+
+def azure_test_async_driver_from_yaml(test_case):
+    """
+    Create a ``AzureStorageBlockDeviceAsyncAPI`` on top of the driver
+    returned by ``azure_test_driver_from_yaml``.
+    :returns: An instance of ``AzureStorageBlockDeviceAsyncAPI``
+    """
+    return AzureStorageBlockDeviceAsyncAPI(
+        reactor, azure_test_driver_from_yaml(test_case))
+
+
+def fake_azure_driver(azure=None, **config):
+    """
+    Create an ``AzureStorageBlockDeviceAPI`` backed by a ``FakeAzure``.
+    :param FakeAzure azure: The fake backend, a new one by default.
+    :param config: Driver settings overriding the defaults.
+    :returns: An instance of ``AzureStorageBlockDeviceAPI``
+    """
+    if azure is None:
+        azure = FakeAzure()
+
+    settings = dict(
+        service_name='fake-service',
+        storage_account_name='fakeaccount',
+        disk_container_name='vhds',
+        poll_initial_delay=0.01,
+        poll_max_delay=0.1,
+        async_timeout=60,
+        # the fake attaches no block devices to this node
+        device_timeout=0,
+        debug=False)
+    settings.update(config)
+
+    accounts = settings.get('storage_accounts') or []
+
+    return AzureStorageBlockDeviceAPI(
+        service_client=azure.service_client,
+        storage_client=azure.storage_client,
+        storage_clients=dict(
+            (a['storage_account_name'],
+             azure.blob_service(a['storage_account_name']))
+            for a in accounts),
+        **settings)
+
+
+def azure_fake_driver_for_test(test_case):
+    """
+    Create an ``AzureStorageBlockDeviceAPI`` backed by a new
+    ``FakeAzure``, so the interface tests run without a subscription.
+    :returns: An instance of ``AzureStorageBlockDeviceAPI``
+    """
+    return fake_azure_driver()
+
+
+def azure_fake_async_driver_for_test(test_case):
+    """
+    Create an ``AzureStorageBlockDeviceAsyncAPI`` backed by a new
+    ``FakeAzure``.
+    :returns: An instance of ``AzureStorageBlockDeviceAsyncAPI``
+    """
+    return AzureStorageBlockDeviceAsyncAPI(reactor, fake_azure_driver())
@@ -1,6 +1,85 @@
-import datetime
+from collections import namedtuple
+import struct
+import time
 import uuid
 
+# Fixed VHD Footer Format Specification
+# spec:
+# https://technet.microsoft.com/en-us/virtualization/bb676673.aspx#E3B
+# Field         Size (bytes)
+# Cookie        8
+# Features      4
+# Version       4
+# Data Offset   8
+# TimeStamp     4
+# Creator App   4
+# Creator Ver   4
+# CreatorHostOS 4
+# Original Size 8
+# Current Size  8
+# Disk Geo      4 (cylinders 2, heads 1, sectors per track 1)
+# Disk Type     4
+# Checksum      4
+# Unique ID     16
+# Saved State   1
+# Reserved      427
+_FOOTER = struct.Struct('>8sIIQI4sI4sQQHBBII16sB427x')
+
+FOOTER_SIZE = _FOOTER.size
+
+# offsets of the fields which differ between footers
+_TIMESTAMP_OFFSET = 24
+_SIZES_OFFSET = 40
+_GEOMETRY_OFFSET = 56
+_CHECKSUM_OFFSET = 64
+_UNIQUE_ID_OFFSET = 68
+
+# seconds between the unix epoch and january 1st 2000
+_VHD_EPOCH = 946684800
+
+# the ascii string 'conectix'
+COOKIE = b'conectix'
+# no features enabled
+FEATURES = 0x00000002
+# current file version
+VERSION = 0x00010000
+# in the case of a fixed disk, this is set to -1
+FIXED_DATA_OFFSET = 0xffffffffffffffff
+# ascii code for 'wa' = windowsazure
+CREATOR_APP = b'wa\x00\x00'
+# version of creator application
+CREATOR_VERSION = 0x00070000
+# creator host os. windows or mac, ascii for 'wi2k'
+CREATOR_OS = b'Wi2k'
+# ox820=2080 cylenders, 0x10=16 heads, 0x3f=63 sectors per cylndr,
+GEOMETRY = (0x0820, 0x10, 0x3f)
+# 0x2 = fixed hard disk
+DISK_TYPE_FIXED = 2
+
+# A footer with every constant field set and the per footer fields
+# (timestamp, sizes, checksum and unique id) zeroed.
+_TEMPLATE = _FOOTER.pack(
+    COOKIE, FEATURES, VERSION, FIXED_DATA_OFFSET, 0, CREATOR_APP,
+    CREATOR_VERSION, CREATOR_OS, 0, 0, GEOMETRY[0], GEOMETRY[1],
+    GEOMETRY[2], DISK_TYPE_FIXED, 0, b'\x00' * 16, 0)
+
+VhdFooter = namedtuple('VhdFooter', [
+    'cookie', 'features', 'version', 'data_offset', 'timestamp',
+    'creator_app', 'creator_version', 'creator_os', 'original_size',
+    'current_size', 'cylinders', 'heads', 'sectors_per_track', 'disk_type',
+    'checksum', 'unique_id', 'saved_state'])
+
+
+class InvalidVhdFooter(Exception):
+    """
+    The data is not a valid fixed VHD footer.
+    :param str reason: What is wrong with the footer
+    """
+
+    def __init__(self, reason):
+        Exception.__init__(self, reason)
+        self.reason = reason
+
 
 class Vhd(object):
 
@@ -8,119 +87,120 @@ class Vhd(object):
         return
 
     @staticmethod
-    def generate_vhd_footer(size):
+    def generate_vhd_footer(size, geometry=None):
         """
         Generate a binary VHD Footer
-        # Fixed VHD Footer Format Specification
-        # spec:
-        # https://technet.microsoft.com/en-us/virtualization/bb676673.aspx#E3B
-        # Field         Size (bytes)
-        # Cookie        8
-        # Features      4
-        # Version       4
-        # Data Offset   4
-        # TimeStamp     4
-        # Creator App   4
-        # Creator Ver   4
-        # CreatorHostOS 4
-        # Original Size 8
-        # Current Size  8
-        # Disk Geo      4
-        # Disk Type     4
-        # Checksum      4
-        # Unique ID     16
-        # Saved State   1
-        # Reserved      427
-        #
-
+        :param int size: The size of the disk in bytes
+        :param tuple geometry: The cylinders, heads and sectors per track
+            of the disk, ``GEOMETRY`` by default.
+        :returns bytes: The 512 byte footer
         """
         # TODO Are we taking any unreliable dependencies of the content of
         # the azure VHD footer?
-        footer_dict = {}
-        # the ascii string 'conectix'
-        footer_dict['cookie'] = \
-            bytearray([0x63, 0x6f, 0x6e, 0x65, 0x63, 0x74, 0x69, 0x78])
-        # no features enabled
-        footer_dict['features'] = bytearray([0x00, 0x00, 0x00, 0x02])
-        # current file version
-        footer_dict['version'] = bytearray([0x00, 0x01, 0x00, 0x00])
-        # in the case of a fixed disk, this is set to -1
-        footer_dict['data_offset'] = \
-            bytearray([0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff,
-                      0xff])
-        # hex representation of seconds since january 1st 2000
-        footer_dict['timestamp'] = Vhd._generate_timestamp()
-        # ascii code for 'wa' = windowsazure
-        footer_dict['creator_app'] = bytearray([0x77, 0x61, 0x00, 0x00])
-        # ascii code for version of creator application
-        footer_dict['creator_version'] = \
-            bytearray([0x00, 0x07, 0x00, 0x00])
-        # creator host os. windows or mac, ascii for 'wi2k'
-        footer_dict['creator_os'] = \
-            bytearray([0x57, 0x69, 0x32, 0x6b])
-        footer_dict['original_size'] = \
-            bytearray.fromhex(hex(size).replace('0x', '').zfill(16))
-        footer_dict['current_size'] = \
-            bytearray.fromhex(hex(size).replace('0x', '').zfill(16))
-        # ox820=2080 cylenders, 0x10=16 heads, 0x3f=63 sectors per cylndr,
-        footer_dict['disk_geometry'] = \
-            bytearray([0x08, 0x20, 0x10, 0x3f])
-        # 0x2 = fixed hard disk
-        footer_dict['disk_type'] = bytearray([0x00, 0x00, 0x00, 0x02])
-        # a uuid
-        footer_dict['unique_id'] = bytearray.fromhex(uuid.uuid4().hex)
-        # saved state and reserved
-        footer_dict['saved_reserved'] = bytearray(428)
-
-        footer_dict['checksum'] = Vhd._compute_checksum(footer_dict)
-
-        return bytes(Vhd._combine_byte_arrays(footer_dict))
+        footer = bytearray(_TEMPLATE)
+        struct.pack_into('>I', footer, _TIMESTAMP_OFFSET,
+                         int(time.time()) - _VHD_EPOCH)
+        struct.pack_into('>QQ', footer, _SIZES_OFFSET, size, size)
+        if geometry is not None:
+            struct.pack_into('>HBB', footer, _GEOMETRY_OFFSET, *geometry)
+        footer[_UNIQUE_ID_OFFSET:_UNIQUE_ID_OFFSET + 16] = uuid.uuid4().bytes
+
+        struct.pack_into('>I', footer, _CHECKSUM_OFFSET,
+                         Vhd._compute_checksum(footer))
+
+        return bytes(footer)
 
     @staticmethod
-    def _generate_timestamp():
-        hevVal = hex(long(datetime.datetime.now().strftime("%s")) - 946684800)
-        return bytearray.fromhex(hevVal.replace(
-            'L', '').replace('0x', '').zfill(8))
+    def parse_vhd_footer(data):
+        """
+        Decode a VHD footer.
+        :param bytes data: The 512 byte footer
+        :raises InvalidVhdFooter: If ``data`` is not 512 bytes long.
+        :returns VhdFooter: The fields of the footer
+        """
+        if len(data) != FOOTER_SIZE:
+            raise InvalidVhdFooter(
+                'Expected {} bytes, got {}'.format(FOOTER_SIZE, len(data)))
+
+        return VhdFooter(*_FOOTER.unpack(bytes(data)))
 
     @staticmethod
-    def _compute_checksum(vhd_data):
+    def validate(data, size=None):
+        """
+        Decode and verify a fixed VHD footer.
+        :param bytes data: The 512 byte footer
+        :param int size: The expected size of the disk in bytes, or
+            ``None`` to skip the size check.
+        :raises InvalidVhdFooter: If the footer is malformed, its checksum
+            does not match or it describes a different size.
+        :returns VhdFooter: The fields of the footer
+        """
+        footer = Vhd.parse_vhd_footer(data)
 
-        if 'checksum' in vhd_data:
-            del vhd_data['checksum']
+        if footer.cookie != COOKIE:
+            raise InvalidVhdFooter(
+                'Bad cookie {!r}'.format(footer.cookie))
 
-        wholeArray = Vhd._combine_byte_arrays(vhd_data)
+        if footer.disk_type != DISK_TYPE_FIXED:
+            raise InvalidVhdFooter(
+                'Not a fixed disk, disk type {}'.format(footer.disk_type))
 
-        total = 0
-        for byte in wholeArray:
-            total += byte
+        checksum = Vhd._compute_checksum(data)
+        if footer.checksum != checksum:
+            raise InvalidVhdFooter(
+                'Checksum {:#010x} does not match computed {:#010x}'.format(
+                    footer.checksum, checksum))
 
-        # ones compliment
-        total = ~total
+        if size is not None and footer.current_size != size:
+            raise InvalidVhdFooter(
+                'Footer describes {} bytes, expected {}'.format(
+                    footer.current_size, size))
 
-        def tohex(val, nbits):
-            return hex((val + (1 << nbits)) % (1 << nbits))
+        return footer
 
-        return bytearray.fromhex(tohex(total, 32).replace('0x', ''))
+    @staticmethod
+    def compute_geometry(size):
+        """
+        The CHS geometry the VHD specification assigns to a disk size.
+        :param int size: The size of the disk in bytes
+        :returns tuple: The cylinders, heads and sectors per track
+        """
+        total_sectors = min(size // 512, 65535 * 16 * 255)
+
+        if total_sectors >= 65535 * 16 * 63:
+            sectors_per_track = 255
+            heads = 16
+            cylinder_times_heads = total_sectors // sectors_per_track
+        else:
+            sectors_per_track = 17
+            cylinder_times_heads = total_sectors // sectors_per_track
+            heads = max((cylinder_times_heads + 1023) // 1024, 4)
+
+            if cylinder_times_heads >= heads * 1024 or heads > 16:
+                sectors_per_track = 31
+                heads = 16
+                cylinder_times_heads = total_sectors // sectors_per_track
+
+            if cylinder_times_heads >= heads * 1024:
+                sectors_per_track = 63
+                heads = 16
+                cylinder_times_heads = total_sectors // sectors_per_track
+
+        return (cylinder_times_heads // heads, heads, sectors_per_track)
 
     @staticmethod
-    def _combine_byte_arrays(vhd_data):
-        wholeArray = vhd_data['cookie'] \
-            + vhd_data['features'] \
-            + vhd_data['version'] \
-            + vhd_data['data_offset'] \
-            + vhd_data['timestamp'] \
-            + vhd_data['creator_app'] \
-            + vhd_data['creator_version'] \
-            + vhd_data['creator_os'] \
-            + vhd_data['original_size'] \
-            + vhd_data['current_size'] \
-            + vhd_data['disk_geometry'] \
-            + vhd_data['disk_type']
-
-        if 'checksum' in vhd_data:
-            wholeArray += vhd_data['checksum']
-
-        wholeArray += vhd_data['unique_id'] \
-            + vhd_data['saved_reserved']
-
-        return wholeArray
+    def _compute_checksum(footer):
+        """
+        The ones complement of the sum of the footer bytes, excluding the
+        checksum field.
+        :param footer: The 512 byte footer, as ``bytes`` or ``bytearray``
+        :returns int: The checksum
+        """
+        view = footer
+        if not isinstance(view, bytearray):
+            view = bytearray(footer)
+        total = sum(view) - sum(
+            view[_CHECKSUM_OFFSET:_CHECKSUM_OFFSET + 4])
+
+        # ones compliment
+        return ~total & 0xffffffff
@@ -0,0 +1,157 @@
+"""
+Create, verify and inspect Azure compatible fixed VHD images locally.
+
+Images are created as sparse files, so preparing a multi GB image only
+writes its 512 byte footer.
+"""
+
+from argparse import ArgumentParser
+import os
+import subprocess
+import sys
+
+from bitmath import parse_string
+
+from vhd import FOOTER_SIZE, InvalidVhdFooter, Vhd
+
+# azure requires the virtual size of a VHD to be a whole number of MiB
+SIZE_ALIGNMENT = 1024 * 1024
+
+
+def create_fixed_vhd(path, size, preallocate=False):
+    """
+    Create a fixed VHD image as a sparse file.
+    :param str path: The path of the image to create
+    :param int size: The virtual size of the disk in bytes, the file is
+        512 bytes larger.
+    :param bool preallocate: Reserve the blocks of the image with
+        ``fallocate`` rather than leaving the file sparse.
+    :raises ValueError: If ``size`` is not a whole number of MiB.
+    :returns VhdFooter: The footer written to the image
+    """
+    if size <= 0 or size % SIZE_ALIGNMENT != 0:
+        raise ValueError(
+            'VHD size must be a positive multiple of 1 MiB, got {}'.format(
+                size))
+
+    footer = Vhd.generate_vhd_footer(size, Vhd.compute_geometry(size))
+
+    with open(path, 'wb') as f:
+        f.truncate(size + FOOTER_SIZE)
+        f.seek(size)
+        f.write(footer)
+
+    if preallocate:
+        subprocess.check_call(
+            ['fallocate', '--keep-size', '-l', str(size), path])
+
+    return Vhd.parse_vhd_footer(footer)
+
+
+def read_footer(path):
+    """
+    :param str path: The path of the image
+    :raises InvalidVhdFooter: If the file is too small to hold a footer.
+    :returns bytes: The last 512 bytes of the image
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() < FOOTER_SIZE:
+            raise InvalidVhdFooter(
+                'File is smaller than a {} byte footer'.format(FOOTER_SIZE))
+        f.seek(-FOOTER_SIZE, os.SEEK_END)
+        return f.read(FOOTER_SIZE)
+
+
+def verify_fixed_vhd(path):
+    """
+    Check the footer, size and geometry of a fixed VHD image.
+    :param str path: The path of the image
+    :returns list: A description of every problem found, empty if the
+        image is a valid Azure fixed VHD.
+    """
+    try:
+        footer = Vhd.validate(read_footer(path))
+    except InvalidVhdFooter as e:
+        return [e.reason]
+
+    problems = []
+    file_size = os.path.getsize(path)
+
+    if file_size != footer.current_size + FOOTER_SIZE:
+        problems.append(
+            'File is {} bytes but the footer describes {} bytes plus a {} '
+            'byte footer'.format(
+                file_size, footer.current_size, FOOTER_SIZE))
+
+    if footer.current_size % SIZE_ALIGNMENT != 0:
+        problems.append(
+            'Size {} is not a multiple of 1 MiB'.format(footer.current_size))
+
+    geometry = (footer.cylinders, footer.heads, footer.sectors_per_track)
+    expected = Vhd.compute_geometry(footer.current_size)
+    if geometry != expected:
+        problems.append(
+            'Geometry {} does not match {} computed from the size'.format(
+                geometry, expected))
+
+    return problems
+
+
+def _parse_size(value):
+    try:
+        return int(value)
+    except ValueError:
+        return int(parse_string(value).to_Byte().value)
+
+
+def main(argv=None):
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command')
+
+    create = commands.add_parser('create', help='create a sparse fixed VHD')
+    create.add_argument('path')
+    create.add_argument('size', type=_parse_size,
+                        help='virtual size, in bytes or like 10GiB')
+    create.add_argument('--preallocate', action='store_true',
+                        help='allocate the blocks with fallocate')
+
+    verify = commands.add_parser('verify', help='verify fixed VHD images')
+    verify.add_argument('paths', nargs='+')
+
+    inspect = commands.add_parser('inspect', help='print a VHD footer')
+    inspect.add_argument('path')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'create':
+        create_fixed_vhd(args.path, args.size, args.preallocate)
+        return 0
+
+    if args.command == 'verify':
+        status = 0
+        for path in args.paths:
+            problems = verify_fixed_vhd(path)
+            for problem in problems:
+                print('{}: {}'.format(path, problem))
+            if problems:
+                status = 1
+            else:
+                print('{}: OK'.format(path))
+        return status
+
+    footer = Vhd.parse_vhd_footer(read_footer(args.path))
+    for (name, value) in zip(footer._fields, footer):
+        if name == 'unique_id':
+            value = value.encode('hex')
+        elif isinstance(value, bytes):
+            value = value.rstrip(b'\x00')
+        elif name in ('checksum', 'data_offset', 'features', 'version',
+                      'creator_version'):
+            value = '{:#x}'.format(value)
+        print('{:<18} {}'.format(name, value))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
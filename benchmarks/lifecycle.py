@@ -0,0 +1,214 @@
+"""
+Benchmark of the volume lifecycle against ``FakeAzure``.
+
+Creates, attaches, lists, detaches and destroys 10, 100 and 1000 volumes
+and reports, for each operation, the wall time and the number of Service
+Management and Blob service calls it made. Results can be written as JSON
+and compared with an earlier run to catch regressions.
+
+Usage: python benchmarks/lifecycle.py [--counts 10,100] [--latency 0.001]
+           [--output results.json] [--compare baseline.json]
+"""
+
+from argparse import ArgumentParser
+from collections import Counter
+import json
+import os
+import platform
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from azure_flocker_driver.fake_azure import FakeAzure, \
+    FakeBlobService  # noqa
+from azure_flocker_driver.lun import LUN_SLOTS  # noqa
+from azure_flocker_driver.testtools_azure_storage_driver import \
+    fake_azure_driver  # noqa
+
+GiB = 1024 * 1024 * 1024
+
+BLOB_METHODS = frozenset(
+    name for name in dir(FakeBlobService) if not name.startswith('_'))
+
+# how many times list_volumes is timed at each volume count
+LIST_REPEATS = 5
+
+
+class Recorder(object):
+    """
+    Accumulates the wall time and Azure calls of each operation.
+    """
+
+    def __init__(self, azure):
+        self._azure = azure
+        self.operations = {}
+
+    def run(self, name, f, *args):
+        before = Counter(self._azure.calls)
+        start = time.time()
+        result = f(*args)
+        elapsed = time.time() - start
+        calls = Counter(self._azure.calls)
+        calls.subtract(before)
+
+        m = self.operations.setdefault(
+            name, {'count': 0, 'seconds': 0.0, 'calls': Counter()})
+        m['count'] += 1
+        m['seconds'] += elapsed
+        m['calls'].update(calls)
+        return result
+
+    def results(self):
+        results = {}
+        for (name, m) in self.operations.items():
+            count = m['count']
+            calls = dict((method, n) for (method, n) in m['calls'].items()
+                         if n)
+            blob_calls = sum(n for (method, n) in calls.items()
+                             if method in BLOB_METHODS)
+            results[name] = {
+                'count': count,
+                'seconds': m['seconds'],
+                'seconds_per_op': m['seconds'] / count,
+                'service_calls_per_op':
+                    float(sum(calls.values()) - blob_calls) / count,
+                'blob_calls_per_op': float(blob_calls) / count,
+                'calls': calls,
+            }
+        return results
+
+
+def lifecycle(count, latency, operation_time, inventory_ttl,
+              metadata_listing=False):
+    """
+    Run every lifecycle operation ``count`` times.
+    :returns dict: The results of ``Recorder`` for each operation.
+    """
+    azure = FakeAzure(latency=latency, operation_time=operation_time)
+    api = fake_azure_driver(azure, inventory_ttl=inventory_ttl,
+                            metadata_listing=metadata_listing)
+    recorder = Recorder(azure)
+
+    volumes = [recorder.run('create_volume', api.create_volume,
+                            uuid.uuid4(), GiB)
+               for i in range(count)]
+
+    for (i, volume) in enumerate(volumes):
+        # a role has only LUN_SLOTS slots
+        recorder.run('attach_volume', api.attach_volume,
+                     volume.blockdevice_id,
+                     u'bench-%d' % (i // LUN_SLOTS))
+
+    for i in range(LIST_REPEATS):
+        recorder.run('list_volumes', api.list_volumes)
+
+    for volume in volumes:
+        recorder.run('detach_volume', api.detach_volume,
+                     volume.blockdevice_id)
+
+    for volume in volumes:
+        recorder.run('destroy_volume', api.destroy_volume,
+                     volume.blockdevice_id)
+
+    return recorder.results()
+
+
+def compare(baseline, results, threshold):
+    """
+    :returns list: A description of each operation which got slower by
+        more than ``threshold``, or makes more calls, than in
+        ``baseline``.
+    """
+    regressions = []
+    for (count, operations) in sorted(results.items()):
+        for (name, new) in sorted(operations.items()):
+            old = baseline.get(count, {}).get(name)
+            if old is None:
+                continue
+
+            for key in ('service_calls_per_op', 'blob_calls_per_op'):
+                if new[key] > old[key]:
+                    regressions.append('{} x{}: {} {:.2f} -> {:.2f}'.format(
+                        name, count, key, old[key], new[key]))
+
+            if new['seconds_per_op'] > \
+                    old['seconds_per_op'] * (1 + threshold):
+                regressions.append(
+                    '{} x{}: seconds_per_op {:.6f} -> {:.6f}'.format(
+                        name, count, old['seconds_per_op'],
+                        new['seconds_per_op']))
+    return regressions
+
+
+def report(results):
+    print('{:>6} {:<16} {:>12} {:>10} {:>8}  {}'.format(
+        'volumes', 'operation', 'ms/op', 'service', 'blob',
+        'calls per op'))
+    for (count, operations) in sorted(results.items(),
+                                      key=lambda r: int(r[0])):
+        for (name, r) in sorted(operations.items()):
+            calls = ', '.join(
+                '{} {:.2f}'.format(method, float(n) / r['count'])
+                for (method, n) in sorted(r['calls'].items()))
+            print('{:>6} {:<16} {:>12.3f} {:>10.2f} {:>8.2f}  {}'.format(
+                count, name, r['seconds_per_op'] * 1000,
+                r['service_calls_per_op'], r['blob_calls_per_op'], calls))
+
+
+def main(argv=None):
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--counts', default='10,100,1000',
+                        help='comma separated volume counts')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds added to every Azure call')
+    parser.add_argument('--operation-time', type=float, default=0,
+                        help='seconds an asynchronous operation takes')
+    parser.add_argument('--inventory-ttl', type=float, default=5,
+                        help='inventory cache ttl of the driver, 0 to '
+                             'measure uncached listings')
+    parser.add_argument('--metadata-listing', action='store_true',
+                        help='list volumes from the metadata of their '
+                             'blobs')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--compare',
+                        help='a results file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='tolerated slowdown, 0.2 is 20%%')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for count in args.counts.split(','):
+        results[count] = lifecycle(
+            int(count), args.latency, args.operation_time,
+            args.inventory_ttl, args.metadata_listing)
+    report(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'time': time.time(),
+                'python': platform.python_version(),
+                'latency': args.latency,
+                'operation_time': args.operation_time,
+                'inventory_ttl': args.inventory_ttl,
+                'metadata_listing': args.metadata_listing,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(baseline, results, args.threshold)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
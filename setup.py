@@ -32,6 +32,11 @@ setup(
     keywords='backend, plugin, flocker, docker, python',
     packages=find_packages(exclude=['test*']),
     install_requires = ['azure', 'bitmath', 'eliot'],
+    entry_points={
+        'console_scripts': [
+            'azure-flocker-vhd = azure_flocker_driver.vhdtool:main',
+        ],
+    },
     data_files=[('/etc/flocker/', ['DESCRIPTION.rst']),
                 ('/etc/flocker/', ['azure_storage_test.yml'])]
 )
\ No newline at end of file